@@ -0,0 +1,140 @@
+"""聊天室共用的核心模組。
+
+套件層級的名稱在第一次取用時才載入所屬的子模組：pandas、scikit-learn、Gemini SDK 等重量級套件
+只在真正用到的功能第一次被呼叫時載入，``import chat_core`` 本身幾乎不花時間。
+"""
+import importlib
+
+_EXPORTS = {
+    "app": ("AppConfig", "prewarm", "run_app", "start_prewarm"),
+    "charts": ("CHART_KIND_NAMES", "CHART_KINDS", "ChartError", "ChartResult", "get_chart"),
+    "client": ("MODEL_NAME", "ModelRegistry", "get_registry", "hash_api_key", "set_registry"),
+    "context": ("ContextManager", "get_context_manager"),
+    "executor": (
+        "ANSWER_TIMEOUT", "TITLE_TIMEOUT", "TimedCall", "dispatch", "generate_title",
+        "generate_title_async", "get_executor",
+    ),
+    "fake": ("FakeGenerativeModel", "FakeModelRegistry"),
+    "ingest": (
+        "FrameCache", "IngestError", "IngestProgress", "content_hash", "get_frame_cache", "load_csv",
+        "optimize_dtypes",
+    ),
+    "modeling": ("ModelingError", "Prediction", "fit_model", "get_fitted_model"),
+    "pipeline": ("prepare_data", "prepare_data_async"),
+    "profiling": ("ColumnProfile", "DatasetProfile", "build_profile", "get_profile"),
+    "prompts": (
+        "build_answer_prompt", "build_title_prompt", "clean_title", "data_section", "estimate_tokens",
+        "heuristic_title",
+    ),
+    "query": (
+        "QueryError", "QueryResult", "plan_and_run", "plan_and_run_async", "replay_chart", "run_query",
+        "validate_spec",
+    ),
+    "render": ("HISTORY_PAGE_SIZE", "TOPIC_PAGE_SIZE", "turn_markdown"),
+    "response_cache": ("CachedResponse", "ResponseCache", "get_response_cache", "normalize_text", "scoped_context"),
+    "retrieval": ("RetrievedRows", "RowIndex", "get_row_index", "relevant_rows"),
+    "scheduler": ("RequestScheduler", "get_scheduler", "set_session"),
+    "store": ("ConversationStore", "Summary", "Topic", "Turn", "get_conversation_store"),
+    "streaming": ("GenerationResult", "format_timing", "generate_text", "generate_text_async"),
+    "tracing": ("Tracer", "get_tracer", "span", "start_trace"),
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = [
+    "ANSWER_TIMEOUT",
+    "AppConfig",
+    "CHART_KINDS",
+    "CHART_KIND_NAMES",
+    "CachedResponse",
+    "ChartError",
+    "ChartResult",
+    "ColumnProfile",
+    "ContextManager",
+    "ConversationStore",
+    "DatasetProfile",
+    "FakeGenerativeModel",
+    "FakeModelRegistry",
+    "FrameCache",
+    "HISTORY_PAGE_SIZE",
+    "IngestError",
+    "IngestProgress",
+    "MODEL_NAME",
+    "TITLE_TIMEOUT",
+    "TOPIC_PAGE_SIZE",
+    "GenerationResult",
+    "ModelRegistry",
+    "ModelingError",
+    "Prediction",
+    "QueryError",
+    "QueryResult",
+    "RequestScheduler",
+    "ResponseCache",
+    "RetrievedRows",
+    "RowIndex",
+    "Summary",
+    "TimedCall",
+    "Topic",
+    "Tracer",
+    "Turn",
+    "build_answer_prompt",
+    "build_profile",
+    "build_title_prompt",
+    "clean_title",
+    "content_hash",
+    "data_section",
+    "dispatch",
+    "estimate_tokens",
+    "fit_model",
+    "format_timing",
+    "generate_text",
+    "generate_text_async",
+    "generate_title",
+    "generate_title_async",
+    "get_chart",
+    "get_context_manager",
+    "get_conversation_store",
+    "get_executor",
+    "get_fitted_model",
+    "get_frame_cache",
+    "get_profile",
+    "get_registry",
+    "get_response_cache",
+    "get_row_index",
+    "get_scheduler",
+    "get_tracer",
+    "hash_api_key",
+    "heuristic_title",
+    "load_csv",
+    "normalize_text",
+    "optimize_dtypes",
+    "plan_and_run",
+    "prewarm",
+    "plan_and_run_async",
+    "prepare_data",
+    "prepare_data_async",
+    "relevant_rows",
+    "replay_chart",
+    "run_app",
+    "run_query",
+    "scoped_context",
+    "set_registry",
+    "set_session",
+    "span",
+    "start_prewarm",
+    "start_trace",
+    "turn_markdown",
+    "validate_spec",
+]
+
+
+def __getattr__(name):
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
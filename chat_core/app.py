@@ -0,0 +1,607 @@
+"""Streamlit 聊天室頁面：open.py、Open -1.py、open -2.py 共用同一份實作，差異由 AppConfig 決定。
+
+* ``default_csv``：沒有上傳檔案時改用的預設 CSV（open -2.py 為 ShoeSize.csv）。
+* ``key_validation``：``on_use`` 在第一次使用時才驗證金鑰；``on_input`` 在輸入時立即驗證，通過才儲存。
+* ``prompt_style``：``topic`` 以主題、對話脈絡與資料段落組成提示詞；``plain`` 把資料直接放在問題前面。
+
+頁面一開始只載入顯示側邊欄所需的輕量模組；pandas、scikit-learn、Gemini SDK 等在用到時才載入。
+``prewarm`` 在背景預先載入這些模組、建立並驗證模型、讀入預設資料並建好資料概況與列索引，
+第一位使用者輸入金鑰、送出問題時就不必等待。以下指令在啟動 Streamlit 的同時開始預熱::
+
+    python -m chat_core.app --preset open-2 --server.port 8501
+"""
+import argparse
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+import streamlit as st
+
+from .client import MODEL_NAME, get_registry, load_genai
+from .context import get_context_manager
+from .executor import ANSWER_TIMEOUT, TITLE_TIMEOUT, dispatch, generate_title
+from .prompts import build_answer_prompt, data_section, heuristic_title
+from .render import HISTORY_PAGE_SIZE, TOPIC_PAGE_SIZE, turn_markdown
+from .response_cache import get_response_cache, scoped_context
+from .scheduler import get_scheduler, set_session
+from .store import get_conversation_store
+from .streaming import generate_text
+from .tracing import get_tracer, span, start_trace
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_SCRIPT = ROOT / "open.py"
+# 預熱時載入的模組：資料處理、查詢、預測、畫圖與列索引用到的重量級套件
+PREWARM_MODULES = (
+    "pandas",
+    "chat_core.pipeline",
+    "chat_core.ingest",
+    "chat_core.charts",
+    "chat_core.modeling",
+    "plotly.graph_objects",
+    "scipy.sparse",
+    "sklearn.compose",
+    "sklearn.feature_extraction.text",
+    "sklearn.impute",
+    "sklearn.linear_model",
+    "sklearn.metrics",
+    "sklearn.model_selection",
+    "sklearn.neighbors",
+    "sklearn.pipeline",
+    "sklearn.preprocessing",
+)
+
+
+# ============================================
+# 可替換的行為
+# ============================================
+class TopicPrompt:
+    """open.py 的提示詞：主題、對話脈絡、資料段落，最後是問題；回覆快取也依主題區分。"""
+
+    def cache_context(self, topic_title, history_text):
+        return f"主題是「{topic_title}」。" + history_text
+
+    def build(self, topic_title, question, history_text, profile, query_result, rows):
+        return build_answer_prompt(topic_title, question, history_text, data_section(profile, query_result, rows))
+
+
+class PlainPrompt:
+    """open -2.py 的提示詞：不帶主題，查詢結果或資料概況直接放在問題前面。"""
+
+    def cache_context(self, topic_title, history_text):
+        return history_text
+
+    def build(self, topic_title, question, history_text, profile, query_result, rows):
+        prompt = question
+        if query_result is not None:
+            prompt = f"{query_result.to_prompt().lstrip()}\n\n根據這些結果，{question}"
+        elif profile is not None:
+            rows_text = rows.to_prompt() if rows is not None else ""
+            prompt = f"以下是使用者提供的 CSV 資料概況：\n{profile.to_text()}{rows_text}\n\n根據這些資料，{question}"
+        if history_text:
+            prompt = f"{history_text}\n\n{prompt}"
+        return prompt
+
+
+def _key_on_use():
+    """金鑰輸入後先存起來，建立模型時才驗證（同一把金鑰只驗證一次）。"""
+    with st.sidebar:
+        st.markdown("## 🔐 API 設定")
+        st.session_state.remember_api = st.checkbox("記住 API 金鑰", value=st.session_state.remember_api)
+
+        if st.session_state.remember_api and st.session_state.api_key:
+            api_key_input = st.session_state.api_key
+            st.success("✅ 已使用儲存的 API Key")
+        else:
+            api_key_input = st.text_input("請輸入 Gemini API 金鑰", type="password")
+
+        if api_key_input and api_key_input != st.session_state.api_key:
+            st.session_state.api_key = api_key_input
+
+    if not st.session_state.api_key:
+        st.info("⚠️ 請在左側輸入 API 金鑰後開始使用。")
+        st.stop()
+    try:
+        # 同一把金鑰只在第一次使用時驗證，之後的 rerun 直接取用快取的模型
+        return get_registry().get_model(st.session_state.api_key)
+    except Exception as e:
+        st.error(f"❌ API 金鑰驗證失敗或無效：{e}")
+        st.stop()
+
+
+def _key_on_input():
+    """輸入金鑰時立即驗證並在側邊欄顯示結果，驗證通過才儲存。"""
+    with st.sidebar:
+        st.markdown("## 🔐 API 設定")
+        st.session_state.remember_api = st.checkbox("記住 API 金鑰", value=st.session_state.remember_api)
+        api_status_placeholder = st.empty()
+
+        if st.session_state.remember_api and st.session_state.api_key:
+            api_status_placeholder.success("✅ 已使用儲存的 API 金鑰")
+        else:
+            api_key_input = st.text_input("請輸入 Gemini API 金鑰", type="password")
+            if api_key_input and api_key_input != st.session_state.api_key:
+                api_status_placeholder.info("⏳ 正在驗證金鑰，請稍候...")
+                try:
+                    get_registry().get_model(api_key_input)
+                    st.session_state.api_key = api_key_input
+                    api_status_placeholder.success("✅ 金鑰驗證成功，已儲存！")
+                except Exception as e:
+                    api_status_placeholder.error(f"❌ 金鑰無效或錯誤：{e}")
+                    st.stop()
+
+    if not st.session_state.api_key:
+        st.info("⚠️ 請在左側輸入有效的 API 金鑰。")
+        st.stop()
+    # 已驗證的金鑰直接命中快取，不會再發出網路請求
+    return get_registry().get_model(st.session_state.api_key)
+
+
+PROMPT_STYLES = {"topic": TopicPrompt(), "plain": PlainPrompt()}
+KEY_VALIDATION = {"on_use": _key_on_use, "on_input": _key_on_input}
+
+
+# ============================================
+# 設定
+# ============================================
+@dataclass(frozen=True)
+class AppConfig:
+    name: str = "open"
+    page_title: str = "Gemini 聊天室"
+    title: str = "🤖 Gemini AI 聊天室"
+    default_csv: str | None = None  # 沒有上傳檔案時改用的 CSV；None 表示不使用預設檔案
+    key_validation: str = "on_use"
+    prompt_style: str = "topic"
+    prewarm: bool = True            # 第一次執行時在背景預熱（見 prewarm）
+
+    def __post_init__(self):
+        if self.key_validation not in KEY_VALIDATION:
+            raise ValueError(f"key_validation 必須是 {sorted(KEY_VALIDATION)} 之一：{self.key_validation}")
+        if self.prompt_style not in PROMPT_STYLES:
+            raise ValueError(f"prompt_style 必須是 {sorted(PROMPT_STYLES)} 之一：{self.prompt_style}")
+
+    @classmethod
+    def from_env(cls, preset="open"):
+        """以 ``preset`` 為基礎（可由 ``CHAT_APP_PRESET`` 覆寫），再套用 ``CHAT_DEFAULT_CSV``、
+        ``CHAT_KEY_VALIDATION``、``CHAT_PROMPT_STYLE``、``CHAT_PREWARM``（0 關閉）等環境變數。"""
+        base = PRESETS[os.getenv("CHAT_APP_PRESET", preset)]
+        overrides = {}
+        if "CHAT_DEFAULT_CSV" in os.environ:
+            overrides["default_csv"] = os.environ["CHAT_DEFAULT_CSV"] or None
+        if os.getenv("CHAT_KEY_VALIDATION"):
+            overrides["key_validation"] = os.environ["CHAT_KEY_VALIDATION"]
+        if os.getenv("CHAT_PROMPT_STYLE"):
+            overrides["prompt_style"] = os.environ["CHAT_PROMPT_STYLE"]
+        if os.getenv("CHAT_PREWARM"):
+            overrides["prewarm"] = os.environ["CHAT_PREWARM"] != "0"
+        return replace(base, **overrides)
+
+
+PRESETS = {
+    "open": AppConfig(),
+    "open-2": AppConfig(name="open-2", default_csv="ShoeSize.csv", key_validation="on_input", prompt_style="plain"),
+}
+# 各腳本傳給 AppConfig.from_env 的設定組；main() 預熱時用同一組，才會與腳本的設定一致
+SCRIPT_PRESETS = {"open.py": "open", "Open -1.py": "open", "open -2.py": "open-2"}
+
+
+# ============================================
+# 預熱
+# ============================================
+def _env_api_key():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+
+
+def prewarm(config, api_key=None):
+    """在第一位使用者連線前做好耗時的準備，回傳成功步驟的耗時（秒）；任何一步失敗都只記錄在日誌，不影響頁面。
+
+    載入重量級模組與 Gemini SDK；有金鑰（參數或 ``GEMINI_API_KEY`` / ``GOOGLE_API_KEY``）時建立並驗證模型；
+    有預設 CSV 時讀入資料並建好資料概況與列索引。結果都存在程序層級的快取中，之後的 session 直接取用。
+    """
+    timings = {}
+    trace = start_trace("prewarm", app=config.name)
+
+    def step(name, fn):
+        # 失敗的步驟記在日誌裡，不列入耗時，否則看起來像是已經準備好
+        start = time.perf_counter()
+        try:
+            with span(f"prewarm_{name}"):
+                fn()
+        except Exception:
+            logger.warning("預熱步驟 %s 失敗", name, exc_info=True)
+            return
+        timings[name] = time.perf_counter() - start
+
+    def load_dataset():
+        from .ingest import load_csv
+        from .profiling import get_profile
+        from .retrieval import get_row_index
+
+        df, dataset_hash = load_csv(config.default_csv)
+        get_profile(df, dataset_hash)
+        get_row_index(df, dataset_hash)
+
+    step("imports", lambda: [importlib.import_module(name) for name in PREWARM_MODULES])
+    step("sdk", load_genai)
+    api_key = api_key or _env_api_key()
+    if api_key:
+        step("model", lambda: get_registry().get_model(api_key))
+    if config.default_csv and os.path.exists(config.default_csv):
+        step("dataset", load_dataset)
+    trace.end()
+    return timings
+
+
+_prewarm_threads = {}
+_prewarm_lock = threading.Lock()
+
+
+def start_prewarm(config, api_key=None):
+    """在背景執行緒預熱並回傳該執行緒；同一個程序中同一份設定只預熱一次，之後回傳同一個執行緒。"""
+    key = (config.default_csv, os.getcwd())
+    with _prewarm_lock:
+        thread = _prewarm_threads.get(key)
+        if thread is None:
+            thread = threading.Thread(target=prewarm, args=(config, api_key), name="prewarm", daemon=True)
+            _prewarm_threads[key] = thread
+            thread.start()
+        return thread
+
+
+# ============================================
+# 頁面
+# ============================================
+_default_state = {
+    "api_key": "",
+    "remember_api": False,
+    "current_topic": "new",     # 預設為新對話；其他值為聊天紀錄資料庫中的主題 id
+    "topic_page": 0,            # 側邊欄主題清單目前頁數
+    "history_window": HISTORY_PAGE_SIZE,  # 目前主題顯示最近幾輪對話
+    "history_topic": None,      # history_window 所屬的主題
+    "uploaded_df": None,        # 上傳的 CSV DataFrame
+    "dataset_hash": None,       # 目前資料的內容雜湊
+    "stream_mode": True,        # 串流顯示回覆
+    "query_mode": True,         # 以完整資料計算後再回答
+    "cache_mode": True,         # 相同問題直接使用快取回覆
+    "diagnostics_mode": False,  # 側邊欄顯示各階段耗時
+    "chart_mode": False,        # 資料下方顯示圖表
+}
+
+
+def _data_section(config):
+    """CSV 上傳（或預設檔案）、資料概況與圖表；回傳這次 rerun 讀到的 DataFrame（沒有時為 None）。"""
+    # 用到資料時才載入 pandas 等套件（預熱過就已在記憶體中）
+    from .charts import CHART_KIND_NAMES, CHART_KINDS, ChartError, get_chart
+    from .ingest import load_csv
+    from .profiling import get_profile
+
+    uploaded_file = st.file_uploader("📁 上傳 CSV 檔案（Gemini 可讀取）", type="csv")
+
+    # 大檔案分塊解析，第一塊讀完就先顯示預覽，之後逐塊更新進度與欄位統計
+    preview_area = st.empty()
+    progress_area = st.empty()
+
+    def show_progress(progress):
+        preview_area.dataframe(progress.preview)
+        with progress_area.container():
+            st.caption(f"⏳ {progress.describe()}")
+            st.dataframe(progress.stats.to_frame(), hide_index=True)
+
+    if uploaded_file is not None:
+        source, message, error = uploaded_file, "✅ 檔案上傳成功，前幾列資料如下：", "❌ 無法讀取 CSV 檔案"
+    elif config.default_csv is not None and os.path.exists(config.default_csv):
+        source = config.default_csv
+        message = f"📂 使用預設的 CSV 檔案（{os.path.basename(config.default_csv)}）"
+        error = "❌ 預設檔案讀取失敗"
+    else:
+        if config.default_csv is not None:
+            st.warning("⚠️ 尚未上傳檔案，且找不到預設檔案。")
+        return None
+
+    try:
+        # 相同內容的檔案只解析一次，rerun 或其他使用者上傳同一份檔案都直接取用快取
+        df, st.session_state.dataset_hash = load_csv(source, on_progress=show_progress)
+    except Exception as e:
+        st.session_state.uploaded_df = None
+        st.session_state.dataset_hash = None
+        st.error(f"{error}：{e}")
+        return None
+    progress_area.empty()
+    st.session_state.uploaded_df = df
+    with preview_area.container():
+        (st.success if source is uploaded_file else st.info)(message)
+        st.dataframe(df.head())
+        if df.attrs.get("truncated"):
+            st.warning(f"⚠️ 資料列數超過上限，只讀取前 {len(df):,} 列。")
+
+    with st.expander("📊 資料概況"):
+        st.dataframe(get_profile(df, st.session_state.dataset_hash).to_frame(), hide_index=True)
+    # 圖表在伺服器端先分箱或降採樣，資料再大送到瀏覽器的點數也有上限
+    st.session_state.chart_mode = st.checkbox("📈 畫圖", value=st.session_state.chart_mode)
+    if st.session_state.chart_mode:
+        chart_columns = st.columns(4)
+        chart_kind = chart_columns[0].selectbox("類型", CHART_KINDS, format_func=CHART_KIND_NAMES.get)
+        chart_x = chart_columns[1].selectbox("X 軸", list(df.columns))
+        chart_y = chart_columns[2].selectbox("Y 軸", [None, *df.columns], format_func=lambda c: "（無）" if c is None else c)
+        chart_color = chart_columns[3].selectbox("分色", [None, *df.columns], format_func=lambda c: "（無）" if c is None else c)
+        try:
+            chart = get_chart(df, st.session_state.dataset_hash, {
+                "kind": chart_kind, "x": chart_x, "y": chart_y, "color": chart_color,
+            })
+            st.plotly_chart(chart.figure(), key="chart_builder")
+            st.caption(chart.describe())
+        except ChartError as e:
+            st.info(f"ℹ️ {e}")
+    return df
+
+
+def _topics_sidebar(store, user_id):
+    with st.sidebar:
+        st.markdown("---")
+        st.header("🗂️ 聊天紀錄")
+
+        if st.button("🆕 新對話", key="new_btn"):
+            st.session_state.current_topic = "new"
+
+        topic_search = st.text_input(
+            "🔍 搜尋主題", key="topic_search", on_change=lambda: st.session_state.update(topic_page=0)
+        )
+
+        # 只查詢目前這一頁的主題，不把全部紀錄載入記憶體
+        topic_total = store.count_topics(user_id, search=topic_search)
+        page_count = max(1, -(-topic_total // TOPIC_PAGE_SIZE))
+        st.session_state.topic_page = min(st.session_state.topic_page, page_count - 1)
+        topics = store.list_topics(
+            user_id, limit=TOPIC_PAGE_SIZE, offset=st.session_state.topic_page * TOPIC_PAGE_SIZE, search=topic_search
+        )
+        if topic_search and not topics:
+            st.caption("找不到符合的主題")
+        for topic in topics:
+            label = f"✔️ {topic.title}" if topic.id == st.session_state.current_topic else topic.title
+            if st.button(label, key=f"topic_btn_{topic.id}"):
+                st.session_state.current_topic = topic.id
+
+        if page_count > 1:
+            prev_col, page_col, next_col = st.columns([1, 2, 1])
+            if prev_col.button("◀", key="topic_prev", disabled=st.session_state.topic_page == 0):
+                st.session_state.topic_page -= 1
+                st.rerun()
+            page_col.caption(f"第 {st.session_state.topic_page + 1} / {page_count} 頁")
+            if next_col.button("▶", key="topic_next", disabled=st.session_state.topic_page >= page_count - 1):
+                st.session_state.topic_page += 1
+                st.rerun()
+
+        st.markdown("---")
+        st.session_state.stream_mode = st.checkbox("⚡ 串流顯示回覆", value=st.session_state.stream_mode)
+        st.session_state.query_mode = st.checkbox("🧮 以完整資料計算後回答", value=st.session_state.query_mode)
+        st.session_state.cache_mode = st.checkbox("💾 使用回覆快取", value=st.session_state.cache_mode)
+        cache_stats = get_response_cache().stats()
+        st.caption(
+            f"快取命中率 {cache_stats['hit_rate']:.0%}（精確 {cache_stats['exact_hits']}・近似 {cache_stats['near_hits']}），"
+            f"已節省 {cache_stats['saved_seconds']:.1f} 秒"
+        )
+        scheduler_stats = get_scheduler().stats()
+        st.caption(
+            f"模型請求：進行中 {scheduler_stats['active']}・排隊 {scheduler_stats['queued']}・"
+            f"平均等待 {scheduler_stats['avg_wait']:.2f} 秒・重試 {scheduler_stats['retries']} 次"
+        )
+        st.session_state.diagnostics_mode = st.checkbox("🩺 顯示診斷資訊", value=st.session_state.diagnostics_mode)
+        if st.session_state.diagnostics_mode:
+            tracer = get_tracer()
+            st.dataframe(tracer.stage_summary(), hide_index=True)
+            last_submit = tracer.last_trace("submit")
+            if last_submit is not None:
+                st.caption("上一次送出：" + "・".join(f"{c.name} {c.duration:.2f}s" for c in last_submit.children))
+            st.download_button("📈 下載 Prometheus 指標", tracer.prometheus_text(), file_name="metrics.prom")
+        if st.button("🧹 清除所有聊天紀錄"):
+            store.clear(user_id)
+            st.session_state.current_topic = "new"
+            st.session_state.topic_page = 0
+
+
+def _submit(config, model, store, contexts, user_id, user_input, answer_placeholder):
+    """回答一則問題並寫入對話紀錄。"""
+    from .pipeline import prepare_data
+
+    style = PROMPT_STYLES[config.prompt_style]
+    is_new = st.session_state.current_topic == "new"
+    if is_new:
+        topic_id = store.create_topic(user_id, "（產生主題中...）")
+        st.session_state.current_topic = topic_id
+    else:
+        topic_id = st.session_state.current_topic
+
+    # === Gemini 回覆內容與主題生成 ===
+    with st.spinner("Gemini 正在思考中..."), span("submit"):
+        title_call = None
+        try:
+            # 如果是新對話，主題在背景與回答同時生成；回答先用本地推得的主題
+            if is_new:
+                title_call = dispatch(generate_title, model, user_input, TITLE_TIMEOUT, timeout=TITLE_TIMEOUT)
+                topic_title = heuristic_title(user_input)
+            else:
+                topic_title = store.get_topic(topic_id).title
+
+            # 最近幾輪原文加上較早對話的摘要；新對話為空字串
+            history_text = "" if is_new else contexts.build(topic_id)
+
+            # 同一份資料、同一段對話脈絡下問過相同（或幾乎相同）的問題時，直接使用快取回覆
+            cache_context = scoped_context(
+                style.cache_context(topic_title, history_text), config.prompt_style, st.session_state.query_mode
+            )
+            cached = None
+            if st.session_state.cache_mode:
+                cached = get_response_cache().get(
+                    MODEL_NAME, user_input, st.session_state.dataset_hash, context=cache_context
+                )
+
+            if cached is not None:
+                answer = cached.answer
+                timing = {"ttft": None, "latency": 0.0, "cached": cached.tier}
+            else:
+                # 模型只規劃查詢，統計在完整資料上計算；規劃失敗時退回資料概況
+                started = time.perf_counter()
+                profile, query_result, rows = prepare_data(
+                    model, st.session_state.uploaded_df, st.session_state.dataset_hash, user_input,
+                    history_text=history_text, query_mode=st.session_state.query_mode,
+                )
+                if query_result is not None and query_result.answer:
+                    # 預測與畫圖由本地直接回答，不必再等 Gemini 組織回覆
+                    answer = query_result.answer
+                    timing = {"ttft": None, "latency": time.perf_counter() - started, "local": query_result.spec["op"]}
+                    if query_result.chart is not None:
+                        # 對話紀錄只存圖表規格，顯示時依規格從快取取回圖表
+                        timing["chart"] = {"dataset_hash": st.session_state.dataset_hash, "spec": query_result.spec}
+                else:
+                    prompt = style.build(topic_title, user_input, history_text, profile, query_result, rows)
+                    result = generate_text(
+                        model,
+                        prompt,
+                        stream=st.session_state.stream_mode,
+                        on_chunk=lambda text: answer_placeholder.markdown(f"**🤖 Gemini：** {text}▌"),
+                        timeout=ANSWER_TIMEOUT,
+                    )
+                    answer_placeholder.empty()
+                    answer = result.text.strip()
+                    timing = result.timing()
+                if st.session_state.cache_mode and answer and "chart" not in timing:
+                    get_response_cache().put(
+                        MODEL_NAME, user_input, answer, st.session_state.dataset_hash,
+                        context=cache_context, latency=timing["latency"],
+                    )
+
+            # 主題生成太慢或失敗時沿用本地主題
+            if is_new:
+                store.rename_topic(topic_id, title_call.result(default=topic_title))
+
+        except Exception as e:
+            answer = f"⚠️ 發生錯誤：{e}"
+            timing = {}
+            if is_new:
+                if title_call is not None:
+                    title_call.cancel()
+                store.rename_topic(topic_id, "錯誤主題")
+
+        # 每輪對話完成後只寫入一次
+        store.append_turn(topic_id, user_input, answer, meta=timing)
+        contexts.schedule_update(model, topic_id)
+
+
+def _history(store):
+    # 切換主題時視窗回到最近幾輪
+    if st.session_state.history_topic != st.session_state.current_topic:
+        st.session_state.history_topic = st.session_state.current_topic
+        st.session_state.history_window = HISTORY_PAGE_SIZE
+
+    # 只查詢並顯示最近的幾輪，每輪是一段預先組好的 markdown
+    with span("render_history") as render_span:
+        turns = store.get_turns(st.session_state.current_topic, limit=st.session_state.history_window + 1)
+        for turn in turns[:st.session_state.history_window]:
+            st.markdown(turn_markdown(turn))
+            chart_meta = turn.meta.get("chart")
+            if chart_meta:
+                from .query import replay_chart
+
+                chart = replay_chart(chart_meta["dataset_hash"], chart_meta["spec"])
+                if chart is not None:
+                    st.plotly_chart(chart.figure(), key=f"chart_{turn.id}")
+        render_span.set(turns=min(len(turns), st.session_state.history_window))
+
+    if len(turns) > st.session_state.history_window:
+        if st.button("⬆️ 載入較早的對話", key="load_older"):
+            st.session_state.history_window += HISTORY_PAGE_SIZE
+            st.rerun()
+
+
+def run_app(config=None):
+    """執行一次聊天室頁面（每次 Streamlit rerun 呼叫一次）。"""
+    config = config or AppConfig()
+    st.set_page_config(page_title=config.page_title, layout="wide")
+    st.title(config.title)
+    # 每次 rerun 是一個 trace，各處理階段的耗時記在其中（見側邊欄的診斷資訊）
+    rerun_trace = start_trace("rerun", script=config.name)
+    try:
+        for k, v in _default_state.items():
+            if k not in st.session_state:
+                st.session_state[k] = v
+
+        # 以網址參數記住使用者代號，重新整理頁面後仍能找回自己的聊天紀錄
+        if "uid" not in st.query_params:
+            st.query_params["uid"] = uuid.uuid4().hex
+        user_id = st.query_params["uid"]
+        # 排程器依使用者代號輪流放行，一個人送出大量請求不會擋住其他人
+        set_session(user_id)
+        store = get_conversation_store()
+        contexts = get_context_manager()
+
+        # 聊天紀錄被清除或網址換了使用者時，回到新對話
+        if st.session_state.current_topic != "new" and store.get_topic(st.session_state.current_topic) is None:
+            st.session_state.current_topic = "new"
+
+        model = KEY_VALIDATION[config.key_validation]()
+        _data_section(config)
+        _topics_sidebar(store, user_id)
+
+        with st.form("user_input_form", clear_on_submit=True):
+            user_input = st.text_input("你想問什麼？", placeholder="請輸入問題...")
+            submitted = st.form_submit_button("🚀 送出")
+
+        # 串流模式下回覆會先逐段寫在這裡，完成後再寫入對話紀錄
+        answer_placeholder = st.empty()
+        if submitted and user_input:
+            _submit(config, model, store, contexts, user_id, user_input, answer_placeholder)
+
+        if st.session_state.current_topic != "new":
+            _history(store)
+    finally:
+        # st.stop() 與 st.rerun() 以例外結束這次執行，trace 仍要結束
+        rerun_trace.end()
+        # 沒有事先預熱時，在第一個頁面送出之後才開始，利用使用者輸入金鑰的時間，不拖慢第一個頁面
+        if config.prewarm:
+            start_prewarm(config)
+
+
+# ============================================
+# 啟動
+# ============================================
+def main(argv=None):
+    """啟動 Streamlit，並在伺服器啟動的同時於同一個程序中預熱，第一位使用者連線時快取已經就緒。
+
+    其餘參數（例如 ``--server.port 8501``）原樣交給 ``streamlit run``。
+    """
+    parser = argparse.ArgumentParser(description="啟動 Gemini 聊天室並預熱")
+    parser.add_argument("--preset", choices=sorted(PRESETS),
+                        help="覆寫腳本本身的設定組（預設沿用 CHAT_APP_PRESET 或腳本的設定）")
+    parser.add_argument("--script", default=str(DEFAULT_SCRIPT), help="Streamlit 腳本（預設 open.py）")
+    parser.add_argument("--no-prewarm", action="store_true")
+    args, streamlit_args = parser.parse_known_args(argv)
+
+    # 腳本以 AppConfig.from_env(腳本的設定組) 讀取設定；只有明確指定 --preset 時才覆寫
+    if args.preset:
+        os.environ["CHAT_APP_PRESET"] = args.preset
+    if args.no_prewarm:
+        os.environ["CHAT_PREWARM"] = "0"
+    # 以 python -m 執行時本檔是 __main__；預熱狀態要記在腳本匯入的 chat_core.app 中，腳本才不會再預熱一次
+    from . import app
+
+    config = app.AppConfig.from_env(SCRIPT_PRESETS.get(Path(args.script).name, "open"))
+    if config.prewarm:
+        app.start_prewarm(config)
+
+    from streamlit.web import cli
+
+    return cli.main.main(["run", args.script, *streamlit_args], prog_name="streamlit")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""批次問答：從檔案讀入一批問題，對同一份資料以有限的並行度逐一回答，結果寫成 JSONL。
+
+    python -m chat_core.batch questions.txt --data ShoeSize.csv --output answers.jsonl --concurrency 8
+    python -m chat_core.batch questions.txt --data ShoeSize.csv --fake          # 本地替身模型，不花額度
+
+問題檔為純文字（每行一題，空行與 # 開頭的行略過）或 JSONL（每行 ``{"question": ..., "id": ...}``）。
+每題都當作新對話，與 open.py 送出第一個問題時走相同流程：回覆快取、查詢規劃、本地預測與畫圖、
+資料概況加相關資料列，提示詞也相同，因此批次結果與介面上的回答一致，並共用同一個回覆快取
+（``--fake`` 時不讀寫快取，替身模型的回覆不會被真實的 session 取用）。
+
+輸出檔同時是進度檔：每答完一題就附加一行並 flush。中斷後以相同指令重新執行，
+已成功的題目（依題目 id 與資料雜湊判斷）會略過，失敗的題目會重試；同一題有多行時以最後一行為準。
+金鑰來源與 HTTP 服務相同：環境變數 ``GEMINI_API_KEY`` / ``GOOGLE_API_KEY``（支援 .env）。
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from .client import MODEL_NAME, get_registry, set_registry
+from .executor import ANSWER_TIMEOUT
+from .pipeline import prepare_data_async
+from .profiling import get_profile
+from .prompts import build_answer_prompt, data_section, heuristic_title
+from .response_cache import get_response_cache, scoped_context
+from .retrieval import get_row_index
+from .scheduler import set_session
+from .streaming import generate_text_async
+from .tracing import start_trace
+
+DEFAULT_CONCURRENCY = 4
+BATCH_SESSION = "batch"
+
+
+@dataclass
+class Question:
+    id: str
+    index: int
+    text: str
+
+
+def question_id(text):
+    return hashlib.sha1(text.strip().encode("utf-8")).hexdigest()[:12]
+
+
+def read_questions(path):
+    """讀入問題檔；沒有指定 id 的題目以題目文字的雜湊為 id，重複的題目只保留第一次出現的。"""
+    questions = []
+    seen = set()
+    with open(path, encoding="utf-8-sig") as f:
+        jsonl = Path(path).suffix.lower() in (".jsonl", ".ndjson")
+        for line in f:
+            line = line.strip()
+            if not line or (not jsonl and line.startswith("#")):
+                continue
+            if jsonl:
+                record = json.loads(line)
+                text = str(record["question"]).strip()
+                qid = str(record.get("id") or question_id(text))
+            else:
+                text, qid = line, question_id(line)
+            if qid in seen:
+                continue
+            seen.add(qid)
+            questions.append(Question(id=qid, index=len(questions), text=text))
+    return questions
+
+
+def load_checkpoint(path, dataset_hash):
+    """讀取既有的輸出檔，回傳這份資料已成功回答的題目 id。
+
+    程序在寫到一半時被中止會留下不完整的最後一行，先截掉，之後附加的內容才不會接在半行後面。
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb") as f:
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    if end < len(data):
+        with open(path, "r+b") as f:
+            f.truncate(end)
+
+    latest = {}
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if record.get("dataset_hash") == dataset_hash:
+            latest[record.get("id")] = record
+    return {qid for qid, record in latest.items() if not record.get("error")}
+
+
+def _trace_totals(trace):
+    """由一題的 trace 統計各階段耗時與提示詞、回覆的 token 數（追蹤關閉時為空）。"""
+    stages = {}
+    tokens = {"prompt": 0, "response": 0}
+    pending = list(getattr(trace, "children", []))
+    while pending:
+        span = pending.pop()
+        if span.duration is not None:
+            stages[span.name] = stages.get(span.name, 0.0) + span.duration
+        for kind in tokens:
+            tokens[kind] += span.attrs.get(f"{kind}_tokens") or 0
+        pending.extend(span.children)
+    return {name: round(seconds, 4) for name, seconds in sorted(stages.items())}, tokens
+
+
+async def answer_question(model, question, df=None, dataset_hash=None, query_mode=True, use_cache=True):
+    """以 open.py 新對話的流程回答一題，回傳寫入 JSONL 的紀錄。"""
+    model_name = getattr(model, "model_name", MODEL_NAME)
+    record = {"id": question.id, "index": question.index, "question": question.text,
+              "model": model_name, "dataset_hash": dataset_hash}
+    trace = start_trace("batch_question", question_id=question.id)
+    started = time.perf_counter()
+    error = None
+    try:
+        topic_title = heuristic_title(question.text)
+        cache_context = scoped_context(f"主題是「{topic_title}」。", "topic", query_mode)
+        cached = None
+        if use_cache:
+            cached = await asyncio.to_thread(
+                get_response_cache().get, model_name, question.text, dataset_hash, cache_context
+            )
+        if cached is not None:
+            record.update(answer=cached.answer, source="cache", ttft=None)
+        else:
+            profile, query_result, rows = await prepare_data_async(
+                model, df, dataset_hash, question.text, query_mode=query_mode
+            )
+            if query_result is not None:
+                record["query_op"] = query_result.spec["op"]
+            if query_result is not None and query_result.answer:
+                record.update(answer=query_result.answer, source="local", ttft=None)
+                if query_result.chart is not None:
+                    record["chart"] = query_result.spec
+            else:
+                prompt = build_answer_prompt(topic_title, question.text, "", data_section(profile, query_result, rows))
+                result = await generate_text_async(model, prompt, stream=True, timeout=ANSWER_TIMEOUT)
+                record.update(answer=result.text.strip(), source="model", ttft=result.ttft)
+            if use_cache and record["answer"] and "chart" not in record:
+                await asyncio.to_thread(
+                    get_response_cache().put, model_name, question.text, record["answer"], dataset_hash,
+                    cache_context, time.perf_counter() - started,
+                )
+    except Exception as e:
+        error = e
+        record.update(answer=None, error=f"{type(e).__name__}: {e}")
+    finally:
+        trace.end(error)
+
+    record["latency"] = time.perf_counter() - started
+    record["stages"], tokens = _trace_totals(trace)
+    record["prompt_tokens"], record["response_tokens"] = tokens["prompt"], tokens["response"]
+    record["finished_at"] = time.time()
+    return record
+
+
+async def run_batch(model, questions, output, df=None, dataset_hash=None, concurrency=DEFAULT_CONCURRENCY,
+                    query_mode=True, use_cache=True, on_record=None, api_key=None):
+    """回答 ``questions`` 中尚未完成的題目，每完成一題就附加到 ``output``；回傳本次產生的紀錄。
+
+    最多同時進行 ``concurrency`` 題；實際送出的模型請求另外受全域排程器的速率限制。
+    ``model`` 為 None 時以 ``api_key`` 在這個事件迴圈中建立 async 模型。
+    """
+    if model is None:
+        # grpc 的 async client 綁定建立時的事件迴圈，必須在執行批次的迴圈中建立
+        model = get_registry().build_async_model(api_key)
+    done = load_checkpoint(output, dataset_hash)
+    pending = [q for q in questions if q.id not in done]
+    if df is not None and pending:
+        # 資料概況與列索引每份資料只建一次，先建好，避免第一批題目同時各建一次
+        await asyncio.to_thread(get_profile, df, dataset_hash)
+        await asyncio.to_thread(get_row_index, df, dataset_hash)
+
+    set_session(BATCH_SESSION)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    records = []
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "a", encoding="utf-8") as f:
+        async def worker(question):
+            async with semaphore:
+                record = await answer_question(model, question, df, dataset_hash, query_mode, use_cache)
+            # 整個批次在同一個事件迴圈中執行，寫檔不會交錯
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            records.append(record)
+            if on_record is not None:
+                on_record(record, len(records), len(pending))
+
+        await asyncio.gather(*(worker(q) for q in pending))
+    return records
+
+
+def summarize(records, wall):
+    latencies = sorted(r["latency"] for r in records if not r.get("error"))
+    summary = {
+        "answered": len(latencies),
+        "failed": sum(1 for r in records if r.get("error")),
+        "wall_seconds": wall,
+        "throughput_per_second": len(records) / wall if wall else 0.0,
+        "prompt_tokens": sum(r["prompt_tokens"] for r in records),
+        "response_tokens": sum(r["response_tokens"] for r in records),
+        "sources": {},
+    }
+    for r in records:
+        if r.get("source"):
+            summary["sources"][r["source"]] = summary["sources"].get(r["source"], 0) + 1
+    if latencies:
+        summary["latency"] = {
+            "mean": statistics.fmean(latencies),
+            "p50": latencies[len(latencies) // 2],
+            "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        }
+    return summary
+
+
+def _print_record(record, count, total):
+    status = f"✗ {record['error']}" if record.get("error") else f"✓ {record['source']}"
+    print(f"[{count}/{total}] {record['latency']:.2f}s {status}：{record['question'][:40]}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批次回答問題檔中的問題，結果寫成 JSONL")
+    parser.add_argument("questions", help="問題檔（.txt 每行一題，或 .jsonl）")
+    parser.add_argument("--data", help="要分析的 CSV 檔")
+    parser.add_argument("--output", help="結果檔，同時作為進度檔（預設為問題檔名加上 .answers.jsonl）")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同時進行的題數")
+    parser.add_argument("--rate", type=float, help="每把金鑰每秒送出的模型請求數（預設讀 CHAT_RATE）")
+    parser.add_argument("--burst", type=int, help="每把金鑰可累積的請求數（預設讀 CHAT_BURST）")
+    parser.add_argument("--no-query", action="store_true", help="不規劃查詢，只用資料概況與相關資料列")
+    parser.add_argument("--no-cache", action="store_true", help="不讀寫回覆快取")
+    parser.add_argument("--fake", action="store_true", help="使用本地替身模型（測試用，不花額度，不讀寫回覆快取）")
+    parser.add_argument("--fake-latency", type=float, default=0.3, help="替身模型回覆第一段文字前的延遲（秒）")
+    args = parser.parse_args(argv)
+    if args.rate is not None and not args.rate > 0:
+        parser.error("--rate 必須大於 0")
+    if args.burst is not None and args.burst < 1:
+        parser.error("--burst 至少為 1")
+    # 排程器第一次取得時讀取這些設定
+    if args.rate is not None:
+        os.environ["CHAT_RATE"] = str(args.rate)
+    if args.burst is not None:
+        os.environ["CHAT_BURST"] = str(args.burst)
+
+    questions = read_questions(args.questions)
+    output = args.output or str(Path(args.questions).with_suffix(".answers.jsonl"))
+
+    if args.fake:
+        from .fake import FakeGenerativeModel, FakeModelRegistry
+
+        set_registry(FakeModelRegistry(FakeGenerativeModel(latency=args.fake_latency)))
+        api_key = "fake"
+    else:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            parser.error("請設定環境變數 GEMINI_API_KEY 或 GOOGLE_API_KEY，或加上 --fake")
+
+    df = dataset_hash = None
+    if args.data:
+        from .ingest import load_csv
+
+        df, dataset_hash = load_csv(args.data)
+
+    get_registry().get_model(api_key)            # 先驗證金鑰，金鑰錯誤時不必等每一題都失敗
+
+    done = len(load_checkpoint(output, dataset_hash) & {q.id for q in questions})
+    print(f"共 {len(questions)} 題，已完成 {done} 題，結果寫入 {output}", file=sys.stderr)
+    start = time.perf_counter()
+    try:
+        records = asyncio.run(run_batch(
+            None, questions, output, df, dataset_hash, concurrency=args.concurrency,
+            # 替身模型的回覆不可寫進與真實模型共用的回覆快取
+            query_mode=not args.no_query, use_cache=not (args.no_cache or args.fake), on_record=_print_record,
+            api_key=api_key,
+        ))
+    except KeyboardInterrupt:
+        print("已中斷；以相同指令重新執行即可從中斷處繼續", file=sys.stderr)
+        return 130
+
+    summary = summarize(records, time.perf_counter() - start)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
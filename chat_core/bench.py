@@ -0,0 +1,438 @@
+"""效能量測：以本地 Gemini 替身在無頭的 Streamlit（AppTest）中跑完整聊天流程，不花任何額度。
+
+    python -m chat_core.bench --rows 10000 100000 1000000 --output bench.json
+    python -m chat_core.bench --rows 10000 --sessions 4 --error-rate 0.1 --baseline bench.json
+
+    python -m chat_core.bench --cold-start --rows 10000 100000
+
+量測 1,000 萬筆時請加上 ``--rows 10000000``（產生的 CSV 約 250 MB）。
+``--cold-start`` 改為在全新程序中量測第一位使用者從打開頁面到第一個回答的等待時間，有、無預熱各一次。
+
+每個情境（腳本 × 資料筆數）在獨立的子程序與暫存工作目錄中執行，快取、聊天紀錄與記憶體量測互不影響。
+資料由 ShoeSize.csv 重複抽樣並加上擾動放大到指定筆數，產生後存在 .cache/bench/ 重複使用。
+結果寫成 JSON，可用 ``--baseline`` 與先前的結果比較。
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SOURCE_CSV = ROOT / "ShoeSize.csv"
+DATA_DIR = ROOT / ".cache" / "bench"
+DEFAULT_SCRIPTS = ("open.py", "open -2.py")
+DEFAULT_ROWS = (10_000, 100_000, 1_000_000)
+DEFAULT_QUESTIONS = ("平均鞋碼是多少？", "男生呢？", "身高和體重有什麼關係？")
+REGRESSION_THRESHOLD = 0.2
+UNLIMITED_RATE = 1e9
+APP_TIMEOUT = 600
+
+
+# ============================================
+# 合成資料
+# ============================================
+def synthetic_dataset(rows, seed=0):
+    """由 ShoeSize.csv 重複抽樣放大到 ``rows`` 筆，數值欄位加上小幅擾動，避免完全重複的列。"""
+    path = DATA_DIR / f"ShoeSize_{rows}.csv"
+    if path.exists():
+        return path
+
+    # 冷啟動量測的子程序也會載入這個模組，pandas 只在產生資料時才載入
+    import numpy as np
+    import pandas as pd
+
+    base = pd.read_csv(SOURCE_CSV)
+    rng = np.random.default_rng(seed)
+    df = base.iloc[rng.integers(0, len(base), rows)].reset_index(drop=True)
+    df["ID"] = np.arange(1, rows + 1)
+    df["Height_cm"] = (df["Height_cm"] + rng.normal(0, 2, rows)).round()
+    df["Weight_kg"] = (df["Weight_kg"] + rng.normal(0, 2, rows)).round()
+    df["Shoe size_cm"] = ((df["Shoe size_cm"] + rng.normal(0, 0.5, rows)) * 2).round() / 2
+
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    df.to_csv(tmp, index=False)
+    tmp.replace(path)
+    return path
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return None
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 回報，macOS 以 bytes 回報
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _summary(values):
+    if not values:
+        return {"mean": None, "p50": None, "p95": None, "max": None}
+    values = sorted(values)
+    return {
+        "mean": statistics.fmean(values),
+        "p50": values[len(values) // 2],
+        "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        "max": values[-1],
+    }
+
+
+# ============================================
+# 單一情境（在子程序中執行）
+# ============================================
+def _session(script, data_path, questions, model, preload):
+    from streamlit.testing.v1 import AppTest
+
+    from .ingest import load_csv
+
+    at = AppTest.from_file(str(ROOT / script), default_timeout=APP_TIMEOUT)
+    at.session_state["api_key"] = "bench"
+    steps = []
+
+    ingest = None
+    if preload:
+        # AppTest 無法操作檔案上傳元件，直接把讀好的資料放進 session（與上傳後的狀態相同）
+        start = time.perf_counter()
+        df, dataset_hash = load_csv(str(data_path))
+        ingest = time.perf_counter() - start
+        at.session_state["uploaded_df"] = df
+        at.session_state["dataset_hash"] = dataset_hash
+
+    def session_calls():
+        # 依 session 代號計算，多個 session 同時進行時不會算到別人的呼叫
+        uid = at.query_params.get("uid")
+        return model.calls_by_session[uid[0] if isinstance(uid, list) else uid] if uid else 0
+
+    def run(kind, question=None):
+        calls = session_calls()
+        start = time.perf_counter()
+        at.run()
+        elapsed = time.perf_counter() - start
+        if at.exception:
+            raise RuntimeError(f"{script}: {at.exception[0].value}")
+        steps.append({
+            "kind": kind,
+            "question": question,
+            "rerun_seconds": elapsed,
+            "model_calls": session_calls() - calls,
+        })
+
+    def ask(question, kind="ask"):
+        next(t for t in at.text_input if t.label == "你想問什麼？").input(question)
+        next(b for b in at.button if "送出" in b.label).click()
+        run(kind, question)
+
+    run("first_run")
+    for _ in range(3):
+        run("idle_rerun")
+    for question in questions:
+        ask(question)
+    # 新對話中再問一次第一個問題：情境相同，應命中回覆快取
+    next(b for b in at.button if "新對話" in b.label).click()
+    run("new_chat")
+    ask(questions[0], kind="repeat")
+    return ingest, steps
+
+
+def run_scenario(script, rows, sessions=1, questions=DEFAULT_QUESTIONS, latency=0.3, chunk_rate=40.0,
+                 error_rate=0.0, rate=None, seed=0):
+    """在目前程序中跑一個情境並回傳結果 dict；會切換工作目錄與替換全域的模型登錄表。"""
+    from .client import set_registry
+    from .fake import FakeGenerativeModel, FakeModelRegistry
+    from .scheduler import get_scheduler
+
+    data_path = synthetic_dataset(rows, seed)
+    workdir = Path(tempfile.mkdtemp(prefix="chat-bench-"))
+    # open -2.py 會讀取工作目錄下的 ShoeSize.csv；open.py 則預先放入 session
+    os.symlink(data_path, workdir / "ShoeSize.csv")
+    os.chdir(workdir)
+
+    model = FakeGenerativeModel(latency=latency, chunk_rate=chunk_rate, error_rate=error_rate, seed=seed)
+    set_registry(FakeModelRegistry(model))
+    scheduler = get_scheduler()
+    if rate is None:
+        # 預設不限速，量到的是應用程式本身的開銷
+        scheduler.rate, scheduler.burst = UNLIMITED_RATE, UNLIMITED_RATE
+    else:
+        scheduler.rate = rate
+
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    preload = script != "open -2.py"
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        futures = [pool.submit(_session, script, data_path, questions, model, preload) for _ in range(sessions)]
+        results = [f.result() for f in futures]
+    wall = time.perf_counter() - start
+
+    steps = [step for _, session_steps in results for step in session_steps]
+    asks = [s for s in steps if s["kind"] in ("ask", "repeat")]
+    ingests = [ingest for ingest, _ in results if ingest is not None]
+    return {
+        "script": script,
+        "rows": rows,
+        "sessions": sessions,
+        "csv_mb": data_path.stat().st_size / 2 ** 20,
+        "ingest_seconds": _summary(ingests),
+        "first_run_seconds": _summary([s["rerun_seconds"] for s in steps if s["kind"] == "first_run"]),
+        "idle_rerun_seconds": _summary([s["rerun_seconds"] for s in steps if s["kind"] == "idle_rerun"]),
+        "interaction_seconds": _summary([s["rerun_seconds"] for s in asks]),
+        "model_calls_per_interaction": statistics.fmean(s["model_calls"] for s in asks) if asks else 0.0,
+        "interactions": len(asks),
+        "throughput_per_second": len(asks) / wall if wall else 0.0,
+        "wall_seconds": wall,
+        "rss_mb": {"before": rss_before, "after": _rss_mb(), "peak": _peak_rss_mb()},
+        "model": {"calls": model.calls, "injected_errors": model.errors},
+        "scheduler": scheduler.stats(),
+        "threads": threading.active_count(),
+        "steps": steps,
+    }
+
+
+# ============================================
+# 冷啟動（在全新的子程序中執行）
+# ============================================
+def cold_start(script, rows, prewarm=True, question=DEFAULT_QUESTIONS[0], seed=0):
+    """量測全新程序中第一位使用者的等待時間：載入 Streamlit、第一個頁面、輸入金鑰後的頁面、第一個問題。
+
+    ``prewarm=True`` 時在第一個頁面之後等背景預熱完成再繼續（相當於使用者輸入金鑰的這段時間），
+    量到的是預熱完成後使用者實際感受到的延遲；等待預熱的時間另外記錄。
+    """
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    import_seconds = time.perf_counter() - start
+
+    from .client import set_registry
+    from .fake import FakeGenerativeModel, FakeModelRegistry
+    from .scheduler import get_scheduler
+
+    data_path = synthetic_dataset(rows, seed)
+    workdir = Path(tempfile.mkdtemp(prefix="chat-cold-"))
+    os.symlink(data_path, workdir / "ShoeSize.csv")
+    os.chdir(workdir)
+    os.environ["CHAT_PREWARM"] = "1" if prewarm else "0"
+    # 模型不延遲，量到的只有應用程式本身的開銷
+    set_registry(FakeModelRegistry(FakeGenerativeModel(latency=0.0, chunk_rate=UNLIMITED_RATE, seed=seed)))
+    scheduler = get_scheduler()
+    scheduler.rate, scheduler.burst = UNLIMITED_RATE, UNLIMITED_RATE
+
+    at = AppTest.from_file(str(ROOT / script), default_timeout=APP_TIMEOUT)
+    result = {"script": script, "rows": rows, "prewarm": prewarm, "import_seconds": import_seconds}
+
+    def run(name):
+        start = time.perf_counter()
+        at.run()
+        result[name] = time.perf_counter() - start
+        if at.exception:
+            raise RuntimeError(f"{script}: {at.exception[0].value}")
+
+    run("first_page_seconds")
+    if prewarm:
+        from .app import SCRIPT_PRESETS, AppConfig, start_prewarm
+
+        start = time.perf_counter()
+        start_prewarm(AppConfig.from_env(SCRIPT_PRESETS.get(script, "open"))).join()
+        result["prewarm_wait_seconds"] = time.perf_counter() - start
+
+    at.session_state["api_key"] = "bench"
+    if script != "open -2.py":
+        # 相當於上傳檔案
+        from .ingest import load_csv
+
+        start = time.perf_counter()
+        df, dataset_hash = load_csv(str(data_path))
+        result["ingest_seconds"] = time.perf_counter() - start
+        at.session_state["uploaded_df"] = df
+        at.session_state["dataset_hash"] = dataset_hash
+    run("key_page_seconds")
+
+    next(t for t in at.text_input if t.label == "你想問什麼？").input(question)
+    next(b for b in at.button if "送出" in b.label).click()
+    run("first_interaction_seconds")
+    # 使用者實際等待的時間（不含輸入金鑰、上傳與預熱期間）
+    result["total_seconds"] = sum(
+        result.get(key, 0.0) for key in ("first_page_seconds", "ingest_seconds", "key_page_seconds", "first_interaction_seconds")
+    )
+    return result
+
+
+# ============================================
+# 主程式
+# ============================================
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _scenario_key(result):
+    return result["script"], result["rows"], result["sessions"]
+
+
+def compare(results, baseline):
+    """與先前的結果比較每次互動的 p50 延遲；回傳變慢超過門檻的情境說明。"""
+    previous = {_scenario_key(r): r for r in baseline.get("results", []) if "error" not in r}
+    regressions = []
+    for result in results:
+        old = previous.get(_scenario_key(result))
+        if old is None or "error" in result:
+            continue
+        before, after = old["interaction_seconds"]["p50"], result["interaction_seconds"]["p50"]
+        if not before or after is None:
+            continue
+        change = after / before - 1
+        line = f"{result['script']} × {result['rows']:,} 筆：p50 {before:.3f}s → {after:.3f}s（{change:+.0%}）"
+        print(line)
+        if change > REGRESSION_THRESHOLD:
+            regressions.append(line)
+    return regressions
+
+
+def _print_result(result):
+    if "error" in result:
+        print(f"{result['script']} × {result['rows']:,} 筆：失敗 {result['error']}")
+        return
+    interaction = result["interaction_seconds"]
+    print(
+        f"{result['script']} × {result['rows']:,} 筆（{result['sessions']} 個 session）："
+        f"互動 p50 {interaction['p50']:.3f}s / p95 {interaction['p95']:.3f}s，"
+        f"閒置 rerun p50 {result['idle_rerun_seconds']['p50']:.3f}s，"
+        f"每次互動 {result['model_calls_per_interaction']:.1f} 次模型呼叫，"
+        f"{result['throughput_per_second']:.2f} 次互動/秒，峰值記憶體 {result['rss_mb']['peak']:.0f} MB"
+    )
+
+
+def _print_cold_start(result):
+    if "error" in result:
+        print(f"{result['script']} × {result['rows']:,} 筆（冷啟動）：失敗 {result['error']}")
+        return
+    print(
+        f"{result['script']} × {result['rows']:,} 筆（冷啟動，{'有' if result['prewarm'] else '無'}預熱）："
+        f"載入 Streamlit {result['import_seconds']:.2f}s，第一個頁面 {result['first_page_seconds']:.2f}s，"
+        f"輸入金鑰後 {result['key_page_seconds']:.2f}s，第一個問題 {result['first_interaction_seconds']:.2f}s"
+    )
+
+
+def _run_worker(command, fallback):
+    proc = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    try:
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+    except (IndexError, json.JSONDecodeError):
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "沒有輸出"
+        return {**fallback, "error": error}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以本地 Gemini 替身量測聊天流程的效能")
+    parser.add_argument("--script", action="append", help="要量測的腳本，可重複指定（預設 open.py 與 open -2.py）")
+    parser.add_argument("--rows", type=int, nargs="+", default=list(DEFAULT_ROWS))
+    parser.add_argument("--sessions", type=int, default=1, help="同時進行的 session 數")
+    parser.add_argument("--question", action="append", help="要問的問題，可重複指定")
+    parser.add_argument("--latency", type=float, default=0.3, help="替身模型回覆第一段文字前的延遲（秒）")
+    parser.add_argument("--chunk-rate", type=float, default=40.0, help="串流每秒送出的片段數")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="每次呼叫注入 429 錯誤的機率")
+    parser.add_argument("--rate", type=float, help="排程器每秒放行的請求數（預設不限速）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果檔路徑（預設 .cache/bench/results-<commit>.json）")
+    parser.add_argument("--baseline", help="先前的結果檔，比較後變慢超過 20% 時以非零狀態結束")
+    parser.add_argument("--cold-start", action="store_true",
+                        help="改為量測全新程序的冷啟動（有、無預熱各一次），不跑一般情境")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--no-prewarm", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    scenario = {
+        "sessions": args.sessions,
+        "questions": tuple(args.question or DEFAULT_QUESTIONS),
+        "latency": args.latency,
+        "chunk_rate": args.chunk_rate,
+        "error_rate": args.error_rate,
+        "rate": args.rate,
+        "seed": args.seed,
+    }
+
+    if args.worker:
+        # 子程序：只跑一個情境，結果以 JSON 寫到 stdout 最後一行
+        if args.cold_start:
+            result = cold_start(args.script[0], args.rows[0], prewarm=not args.no_prewarm,
+                                question=scenario["questions"][0], seed=args.seed)
+        else:
+            result = run_scenario(args.script[0], args.rows[0], **scenario)
+        print(json.dumps(result, ensure_ascii=False))
+        return 0
+
+    results = []
+    cold_results = []
+    for script in args.script or DEFAULT_SCRIPTS:
+        for rows in args.rows:
+            if args.cold_start:
+                synthetic_dataset(rows, args.seed)
+                for prewarm in (False, True):
+                    command = [
+                        sys.executable, "-m", "chat_core.bench", "--worker", "--cold-start", "--script", script,
+                        "--rows", str(rows), "--seed", str(args.seed), "--question", scenario["questions"][0],
+                    ]
+                    if not prewarm:
+                        command.append("--no-prewarm")
+                    result = _run_worker(command, {"script": script, "rows": rows, "prewarm": prewarm})
+                    _print_cold_start(result)
+                    cold_results.append(result)
+                continue
+
+            command = [
+                sys.executable, "-m", "chat_core.bench", "--worker", "--script", script, "--rows", str(rows),
+                "--sessions", str(args.sessions), "--latency", str(args.latency),
+                "--chunk-rate", str(args.chunk_rate), "--error-rate", str(args.error_rate), "--seed", str(args.seed),
+            ]
+            if args.rate is not None:
+                command += ["--rate", str(args.rate)]
+            for question in scenario["questions"]:
+                command += ["--question", question]
+            result = _run_worker(command, {"script": script, "rows": rows, "sessions": args.sessions})
+            _print_result(result)
+            results.append(result)
+
+    commit = _git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {**scenario, "questions": list(scenario["questions"])},
+        "results": results,
+    }
+    if cold_results:
+        report["cold_start"] = cold_results
+    output = Path(args.output or DATA_DIR / f"results-{commit or 'local'}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果已寫入 {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            print("效能退步：\n" + "\n".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""伺服器端彙總的圖表：先在 pandas / numpy 上分箱或降採樣，送到瀏覽器的點數有固定上限。
+
+* histogram：數值欄以 ``np.histogram`` 分箱，文字欄取出現最多的值。
+* bar：依 x 分組彙總 y（預設平均），最多 ``MAX_BARS`` 組。
+* scatter：超過 ``MAX_POINTS`` 筆時均勻取樣。
+* density：``np.histogram2d`` 的二維分箱熱度圖，適合很大的資料。
+* line：依 x 排序後以 LTTB 降採樣，保留曲線的形狀。
+
+圖表 JSON 依 (資料雜湊, 圖表規格) 快取，同一張圖只計算一次；資料再大，圖表大小與繪製時間都不變。
+"""
+import json
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .common import LRUCache, is_numeric
+from .tracing import span
+
+CHART_KINDS = ("histogram", "bar", "scatter", "density", "line")
+CHART_KIND_NAMES = {"histogram": "分布圖", "bar": "長條圖", "scatter": "散佈圖", "density": "密度圖", "line": "折線圖"}
+CHART_AGGS = ("mean", "median", "sum", "min", "max", "count")
+MAX_POINTS = 5000
+HISTOGRAM_BINS = 50
+DENSITY_BINS = 80
+MAX_BARS = 30
+MAX_SERIES = 10
+MAX_CHARTS = 64
+RANDOM_STATE = 0
+
+
+class ChartError(ValueError):
+    """圖表規格不合法或欄位不適合這種圖表。"""
+
+
+@dataclass
+class ChartResult:
+    spec: dict
+    figure_json: str
+    rows: int                   # 參與繪圖的資料筆數
+    points: int                 # 實際送到瀏覽器的點數（或格數、長條數）
+    method: str                 # 原始 / 取樣 / 分箱 / LTTB / 分組彙總
+    build_seconds: float = 0.0
+
+    def figure(self):
+        import plotly.io
+        return plotly.io.from_json(self.figure_json)
+
+    def describe(self):
+        spec = self.spec
+        columns = " 與 ".join(str(c) for c in (spec["x"], spec.get("y")) if c is not None)
+        text = f"已畫出 {columns} 的{CHART_KIND_NAMES[spec['kind']]}"
+        if spec.get("color") is not None:
+            text += f"（依 {spec['color']} 分色）"
+        return f"{text}：{self.rows:,} 筆資料（{self.method}）繪製為 {self.points:,} 個點。"
+
+    def to_frame(self):
+        spec = self.spec
+        return pd.DataFrame([{
+            "圖表": spec["kind"], "x": spec["x"], "y": spec.get("y"), "分色": spec.get("color"),
+            "資料筆數": self.rows, "繪製點數": self.points, "方式": self.method,
+        }])
+
+
+def _check_column(df, spec, field, required=False):
+    column = spec.get(field)
+    if column is None:
+        if required:
+            raise ChartError(f"{field} 欄位必須指定")
+        return None
+    if column not in df.columns:
+        raise ChartError(f"{field} 欄位不存在：{column}")
+    return column
+
+
+def validate_chart_spec(df, spec):
+    """檢查並補齊圖表規格，回傳新的 dict；不合法時丟出 ChartError。"""
+    if not isinstance(spec, dict):
+        raise ChartError("圖表規格必須是 JSON 物件")
+    kind = spec.get("kind", "histogram")
+    if kind not in CHART_KINDS:
+        raise ChartError(f"不支援的圖表類型：{kind}")
+
+    x = _check_column(df, spec, "x", required=True)
+    y = _check_column(df, spec, "y", required=kind in ("scatter", "density", "line"))
+    color = _check_column(df, spec, "color") if kind != "density" else None
+    if color == x:
+        color = None
+    agg = spec.get("agg") or ("mean" if y is not None else "count")
+    if agg not in CHART_AGGS:
+        raise ChartError(f"彙總函式只能是 {', '.join(CHART_AGGS)}")
+
+    numeric_axes = {"scatter": (x, y), "density": (x, y), "line": (y,), "bar": (y,) if agg != "count" else ()}
+    for column in numeric_axes.get(kind, ()):
+        if column is not None and not is_numeric(df[column]):
+            raise ChartError(f"{column} 不是數值欄，無法畫{CHART_KIND_NAMES[kind]}")
+    return {"kind": kind, "x": x, "y": y, "color": color, "agg": agg}
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets 降採樣，回傳保留點的索引（x 需已排序）。"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    # 頭尾固定保留，中間分成 threshold - 2 個桶，每桶保留與前一點、下一桶平均點構成最大三角形的點
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def _groups(frame, color):
+    """依分色欄位切成多條資料序列，最多 ``MAX_SERIES`` 組（依筆數多寡）。"""
+    if color is None:
+        return [(None, frame)]
+    top = frame[color].value_counts().index[:MAX_SERIES]
+    return [(value, frame[frame[color] == value]) for value in top]
+
+
+def _histogram(go, df, spec):
+    x, color = spec["x"], spec["color"]
+    frame = df[[x] + ([color] if color is not None else [])].dropna(subset=[x])
+    traces = []
+    if is_numeric(frame[x]):
+        values = frame[x].to_numpy(dtype="float64")
+        edges = np.histogram_bin_edges(values, bins=HISTOGRAM_BINS) if len(values) else np.arange(2)
+        centers = (edges[:-1] + edges[1:]) / 2
+        for name, group in _groups(frame, color):
+            counts, _ = np.histogram(group[x].to_numpy(dtype="float64"), bins=edges)
+            traces.append(go.Bar(x=centers, y=counts, width=np.diff(edges), name=None if name is None else str(name)))
+        method, points = "分箱", len(centers) * len(traces)
+    else:
+        for name, group in _groups(frame, color):
+            counts = group[x].value_counts().head(MAX_BARS)
+            traces.append(go.Bar(x=counts.index.astype(str), y=counts.to_numpy(), name=None if name is None else str(name)))
+        method, points = "分組彙總", sum(len(t.x) for t in traces)
+    layout = {"barmode": "overlay" if color is not None else "group", "xaxis_title": str(x), "yaxis_title": "筆數"}
+    return traces, layout, len(frame), points, method
+
+
+def _bar(go, df, spec):
+    x, y, color, agg = spec["x"], spec["y"], spec["color"], spec["agg"]
+    keys = [x] + ([color] if color is not None else [])
+    grouped = df.groupby(keys, observed=True)
+    table = grouped.size() if y is None or agg == "count" else grouped[y].agg(agg)
+    if color is not None:
+        table = table.unstack(color)
+        order = table.sum(axis=1).sort_values(ascending=False).index[:MAX_BARS]
+        table = table.loc[order, table.columns[:MAX_SERIES]]
+        traces = [go.Bar(x=table.index.astype(str), y=table[c].to_numpy(), name=str(c)) for c in table.columns]
+    else:
+        table = table.sort_values(ascending=False).head(MAX_BARS)
+        traces = [go.Bar(x=table.index.astype(str), y=table.to_numpy())]
+    label = "筆數" if y is None or agg == "count" else f"{y}（{agg}）"
+    layout = {"xaxis_title": str(x), "yaxis_title": label}
+    return traces, layout, len(df), sum(len(t.x) for t in traces), "分組彙總"
+
+
+def _scatter(go, df, spec):
+    x, y, color = spec["x"], spec["y"], spec["color"]
+    frame = df[[x, y] + ([color] if color is not None else [])].dropna(subset=[x, y])
+    method = "原始資料"
+    sample = frame
+    if len(frame) > MAX_POINTS:
+        sample = frame.sample(MAX_POINTS, random_state=RANDOM_STATE)
+        method = "均勻取樣"
+    traces = [
+        go.Scattergl(x=group[x].to_numpy(), y=group[y].to_numpy(), mode="markers",
+                     marker={"size": 4, "opacity": 0.6}, name=None if name is None else str(name))
+        for name, group in _groups(sample, color)
+    ]
+    layout = {"xaxis_title": str(x), "yaxis_title": str(y)}
+    return traces, layout, len(frame), sum(len(t.x) for t in traces), method
+
+
+def _density(go, df, spec):
+    x, y = spec["x"], spec["y"]
+    frame = df[[x, y]].dropna()
+    counts, x_edges, y_edges = np.histogram2d(
+        frame[x].to_numpy(dtype="float64"), frame[y].to_numpy(dtype="float64"), bins=DENSITY_BINS,
+    )
+    # 沒有資料的格子不上色
+    z = np.where(counts.T > 0, counts.T, np.nan)
+    trace = go.Heatmap(
+        x=(x_edges[:-1] + x_edges[1:]) / 2, y=(y_edges[:-1] + y_edges[1:]) / 2, z=z,
+        colorscale="Viridis", colorbar={"title": "筆數"},
+    )
+    layout = {"xaxis_title": str(x), "yaxis_title": str(y)}
+    return [trace], layout, len(frame), int(np.count_nonzero(counts)), "二維分箱"
+
+
+def _line(go, df, spec):
+    x, y, color = spec["x"], spec["y"], spec["color"]
+    frame = df[[x, y] + ([color] if color is not None else [])].dropna(subset=[x, y]).sort_values(x, kind="stable")
+    groups = _groups(frame, color)
+    threshold = max(3, MAX_POINTS // len(groups))
+    traces = []
+    method = "原始資料"
+    for name, group in groups:
+        x_values = group[x]
+        numeric_x = x_values.astype("int64") if pd.api.types.is_datetime64_any_dtype(x_values) else x_values
+        if len(group) <= threshold:
+            keep = np.arange(len(group))
+        elif is_numeric(numeric_x):
+            keep = lttb(numeric_x.to_numpy(dtype="float64"), group[y].to_numpy(dtype="float64"), threshold)
+            method = "LTTB 降採樣"
+        else:
+            keep = np.linspace(0, len(group) - 1, threshold).astype(np.int64)
+            method = "均勻取樣"
+        group = group.iloc[keep]
+        traces.append(go.Scattergl(
+            x=group[x].to_numpy(), y=group[y].to_numpy(), mode="lines", name=None if name is None else str(name),
+        ))
+    layout = {"xaxis_title": str(x), "yaxis_title": str(y)}
+    return traces, layout, len(frame), sum(len(t.x) for t in traces), method
+
+
+_BUILDERS = {"histogram": _histogram, "bar": _bar, "scatter": _scatter, "density": _density, "line": _line}
+
+
+def build_chart(df, spec):
+    """依規格在 ``df`` 上彙總並產生 Plotly 圖表，回傳 ChartResult。"""
+    # 只有第一次畫圖時才載入 plotly
+    import plotly.graph_objects as go
+
+    spec = validate_chart_spec(df, spec)
+    start = time.perf_counter()
+    try:
+        traces, layout, rows, points, method = _BUILDERS[spec["kind"]](go, df, spec)
+    except (TypeError, ValueError) as e:
+        raise ChartError(f"圖表產生失敗：{e}") from e
+    figure = go.Figure(data=traces)
+    figure.update_layout(
+        margin={"l": 40, "r": 20, "t": 30, "b": 40}, showlegend=spec["color"] is not None, **layout,
+    )
+    return ChartResult(spec, figure.to_json(), rows, points, method, time.perf_counter() - start)
+
+
+_charts = LRUCache(MAX_CHARTS)
+
+
+def get_chart(df, dataset_hash, spec):
+    """取得圖表；有內容雜湊時依 (雜湊, 規格) 快取，同一張圖只計算一次。
+
+    ``spec`` 可以包含篩選條件等其他欄位，它們會一起成為快取索引的一部分。
+    """
+    if dataset_hash is None:
+        return build_chart(df, spec)
+
+    def build():
+        with span("build_chart", rows=len(df), kind=str(spec.get("kind"))) as s:
+            chart = build_chart(df, spec)
+            s.set(points=chart.points, bytes=len(chart.figure_json))
+        return chart
+
+    key = (dataset_hash, json.dumps(spec, sort_keys=True, ensure_ascii=False, default=str))
+    return _charts.get_or_build(key, build)
@@ -0,0 +1,203 @@
+"""Gemini 模型快取：同一個 API 金鑰在整個程序中只建立、驗證一次模型。"""
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from google.api_core import exceptions as google_exceptions
+
+from .tracing import span
+
+MODEL_NAME = "models/gemini-2.0-flash"
+# 金鑰本身無效或沒有權限；逾時、5xx、網路中斷等暫時性錯誤不算，下次取得時會重新驗證
+AUTH_ERRORS = (
+    google_exceptions.InvalidArgument,
+    google_exceptions.PermissionDenied,
+    google_exceptions.Unauthenticated,
+)
+
+
+def load_genai():
+    """載入 Gemini SDK；光是 import 就要約一秒，等第一次建立模型（或預熱）時才載入。"""
+    import google.generativeai as genai
+    from google.generativeai import client as genai_client
+
+    return genai, genai_client
+
+
+def hash_api_key(api_key):
+    """以 SHA-256 雜湊金鑰，登錄表內不保存明文金鑰。"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class _Entry:
+    model: object
+    created_at: float
+    last_used: float = field(default=0.0)
+
+
+class ModelRegistry:
+    """以金鑰雜湊為索引的模型登錄表（TTL + LRU 淘汰）。
+
+    第一次取得某金鑰的模型時，以 ``count_tokens`` 這種不產生內容的輕量呼叫驗證金鑰；
+    之後在 TTL 內的 rerun 直接命中快取，不會發出任何網路請求。
+    金鑰無效（``AUTH_ERRORS``）的結果也會短暫記住，避免同一把錯誤金鑰在每次 rerun 都重新探測；
+    其他驗證錯誤不記住，一次暫時性的失敗不會讓有效的金鑰被擋住。
+    """
+
+    def __init__(self, model_name=MODEL_NAME, ttl=3600.0, max_entries=32, failure_ttl=60.0):
+        self.model_name = model_name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.failure_ttl = failure_ttl
+        self._entries = OrderedDict()
+        self._async_entries = OrderedDict()     # {(金鑰雜湊, 事件迴圈): _Entry}
+        self._failures = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.validations = 0
+        self.failures = 0           # 驗證失敗次數（包含暫時性錯誤）
+        self.failure_hits = 0       # 直接以記住的驗證失敗拒絕的次數
+
+    def _build_model(self, api_key):
+        # genai.configure 是全域設定，建立模型後立即綁定專屬 client，
+        # 之後其他金鑰再呼叫 configure 也不會影響這個模型；_rate_key 讓排程器依金鑰限速。
+        genai, genai_client = load_genai()
+        genai.configure(api_key=api_key)
+        model = genai.GenerativeModel(self.model_name)
+        model._client = genai_client.get_default_generative_client()
+        model._rate_key = hash_api_key(api_key)
+        return model
+
+    def _validate(self, model):
+        self.validations += 1
+        model.count_tokens("Hi")
+
+    # === TTL + LRU（呼叫端需持有 self._lock）===
+    def _lookup(self, entries, key, now):
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if now - entry.created_at >= self.ttl:
+            del entries[key]
+            self.evictions += 1
+            return None
+        entries.move_to_end(key)
+        entry.last_used = now
+        return entry.model
+
+    def _store(self, entries, key, model, now):
+        entries[key] = _Entry(model=model, created_at=now, last_used=now)
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_model(self, api_key, validate=True):
+        key = hash_api_key(api_key)
+        now = time.monotonic()
+
+        with self._lock:
+            model = self._lookup(self._entries, key, now)
+            if model is not None:
+                self.hits += 1
+                return model
+
+            failure = self._failures.get(key)
+            if failure is not None:
+                failed_at, error = failure
+                if now - failed_at < self.failure_ttl:
+                    self.failure_hits += 1
+                    raise error
+                del self._failures[key]
+
+            self.misses += 1
+            model = self._build_model(api_key)
+
+        # 網路驗證在鎖外進行，避免一把慢金鑰阻塞其他使用者
+        if validate:
+            try:
+                with span("validate_key"):
+                    self._validate(model)
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                    if isinstance(e, AUTH_ERRORS):
+                        self._failures[key] = (time.monotonic(), e)
+                raise
+
+        with self._lock:
+            self._store(self._entries, key, model, now)
+        return model
+
+    def get_async_model(self, api_key):
+        """取得綁定目前事件迴圈的 async 模型，與同步模型一樣依 TTL 與 LRU 快取；金鑰請先以 ``get_model`` 驗證。"""
+        key = (hash_api_key(api_key), asyncio.get_running_loop())
+        now = time.monotonic()
+        with self._lock:
+            model = self._lookup(self._async_entries, key, now)
+        if model is None:
+            model = self.build_async_model(api_key)
+            with self._lock:
+                self._store(self._async_entries, key, model, now)
+        return model
+
+    def build_async_model(self, api_key):
+        """建立綁定 async client 的模型（給 asyncio 服務使用）。
+
+        grpc 的 async client 綁定建立時的事件迴圈，必須在服務的事件迴圈中呼叫；
+        金鑰請先以 ``get_model`` 驗證。
+        """
+        genai, genai_client = load_genai()
+        with self._lock:
+            genai.configure(api_key=api_key)
+            model = genai.GenerativeModel(self.model_name)
+            model._async_client = genai_client.get_default_generative_async_client()
+            model._rate_key = hash_api_key(api_key)
+        return model
+
+    def invalidate(self, api_key):
+        key = hash_api_key(api_key)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._failures.pop(key, None)
+            for async_key in [k for k in self._async_entries if k[0] == key]:
+                del self._async_entries[async_key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "validations": self.validations,
+                "failures": self.failures,
+                "failure_hits": self.failure_hits,
+                "size": len(self._entries),
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """取得程序層級共用的登錄表（所有 Streamlit session 共用）。"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
+
+
+def set_registry(registry):
+    """替換程序層級的登錄表（例如效能量測時換成本地替身），回傳原本的登錄表。"""
+    global _registry
+    with _registry_lock:
+        previous, _registry = _registry, registry
+        return previous
@@ -0,0 +1,60 @@
+"""資料分析模組共用的小工具：欄位型別判斷、數字格式與以資料雜湊為索引的 LRU 快取。"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def is_numeric(series):
+    """數值欄位（布林欄位雖然也是數字型別，但當作分類處理）。"""
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+
+def format_number(value):
+    """數字四捨五入到小數兩位並去掉多餘的 0（不用科學記號）；其他值原樣轉成字串。"""
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return np.format_float_positional(round(float(value), 2), trim="-")
+    return str(value)
+
+
+class LRUCache:
+    """程序層級共用、執行緒安全的 LRU 快取，超過 ``max_entries`` 時淘汰最久沒用到的項目。
+
+    建立結果的計算在鎖外進行；兩個執行緒同時建立同一個項目時兩份都會算，保留後放入的那份。
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return value
+
+    def get_or_build(self, key, build):
+        """有快取時直接回傳，否則呼叫 ``build()`` 並放入快取。"""
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, build())
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
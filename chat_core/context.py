@@ -0,0 +1,126 @@
+"""多輪對話脈絡：最近 K 輪原文加上較早對話的滾動摘要，讓每次提示詞的長度大致固定。"""
+import threading
+
+from .executor import submit
+from .prompts import estimate_tokens
+from .scheduler import PRIORITY_BACKGROUND, get_scheduler, rate_key
+from .store import get_conversation_store
+from .streaming import request_options
+from .tracing import get_tracer, span
+
+RECENT_TURNS = 4
+TURN_TOKENS = 300           # 最近幾輪中每則訊息最多保留的 token 數
+SUMMARY_TOKENS = 300        # 摘要的 token 上限
+MAX_TURNS_PER_UPDATE = 20   # 單次更新摘要最多讀入的輪數
+SUMMARY_TIMEOUT = 30.0
+
+
+def clip_tokens(text, budget):
+    tokens = estimate_tokens(text)
+    if tokens <= budget:
+        return text
+    return text[:max(1, len(text) * budget // tokens)] + "…"
+
+
+def build_summary_prompt(summary, turns, budget):
+    lines = "\n".join(f"使用者：{t.user}\nGemini：{t.bot}" for t in turns)
+    return (
+        f"以下是一段對話的既有摘要與新增的對話內容。請更新摘要，保留使用者關心的重點、"
+        f"已得到的結論與數字，不超過 {budget} 字，直接輸出摘要。\n\n"
+        f"既有摘要：{summary or '（無）'}\n\n新增對話：\n{lines}"
+    )
+
+
+class ContextManager:
+    """由聊天紀錄組出要放進提示詞的對話脈絡。
+
+    最近 ``recent_turns`` 輪原文保留；更早的對話由背景執行緒逐步併入摘要，
+    摘要更新失敗時沿用舊的摘要，不影響當下的回答。
+    """
+
+    def __init__(self, store, recent_turns=RECENT_TURNS, turn_tokens=TURN_TOKENS, summary_tokens=SUMMARY_TOKENS):
+        self.store = store
+        self.recent_turns = recent_turns
+        self.turn_tokens = turn_tokens
+        self.summary_tokens = summary_tokens
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def build(self, topic_id):
+        """回傳對話脈絡文字；新主題沒有紀錄時回傳空字串。"""
+        with span("context") as s:
+            text = self._build(topic_id)
+            s.record_text("prompt", text)
+        return text
+
+    def _build(self, topic_id):
+        recent = self.store.get_turns(topic_id, limit=self.recent_turns)
+        if not recent:
+            return ""
+
+        lines = []
+        summary = self.store.get_summary(topic_id)
+        if summary is not None:
+            lines.append(f"先前對話摘要：{summary.text}")
+        lines.append("最近的對話：")
+        for turn in reversed(recent):
+            lines.append(f"使用者：{clip_tokens(turn.user, self.turn_tokens)}")
+            lines.append(f"Gemini：{clip_tokens(turn.bot, self.turn_tokens)}")
+        return "\n".join(lines)
+
+    def schedule_update(self, model, topic_id):
+        """在背景把超出最近 K 輪的對話併入摘要；同一主題同時只會有一個更新在進行。"""
+        with self._lock:
+            if topic_id in self._pending:
+                return None
+            self._pending.add(topic_id)
+        return submit(self._update, model, topic_id)
+
+    def _update(self, model, topic_id):
+        # 背景更新可能比觸發它的 rerun 更晚結束，記成獨立的 trace
+        trace = get_tracer().start("summary", root=True)
+        error = None
+        try:
+            recent = self.store.get_turns(topic_id, limit=self.recent_turns)
+            if len(recent) < self.recent_turns:
+                return
+            summary = self.store.get_summary(topic_id)
+            older = self.store.get_turns(
+                topic_id,
+                limit=MAX_TURNS_PER_UPDATE,
+                before_id=recent[-1].id,
+                after_id=summary.upto_id if summary else None,
+                oldest_first=True,
+            )
+            if not older:
+                return
+
+            prompt = build_summary_prompt(summary.text if summary else "", older, self.summary_tokens)
+            trace.record_text("prompt", prompt)
+            response = get_scheduler().call(
+                rate_key(model), model.generate_content, prompt,
+                priority=PRIORITY_BACKGROUND, **request_options(SUMMARY_TIMEOUT),
+            )
+            trace.record_text("response", response.text)
+            trace.record_usage(response)
+            text = clip_tokens(response.text.strip(), self.summary_tokens)
+            if text:
+                self.store.set_summary(topic_id, text, older[-1].id)
+        except Exception as e:
+            error = e
+        finally:
+            trace.end(error)
+            with self._lock:
+                self._pending.discard(topic_id)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_context_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ContextManager(get_conversation_store())
+        return _manager
@@ -0,0 +1,90 @@
+"""模型呼叫的背景執行層：互不相依的請求（例如主題與回答）可以同時送出。"""
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from dataclasses import dataclass
+
+from .prompts import build_title_prompt, clean_title
+from .scheduler import PRIORITY_TITLE, get_scheduler, rate_key
+from .streaming import request_options
+from .tracing import span
+
+MAX_WORKERS = 16
+ANSWER_TIMEOUT = 60.0
+TITLE_TIMEOUT = 8.0
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """程序層級共用的執行緒池；呼叫 Gemini 時大多在等待網路，執行緒即可。"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="gemini")
+        return _executor
+
+
+@dataclass
+class TimedCall:
+    future: object
+    deadline: float
+
+    def result(self, default=None):
+        """在期限內取得結果；逾時或失敗時取消請求並回傳 ``default``。
+
+        已經在執行中的呼叫無法真正中斷，只會被放棄，結果不再被使用。
+        """
+        remaining = max(0.0, self.deadline - time.monotonic())
+        try:
+            return self.future.result(timeout=remaining)
+        except FutureTimeout:
+            self.future.cancel()
+            return default
+        except Exception:
+            return default
+
+    def cancel(self):
+        self.future.cancel()
+
+
+def submit(fn, *args, **kwargs):
+    """丟到執行緒池執行，並帶上目前的 contextvars（例如排程用的 session 代號）。"""
+    context = contextvars.copy_context()
+    return get_executor().submit(context.run, fn, *args, **kwargs)
+
+
+def dispatch(fn, *args, timeout, **kwargs):
+    """把 ``fn`` 丟到執行緒池，回傳帶有截止時間的 TimedCall。"""
+    future = submit(fn, *args, **kwargs)
+    return TimedCall(future=future, deadline=time.monotonic() + timeout)
+
+
+def generate_title(model, user_input, timeout=None):
+    # 主題的優先順序低於回答；排隊超過逾時就放棄，由呼叫端改用本地主題
+    prompt = build_title_prompt(user_input)
+    with span("title") as s:
+        s.record_text("prompt", prompt)
+        response = get_scheduler().call(
+            rate_key(model), model.generate_content, prompt,
+            priority=PRIORITY_TITLE, max_wait=timeout, **request_options(timeout),
+        )
+        s.record_text("response", response.text)
+        s.record_usage(response)
+    return clean_title(response.text)
+
+
+async def generate_title_async(model, user_input, timeout=None):
+    prompt = build_title_prompt(user_input)
+    with span("title") as s:
+        s.record_text("prompt", prompt)
+        response = await get_scheduler().call_async(
+            rate_key(model), model.generate_content_async, prompt,
+            priority=PRIORITY_TITLE, max_wait=timeout, **request_options(timeout),
+        )
+        s.record_text("response", response.text)
+        s.record_usage(response)
+    return clean_title(response.text)
@@ -0,0 +1,129 @@
+"""本地 Gemini 替身：不連網、不花額度，延遲、串流速度與錯誤都可設定，給效能量測與批次測試使用。
+
+依提示詞判斷請求種類並回傳對應格式的內容：
+
+* 查詢規劃：回傳適用於任何資料表的 ``describe`` 查詢規格。
+* 主題生成：回傳問題的前幾個字。
+* 其他（回答、摘要）：回傳固定長度的文字，串流時依 ``chunk_rate`` 逐段送出。
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+from google.api_core import exceptions as google_exceptions
+
+from .client import MODEL_NAME
+from .scheduler import current_session
+
+FAKE_MODEL_NAME = f"fake/{MODEL_NAME}"    # 與真實模型區分，批次紀錄與快取索引都不會混在一起
+PLAN_SPEC = '```json\n{"op": "describe"}\n```'
+
+
+@dataclass
+class FakeResponse:
+    text: str
+
+
+class FakeGenerativeModel:
+    """模擬 ``genai.GenerativeModel`` 的 ``generate_content`` / ``generate_content_async`` / ``count_tokens``。
+
+    ``latency`` 為收到第一段文字前的延遲（秒）；``chunk_rate`` 為串流每秒送出的片段數；
+    ``error_rate`` 的機率在送出任何文字前丟出 ``error``（預設為 429）。
+    """
+
+    def __init__(self, latency=0.3, chunk_rate=40.0, chunk_chars=8, answer_chars=400,
+                 error_rate=0.0, error=google_exceptions.TooManyRequests, seed=None):
+        self.model_name = FAKE_MODEL_NAME
+        self.latency = latency
+        self.chunk_rate = chunk_rate
+        self.chunk_chars = chunk_chars
+        self.answer_chars = answer_chars
+        self.error_rate = error_rate
+        self.error = error
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._rate_key = "fake"
+        self.calls = 0
+        self.errors = 0
+        self.calls_by_session = Counter()
+
+    def _begin(self):
+        with self._lock:
+            self.calls += 1
+            self.calls_by_session[current_session()] += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if failed:
+            raise self.error("fake model: injected error")
+
+    def _reply(self, prompt):
+        if "查詢規劃器" in prompt:
+            return PLAN_SPEC
+        if "產生一個簡短主題" in prompt:
+            start = prompt.find("「") + 1
+            return prompt[start:start + 6] or "測試主題"
+        # 回答內容帶上問題的結尾，讓不同問題的回答不同
+        tail = prompt[-40:].replace("\n", " ")
+        return (f"（模擬回覆）{tail} " * (self.answer_chars // 40 + 1))[:self.answer_chars]
+
+    def _chunks(self, text):
+        return [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+
+    def generate_content(self, contents, stream=False, request_options=None, **kwargs):
+        self._begin()
+        text = self._reply(str(contents))
+        time.sleep(self.latency)
+        if not stream:
+            time.sleep(len(self._chunks(text)) / self.chunk_rate)
+            return FakeResponse(text)
+
+        def iterate():
+            for i, chunk in enumerate(self._chunks(text)):
+                if i:
+                    time.sleep(1 / self.chunk_rate)
+                yield FakeResponse(chunk)
+        return iterate()
+
+    async def generate_content_async(self, contents, stream=False, request_options=None, **kwargs):
+        self._begin()
+        text = self._reply(str(contents))
+        await asyncio.sleep(self.latency)
+        if not stream:
+            await asyncio.sleep(len(self._chunks(text)) / self.chunk_rate)
+            return FakeResponse(text)
+
+        async def iterate():
+            for i, chunk in enumerate(self._chunks(text)):
+                if i:
+                    await asyncio.sleep(1 / self.chunk_rate)
+                yield FakeResponse(chunk)
+        return iterate()
+
+    def count_tokens(self, contents):
+        return None
+
+
+class FakeModelRegistry:
+    """與 ModelRegistry 相同介面，任何金鑰都回傳同一個替身模型。"""
+
+    def __init__(self, model=None):
+        self.model = model or FakeGenerativeModel()
+
+    def get_model(self, api_key, validate=True):
+        return self.model
+
+    def build_async_model(self, api_key):
+        return self.model
+
+    def get_async_model(self, api_key):
+        return self.model
+
+    def invalidate(self, api_key):
+        pass
+
+    def stats(self):
+        return {"hits": 0, "misses": 0, "evictions": 0, "validations": 0, "failures": 0, "failure_hits": 0, "size": 1}
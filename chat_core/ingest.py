@@ -0,0 +1,527 @@
+"""CSV 讀取與快取：以檔案內容雜湊為索引，同一份資料在整個程序中只解析一次。
+
+解析時先從檔案開頭取樣判斷編碼（UTF-8 以外的檔案交給 chardet，Big5 以 CP950 解讀）與分隔符號，
+再分塊讀取：每一塊先壓縮型別才保留，第一塊讀完就可以顯示預覽，欄位統計也逐塊累計。
+列數與檔案大小都有上限，超過列數上限時只保留前面的資料列。
+"""
+import codecs
+import csv
+import hashlib
+import io
+import math
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from .common import is_numeric
+from .tracing import span
+
+try:  # Parquet 落地需要 pyarrow，沒有安裝時只使用記憶體快取
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+try:  # 沒有 chardet 時，非 UTF-8 的檔案依序嘗試 ENCODING_FALLBACKS
+    import chardet
+except ImportError:
+    chardet = None
+
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+DEFAULT_SPILL_DIR = os.path.join(".cache", "frames")
+DEFAULT_SPILL_BUDGET = 2 * 1024 * 1024 * 1024
+MAX_UPLOAD_HASHES = 1024
+MAX_PATH_HASHES = 1024
+CATEGORY_RATIO = 0.5
+
+CHUNK_ROWS = 100_000
+SNIFF_BYTES = 64 * 1024
+DEFAULT_MAX_ROWS = 5_000_000
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DELIMITERS = ",;\t|"
+# chardet 回報的編碼改用相容的超集，Big5 檔案常混有 CP950 才有的字
+ENCODING_ALIASES = {"ascii": "utf-8", "big5": "cp950", "gb2312": "gb18030", "gbk": "gb18030"}
+ENCODING_FALLBACKS = ("cp950", "gb18030", "latin-1")
+HASH_BLOCK = 1024 * 1024
+
+
+class IngestError(ValueError):
+    """檔案超過大小上限或無法以偵測到的編碼解讀。"""
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path):
+    """以固定大小的區塊計算檔案雜湊，結果與 ``content_hash`` 相同但不必整份讀進記憶體。"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sniff_encoding(sample, complete=False):
+    """判斷取樣內容的編碼；``complete`` 表示取樣就是整份檔案（結尾沒有被截斷的字元）。"""
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=complete)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    if chardet is not None:
+        detected = (chardet.detect(sample).get("encoding") or "").lower()
+        if detected:
+            return ENCODING_ALIASES.get(detected, detected)
+    for encoding in ENCODING_FALLBACKS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=complete)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return "latin-1"
+
+
+def sniff_delimiter(sample, encoding):
+    """從取樣的完整資料列判斷分隔符號，無法判斷時使用逗號。"""
+    text = sample.decode(encoding, errors="ignore")
+    lines = text.splitlines()
+    if len(lines) > 1:
+        lines = lines[:-1]      # 最後一列可能被取樣截斷
+    try:
+        return csv.Sniffer().sniff("\n".join(lines), delimiters=DELIMITERS).delimiter
+    except csv.Error:
+        return ","
+
+
+def optimize_dtypes(df, categories=None):
+    """低基數文字欄轉 category（例如 Gender），數值欄往下轉成最小可容納且不失真的型別。
+
+    ``categories`` 指定要轉成 category 的欄位；None 時依各欄的基數判斷。
+    分塊解析時以第一塊的判斷結果套用到之後每一塊，合併後欄位型別才會一致。
+    """
+    df = df.copy()
+    for col in df.columns:
+        series = df[col]
+        if categories is not None and col in categories:
+            df[col] = series.astype("category")
+            continue
+        if pd.api.types.is_bool_dtype(series):
+            continue
+        if pd.api.types.is_integer_dtype(series):
+            df[col] = pd.to_numeric(series, downcast="integer")
+        elif pd.api.types.is_float_dtype(series):
+            # 只有轉換不失真時才用 float32，避免 22.3 之類的數值在統計結果中變成 22.299999
+            downcast = pd.to_numeric(series, downcast="float")
+            if downcast.dtype != series.dtype and downcast.astype(series.dtype).equals(series):
+                df[col] = downcast
+        elif categories is None and (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+            if len(series) and series.nunique(dropna=True) / len(series) <= CATEGORY_RATIO:
+                df[col] = series.astype("category")
+    return df
+
+
+def frame_nbytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+def concat_chunks(chunks):
+    """合併分塊解析的結果；各塊都是 category 的欄位合併類別後仍保持 category。"""
+    if len(chunks) == 1:
+        return chunks[0]
+    columns = {}
+    for col in chunks[0].columns:
+        parts = [chunk[col] for chunk in chunks]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            try:
+                columns[col] = pd.Series(union_categoricals(parts), name=col)
+            except TypeError:
+                # 某一塊的類別型別不同（例如整塊缺值），改以文字合併後再轉回 category
+                parts = [part.astype(object) for part in parts]
+                columns[col] = pd.concat(parts, ignore_index=True).astype("category")
+        else:
+            parts = [part.astype(object) if isinstance(part.dtype, pd.CategoricalDtype) else part for part in parts]
+            columns[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+class RunningStats:
+    """逐塊累計的欄位統計（缺值、數值欄的最小、平均、最大），解析途中就能顯示。"""
+
+    def __init__(self):
+        self.rows = 0
+        self._columns = {}      # {欄位: [型別, 缺值, 非空數值個數, 總和, 最小, 最大]}
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        for col in chunk.columns:
+            series = chunk[col]
+            entry = self._columns.setdefault(col, [str(series.dtype), 0, 0, 0.0, math.inf, -math.inf])
+            entry[0] = str(series.dtype)
+            entry[1] += int(series.isna().sum())
+            if is_numeric(series):
+                values = series.dropna()
+                if len(values):
+                    entry[2] += len(values)
+                    entry[3] += float(values.sum())
+                    entry[4] = min(entry[4], float(values.min()))
+                    entry[5] = max(entry[5], float(values.max()))
+
+    def to_frame(self):
+        records = []
+        for col, (dtype, nulls, count, total, low, high) in self._columns.items():
+            record = {"欄位": col, "型別": dtype, "缺值": nulls}
+            if count:
+                record.update({"min": low, "mean": round(total / count, 4), "max": high})
+            records.append(record)
+        return pd.DataFrame(records)
+
+
+@dataclass
+class IngestProgress:
+    """每解析完一塊回報一次；``preview`` 是第一塊的前幾列。"""
+    rows: int
+    bytes_read: int
+    total_bytes: int
+    encoding: str
+    delimiter: str
+    preview: pd.DataFrame
+    stats: RunningStats
+
+    def describe(self):
+        text = f"已讀取 {self.rows:,} 列"
+        if self.total_bytes:
+            text += f"（{self.bytes_read / 1e6:.1f} / {self.total_bytes / 1e6:.1f} MB）"
+        delimiter = "Tab" if self.delimiter == "\t" else self.delimiter
+        return f"{text}，編碼 {self.encoding}，分隔符號「{delimiter}」"
+
+
+def read_csv_chunked(f, total_bytes=None, max_rows=DEFAULT_MAX_ROWS, chunk_rows=CHUNK_ROWS,
+                     on_progress=None, **read_csv_kwargs):
+    """從可 seek 的二進位檔案分塊解析 CSV。
+
+    ``encoding`` / ``sep`` 沒有指定時由取樣判斷。結果的 ``df.attrs`` 記錄
+    ``encoding``、``delimiter`` 與 ``truncated``（是否因列數上限而只保留前面的資料列）。
+    """
+    start = f.tell()
+    sample = f.read(SNIFF_BYTES)
+    f.seek(start)
+    encoding = read_csv_kwargs.pop("encoding", None) or sniff_encoding(sample, complete=len(sample) < SNIFF_BYTES)
+    delimiter = read_csv_kwargs.pop("sep", None) or sniff_delimiter(sample, encoding)
+
+    stats = RunningStats()
+    chunks = []
+    categories = None
+    preview = None
+    truncated = False
+    try:
+        with pd.read_csv(f, encoding=encoding, sep=delimiter, chunksize=chunk_rows, **read_csv_kwargs) as reader:
+            for chunk in reader:
+                if stats.rows + len(chunk) > max_rows:
+                    chunk = chunk.iloc[:max_rows - stats.rows]
+                    truncated = True
+                # 每塊先壓縮型別再保留，尖峰記憶體約為壓縮後的資料加上一塊原始資料
+                chunk = optimize_dtypes(chunk, categories)
+                if categories is None:
+                    categories = {col for col in chunk.columns if isinstance(chunk[col].dtype, pd.CategoricalDtype)}
+                chunks.append(chunk)
+                stats.update(chunk)
+                if preview is None:
+                    preview = chunk.head()
+                if on_progress is not None:
+                    on_progress(IngestProgress(
+                        stats.rows, f.tell() - start, total_bytes, encoding, delimiter, preview, stats,
+                    ))
+                if truncated:
+                    break
+    except UnicodeDecodeError as e:
+        raise IngestError(f"無法以 {encoding} 編碼解讀檔案：{e}") from e
+
+    df = concat_chunks(chunks) if chunks else pd.DataFrame()
+    df.attrs.update(encoding=encoding, delimiter=delimiter, truncated=truncated)
+    return df
+
+
+class FrameCache:
+    """依內容雜湊保存已解析 DataFrame 的 LRU 快取，以總記憶體量為上限。
+
+    快取中的 DataFrame 由所有 session 共用，呼叫端不可原地修改。
+    設定 ``spill_dir`` 且有 pyarrow 時，解析結果另存為 Parquet，
+    程序重啟或被淘汰後再次讀取時以 memory map 載入，不必重新解析 CSV；
+    落地檔案的總大小超過 ``spill_budget`` 時依最後使用時間刪除最舊的檔案。
+    多個執行緒同時載入同一份資料時只有一個實際解析，其他的等它完成後直接取用快取。
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, spill_dir=DEFAULT_SPILL_DIR,
+                 max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES, spill_budget=DEFAULT_SPILL_BUDGET):
+        for name, value in (("memory_budget", memory_budget), ("max_rows", max_rows),
+                            ("max_bytes", max_bytes), ("spill_budget", spill_budget)):
+            if value <= 0:
+                raise ValueError(f"{name} 必須大於 0（目前為 {value}）")
+        self.memory_budget = memory_budget
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir if HAS_PYARROW else None
+        self.spill_budget = spill_budget
+        self._frames = OrderedDict()     # {hash: (df, nbytes)}
+        self._path_hashes = OrderedDict()    # {(path, mtime, size): hash}
+        self._upload_hashes = OrderedDict()  # {(file_id, size): hash}
+        self._loading = {}                   # {載入中的索引: threading.Event}
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.spill_hits = 0
+        self.spill_evictions = 0
+        self.evictions = 0
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.parquet")
+
+    def _get(self, key):
+        with self._lock:
+            item = self._frames.get(key)
+            if item is not None:
+                self._frames.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            self.misses += 1
+        return None
+
+    def _put(self, key, df):
+        nbytes = frame_nbytes(df)
+        with self._lock:
+            if key in self._frames:
+                return self._frames[key][0]
+            self._frames[key] = (df, nbytes)
+            self.nbytes += nbytes
+            # 至少保留剛放入的這一份
+            while self.nbytes > self.memory_budget and len(self._frames) > 1:
+                _, (_, evicted) = self._frames.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+        return df
+
+    def _load_spill(self, key):
+        if self.spill_dir is None:
+            return None
+        path = self._spill_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            df = pd.read_parquet(path, memory_map=True)
+        except Exception:
+            return None
+        try:
+            os.utime(path)          # 修改時間即最後使用時間，供落地檔案的 LRU 淘汰使用
+        except OSError:
+            pass
+        self.spill_hits += 1
+        return df
+
+    def _spill(self, key, df):
+        if self.spill_dir is None:
+            return
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            tmp_path = self._spill_path(key) + ".tmp"
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self._spill_path(key))
+            self._trim_spill(key)
+        except Exception:
+            # 落地只是加速用，失敗不影響讀取結果
+            pass
+
+    def _trim_spill(self, keep):
+        """落地檔案總大小超過上限時，從最久沒用到的檔案開始刪除（至少保留剛寫入的 ``keep``）。"""
+        files = []
+        with os.scandir(self.spill_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".parquet") and entry.name != f"{keep}.parquet":
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files) + os.path.getsize(self._spill_path(keep))
+        for _, size, path in sorted(files):
+            if total <= self.spill_budget:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.spill_evictions += 1
+
+    def get(self, key):
+        """依內容雜湊取得已解析的 DataFrame（包含落地的 Parquet）；不存在時回傳 None。"""
+        df = self._get(key)
+        if df is None:
+            df = self._load_spill(key)
+            if df is not None:
+                df = self._put(key, df)
+        return df
+
+    def _coalesce(self, flight_key, load):
+        """同一個 ``flight_key`` 同時只讓一個執行緒執行 ``load()``。
+
+        其他執行緒等它結束後再自己呼叫 ``load()``，這時通常已能直接命中快取；
+        先執行的那次失敗時，等待的執行緒會各自重試並得到自己的錯誤。
+        """
+        with self._lock:
+            event = self._loading.get(flight_key)
+            leader = event is None
+            if leader:
+                event = self._loading[flight_key] = threading.Event()
+        if not leader:
+            event.wait()
+            return load()
+        try:
+            return load()
+        finally:
+            with self._lock:
+                del self._loading[flight_key]
+            event.set()
+
+    def _check_size(self, nbytes):
+        if nbytes > self.max_bytes:
+            raise IngestError(f"檔案大小 {nbytes / 1e6:.1f} MB 超過上限 {self.max_bytes / 1e6:.0f} MB")
+
+    def _parse(self, key, f, total_bytes, on_progress, read_csv_kwargs):
+        df = self._load_spill(key)
+        if df is None:
+            with span("read_csv", bytes=total_bytes) as s:
+                df = read_csv_chunked(
+                    f, total_bytes, max_rows=self.max_rows, on_progress=on_progress, **read_csv_kwargs,
+                )
+                s.set(rows=len(df), columns=len(df.columns), **df.attrs)
+            self._spill(key, df)
+        return self._put(key, df)
+
+    def load_bytes(self, data, on_progress=None, **read_csv_kwargs):
+        """回傳 (DataFrame, 內容雜湊)；``on_progress`` 在每解析完一塊時收到 ``IngestProgress``。"""
+        self._check_size(len(data))
+        key = content_hash(data)
+        df = self._get(key)
+        if df is not None:
+            return df, key
+
+        def load():
+            df = self._get(key)
+            if df is None:
+                df = self._parse(key, io.BytesIO(data), len(data), on_progress, read_csv_kwargs)
+            return df
+
+        return self._coalesce(key, load), key
+
+    def load_upload(self, upload, on_progress=None, **read_csv_kwargs):
+        """讀取 Streamlit 的 UploadedFile。
+
+        同一個上傳檔案每次 rerun 都會再傳進來；以 (file_id, 大小) 記住雜湊，
+        命中時不必再取出整份內容重新計算雜湊。
+        """
+        upload_key = (getattr(upload, "file_id", None), getattr(upload, "size", None))
+        if upload_key[0] is not None:
+            with self._lock:
+                key = self._upload_hashes.get(upload_key)
+                if key is not None:
+                    self._upload_hashes.move_to_end(upload_key)
+            if key is not None:
+                df = self.get(key)
+                if df is not None:
+                    return df, key
+
+        df, key = self.load_bytes(upload.getvalue(), on_progress=on_progress, **read_csv_kwargs)
+        if upload_key[0] is not None:
+            with self._lock:
+                self._upload_hashes[upload_key] = key
+                while len(self._upload_hashes) > MAX_UPLOAD_HASHES:
+                    self._upload_hashes.popitem(last=False)
+        return df, key
+
+    def load_path(self, path, on_progress=None, **read_csv_kwargs):
+        # 本機檔案以 (路徑, 修改時間, 大小) 記住雜湊，檔案沒變就不必重新讀取內容
+        stat = os.stat(path)
+        self._check_size(stat.st_size)
+        stat_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        key = self._path_hash(stat_key)
+        if key is not None:
+            df = self._get(key)
+            if df is not None:
+                return df, key
+        return self._coalesce(stat_key, lambda: self._load_path(path, stat_key, on_progress, read_csv_kwargs))
+
+    def _path_hash(self, stat_key):
+        with self._lock:
+            key = self._path_hashes.get(stat_key)
+            if key is not None:
+                self._path_hashes.move_to_end(stat_key)
+            return key
+
+    def _load_path(self, path, stat_key, on_progress, read_csv_kwargs):
+        # 雜湊與解析都直接從檔案分段讀取，不必整份載入記憶體
+        key = self._path_hash(stat_key)
+        if key is None:
+            key = file_hash(path)
+        df = self._get(key)
+        if df is None:
+            with open(path, "rb") as f:
+                df = self._parse(key, f, stat_key[2], on_progress, read_csv_kwargs)
+        with self._lock:
+            self._path_hashes[stat_key] = key
+            self._path_hashes.move_to_end(stat_key)
+            while len(self._path_hashes) > MAX_PATH_HASHES:
+                self._path_hashes.popitem(last=False)
+        return df, key
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "spill_hits": self.spill_hits,
+                "spill_evictions": self.spill_evictions,
+                "evictions": self.evictions,
+                "frames": len(self._frames),
+                "nbytes": self.nbytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_frame_cache():
+    """程序層級共用的 DataFrame 快取；第一次取得時讀取 ``CHAT_MEMORY_BUDGET``、``CHAT_SPILL_BUDGET``、
+    ``CHAT_MAX_BYTES``（皆為位元組數）與 ``CHAT_MAX_ROWS`` 設定。"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = FrameCache(
+                    memory_budget=int(os.getenv("CHAT_MEMORY_BUDGET") or DEFAULT_MEMORY_BUDGET),
+                    spill_budget=int(os.getenv("CHAT_SPILL_BUDGET") or DEFAULT_SPILL_BUDGET),
+                    max_rows=int(os.getenv("CHAT_MAX_ROWS") or DEFAULT_MAX_ROWS),
+                    max_bytes=int(os.getenv("CHAT_MAX_BYTES") or DEFAULT_MAX_BYTES),
+                )
+            except ValueError as e:
+                raise ValueError(
+                    f"CHAT_MEMORY_BUDGET / CHAT_SPILL_BUDGET / CHAT_MAX_ROWS / CHAT_MAX_BYTES 設定錯誤：{e}"
+                ) from e
+        return _cache
+
+
+def load_csv(source, on_progress=None):
+    """讀取上傳的檔案（Streamlit UploadedFile）或本機路徑，回傳 (DataFrame, 內容雜湊)。
+
+    ``on_progress`` 只在實際解析時呼叫（快取命中時不會）。
+    """
+    cache = get_frame_cache()
+    with span("ingest"):
+        if isinstance(source, (str, os.PathLike)):
+            return cache.load_path(source, on_progress=on_progress)
+        return cache.load_upload(source, on_progress=on_progress)
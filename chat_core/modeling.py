@@ -0,0 +1,201 @@
+"""本地預測模型：在完整資料上訓練 scikit-learn 模型回答「身高 175、體重 80 的人穿幾號鞋」這類問題。
+
+模型依 (資料雜湊, 目標欄, 特徵欄) 快取，同一份資料的同一種問題只訓練一次，之後每次預測只需幾毫秒。
+數值目標用線性迴歸，文字目標用邏輯迴歸；訓練時留一部分資料評估，回答會附上 R² 或準確率。
+"""
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .common import LRUCache, format_number, is_numeric
+from .tracing import span
+
+MAX_MODELS = 32
+MAX_TRAIN_ROWS = 200_000
+MIN_TRAIN_ROWS = 10
+MAX_CLASSES = 50
+TEST_FRACTION = 0.2
+RANDOM_STATE = 0
+
+
+class ModelingError(ValueError):
+    """資料不足或欄位不適合訓練預測模型。"""
+
+
+@dataclass
+class Prediction:
+    target: str
+    kind: str                   # regression / classification
+    value: object
+    inputs: dict
+    interval: float = None      # 迴歸：約 95% 的預測誤差範圍（±）
+    probability: float = None   # 分類：預測類別的機率
+    score: float = None         # 迴歸為 R²，分類為準確率（留出資料上評估）
+    train_rows: int = 0
+
+    def to_frame(self):
+        record = {"目標欄位": self.target, "預測值": self.value}
+        if self.interval is not None:
+            record["誤差範圍"] = f"±{format_number(self.interval)}"
+        if self.probability is not None:
+            record["機率"] = round(self.probability, 4)
+        if self.score is not None:
+            record["R²" if self.kind == "regression" else "準確率"] = round(self.score, 4)
+        record["訓練筆數"] = self.train_rows
+        record.update({f"輸入：{col}": value for col, value in self.inputs.items()})
+        return pd.DataFrame([record])
+
+    def to_text(self):
+        conditions = "、".join(f"{col} 為 {format_number(value)}" for col, value in self.inputs.items())
+        if self.kind == "regression":
+            text = f"依資料中 {self.train_rows:,} 筆紀錄以線性迴歸推估，{conditions} 時，{self.target} 約為 {format_number(self.value)}"
+            if self.interval is not None:
+                text += f"（約 95% 落在 ±{format_number(self.interval)} 之內）"
+            if self.score is not None:
+                text += f"。模型在留出資料上的 R² 為 {self.score:.2f}"
+        else:
+            text = f"依資料中 {self.train_rows:,} 筆紀錄以邏輯迴歸推估，{conditions} 時，{self.target} 最可能是 {self.value}"
+            if self.probability is not None:
+                text += f"（機率 {self.probability:.0%}）"
+            if self.score is not None:
+                text += f"。模型在留出資料上的準確率為 {self.score:.0%}"
+        return text + "。"
+
+
+class FittedModel:
+    def __init__(self, target, features, numeric, kind, pipeline, score, rmse, train_rows, fit_seconds):
+        self.target = target
+        self.features = features
+        self.numeric = numeric
+        self.kind = kind
+        self.pipeline = pipeline
+        self.score = score
+        self.rmse = rmse
+        self.train_rows = train_rows
+        self.fit_seconds = fit_seconds
+
+    def predict(self, inputs):
+        """``inputs`` 為 {特徵欄: 值}，缺少的特徵以訓練資料的中位數或眾數補上。"""
+        row = pd.DataFrame([{col: inputs.get(col, np.nan) for col in self.features}])
+        row = _prepare_features(row, self.numeric)
+        value = self.pipeline.predict(row)[0]
+        prediction = Prediction(
+            target=self.target, kind=self.kind, value=value, score=self.score, train_rows=self.train_rows,
+            inputs={col: inputs[col] for col in self.features if col in inputs},
+        )
+        if self.kind == "regression":
+            prediction.value = float(value)
+            if self.rmse is not None:
+                prediction.interval = 1.96 * self.rmse
+        else:
+            prediction.probability = float(self.pipeline.predict_proba(row)[0].max())
+        return prediction
+
+
+def _prepare_features(frame, numeric):
+    """數值特徵轉成 float，其餘轉成 object，讓 scikit-learn 的補值與編碼器都能處理。"""
+    frame = frame.copy()
+    for col in frame.columns:
+        if col in numeric:
+            frame[col] = pd.to_numeric(frame[col], errors="coerce").astype("float64")
+        else:
+            frame[col] = frame[col].astype(object).where(frame[col].notna(), np.nan)
+    return frame
+
+
+def fit_model(df, target, features):
+    """在 ``df`` 上訓練以 ``features`` 預測 ``target`` 的模型。"""
+    # 只有第一次訓練模型時才載入 scikit-learn
+    from sklearn.compose import ColumnTransformer
+    from sklearn.impute import SimpleImputer
+    from sklearn.linear_model import LinearRegression, LogisticRegression
+    from sklearn.metrics import accuracy_score, mean_squared_error, r2_score
+    from sklearn.model_selection import train_test_split
+    from sklearn.pipeline import Pipeline, make_pipeline
+    from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+    missing = [col for col in [target, *features] if col not in df.columns]
+    if missing:
+        raise ModelingError(f"欄位不存在：{missing}")
+    if not features or target in features:
+        raise ModelingError("需要至少一個與目標不同的特徵欄位")
+
+    data = df[[*features, target]].dropna(subset=[target])
+    if len(data) > MAX_TRAIN_ROWS:
+        data = data.sample(MAX_TRAIN_ROWS, random_state=RANDOM_STATE)
+    if len(data) < MIN_TRAIN_ROWS:
+        raise ModelingError(f"目標欄位有值的資料只有 {len(data)} 筆，不足以訓練模型")
+
+    y = data[target]
+    if is_numeric(y):
+        kind = "regression"
+        y = y.astype("float64")
+        estimator = LinearRegression()
+    else:
+        kind = "classification"
+        y = y.astype(str)
+        if y.nunique() > MAX_CLASSES:
+            raise ModelingError(f"{target} 有 {y.nunique()} 種不同的值，不適合作為分類目標")
+        if y.nunique() < 2:
+            raise ModelingError(f"{target} 只有一種值，不需要預測")
+        estimator = LogisticRegression(max_iter=1000)
+
+    numeric = [col for col in features if is_numeric(data[col])]
+    categorical = [col for col in features if col not in numeric]
+    X = _prepare_features(data[features], numeric)
+    pipeline = Pipeline([
+        ("features", ColumnTransformer([
+            ("numeric", make_pipeline(SimpleImputer(strategy="median"), StandardScaler()), numeric),
+            ("categorical", make_pipeline(
+                SimpleImputer(strategy="most_frequent"), OneHotEncoder(handle_unknown="ignore"),
+            ), categorical),
+        ])),
+        ("model", estimator),
+    ])
+
+    start = time.perf_counter()
+    score = rmse = None
+    try:
+        # 資料夠多時先在留出的資料上評估，再用全部資料重新訓練
+        if len(data) >= 2 * MIN_TRAIN_ROWS:
+            stratify = y if kind == "classification" and y.value_counts().min() >= 2 else None
+            X_train, X_test, y_train, y_test = train_test_split(
+                X, y, test_size=TEST_FRACTION, random_state=RANDOM_STATE, stratify=stratify,
+            )
+            predicted = pipeline.fit(X_train, y_train).predict(X_test)
+            if kind == "regression":
+                score = float(r2_score(y_test, predicted))
+                rmse = float(np.sqrt(mean_squared_error(y_test, predicted)))
+            else:
+                score = float(accuracy_score(y_test, predicted))
+        pipeline.fit(X, y)
+    except ValueError as e:
+        raise ModelingError(f"模型訓練失敗：{e}") from e
+    return FittedModel(
+        target, list(features), numeric, kind, pipeline, score, rmse, len(data), time.perf_counter() - start,
+    )
+
+
+_models = LRUCache(MAX_MODELS)
+
+
+def get_fitted_model(df, dataset_hash, target, features):
+    """取得預測模型；有內容雜湊時依 (雜湊, 目標欄, 特徵欄) 快取，同一種問題只訓練一次。"""
+    features = sorted(features, key=str)
+    if dataset_hash is None:
+        return fit_model(df, target, features)
+
+    def build():
+        with span("fit_model", rows=len(df), target=str(target), features=len(features)):
+            return fit_model(df, target, features)
+
+    return _models.get_or_build((dataset_hash, target, tuple(features)), build)
+
+
+def predict(df, dataset_hash, target, inputs):
+    """以 ``inputs`` 的欄位作為特徵預測 ``target``，回傳 Prediction。"""
+    model = get_fitted_model(df, dataset_hash, target, list(inputs))
+    with span("predict"):
+        return model.predict(inputs)
@@ -0,0 +1,57 @@
+"""回答前的資料準備：Streamlit 腳本與 HTTP 服務共用同一套流程。"""
+import asyncio
+
+from .profiling import get_profile
+from .query import plan_and_run, plan_and_run_async
+from .retrieval import relevant_rows
+from .tracing import span
+
+
+def prepare_data(model, df, dataset_hash, question, history_text="", query_mode=True):
+    """回傳 (資料概況, 查詢結果, 相關資料列)；沒有資料時三者皆為 None。
+
+    查詢模式下先請模型規劃查詢、在完整資料上計算；規劃或計算失敗（任何例外）、問題與資料無關時查詢結果為 None，
+    呼叫端改用資料概況，並附上依問題挑出的相關資料列（對不上任何資料列時為 None）。
+    查詢結果帶有 ``answer`` 時（本地模型的預測）可以直接作為回覆。
+    """
+    if df is None:
+        return None, None, None
+
+    with span("prepare_data", rows=len(df), query_mode=query_mode) as s:
+        # 每份資料只算一次的欄位統計，取代原本貼上前 10 筆資料
+        profile = get_profile(df, dataset_hash)
+        query_result = None
+        if query_mode:
+            try:
+                query_result = plan_and_run(
+                    model, df, question, schema=profile.schema_text(), context=history_text,
+                    dataset_hash=dataset_hash,
+                )
+            except Exception as e:
+                # 規格不合法、規劃呼叫逾時、配額用盡或被安全機制擋下時都退回資料概況
+                s.set(query_error=f"{type(e).__name__}: {e}")
+        # 有計算結果時不需要原始資料列
+        rows = relevant_rows(df, dataset_hash, question) if query_result is None else None
+    return profile, query_result, rows
+
+
+async def prepare_data_async(model, df, dataset_hash, question, history_text="", query_mode=True):
+    """``prepare_data`` 的非同步版本，給 HTTP 服務使用。"""
+    if df is None:
+        return None, None, None
+
+    with span("prepare_data", rows=len(df), query_mode=query_mode) as s:
+        profile = await asyncio.to_thread(get_profile, df, dataset_hash)
+        query_result = None
+        if query_mode:
+            try:
+                query_result = await plan_and_run_async(
+                    model, df, question, schema=profile.schema_text(), context=history_text,
+                    dataset_hash=dataset_hash,
+                )
+            except Exception as e:
+                s.set(query_error=f"{type(e).__name__}: {e}")
+        rows = None
+        if query_result is None:
+            rows = await asyncio.to_thread(relevant_rows, df, dataset_hash, question)
+    return profile, query_result, rows
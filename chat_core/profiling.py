@@ -0,0 +1,157 @@
+"""資料概況：每份資料只計算一次的欄位統計，用精簡文字取代把原始資料列貼進提示詞。"""
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from .common import LRUCache, format_number
+from .tracing import span
+
+HISTOGRAM_BINS = 10
+TOP_VALUES = 10
+MAX_PROFILES = 32
+QUANTILES = (0.25, 0.5, 0.75)
+MAX_HISTOGRAM_COLUMNS = 20      # 欄位很多時提示詞裡省略分布，避免概況本身過長
+
+
+@dataclass
+class ColumnProfile:
+    name: str
+    dtype: str
+    kind: str                   # numeric / categorical / datetime
+    count: int
+    nulls: int
+    unique: int
+    stats: dict = field(default_factory=dict)        # min/max/mean/std/p25/p50/p75
+    top_values: list = field(default_factory=list)   # [(值, 次數)]
+    histogram: list = field(default_factory=list)    # [(下界, 上界, 次數)]
+
+    def to_text(self, histogram=True):
+        head = f"- {self.name}（{self.dtype}，缺值 {self.nulls}）"
+        if self.kind == "numeric" and self.stats:
+            s = {k: format_number(v) for k, v in self.stats.items()}
+            text = (
+                f"{head}：平均 {s['mean']}，標準差 {s['std']}，最小 {s['min']}，"
+                f"P25 {s['p25']}，中位數 {s['p50']}，P75 {s['p75']}，最大 {s['max']}"
+            )
+            if histogram and self.histogram:
+                bins = "、".join(f"{format_number(lo)}~{format_number(hi)}:{n}" for lo, hi, n in self.histogram)
+                text += f"；分布 {bins}"
+            return text
+        if self.kind == "datetime" and self.stats:
+            return f"{head}：{self.stats['min']} ~ {self.stats['max']}"
+        values = "、".join(f"{v} {n}" for v, n in self.top_values)
+        return f"{head}：{self.unique} 種值，最常見 {values}"
+
+
+@dataclass
+class DatasetProfile:
+    rows: int
+    nbytes: int
+    columns: list
+
+    def to_text(self):
+        """注入提示詞用的精簡文字。"""
+        lines = [f"資料概況：共 {self.rows} 筆、{len(self.columns)} 個欄位"]
+        histogram = len(self.columns) <= MAX_HISTOGRAM_COLUMNS
+        lines.extend(col.to_text(histogram) for col in self.columns)
+        return "\n".join(lines)
+
+    def schema_text(self):
+        """只有欄位、型別與值域的簡短說明（給查詢規劃用）。"""
+        lines = []
+        for col in self.columns:
+            if col.kind == "numeric" and col.stats:
+                detail = f"範圍 {format_number(col.stats['min'])} ~ {format_number(col.stats['max'])}"
+            elif col.kind == "datetime" and col.stats:
+                detail = f"範圍 {col.stats['min']} ~ {col.stats['max']}"
+            else:
+                detail = "值例如 " + ", ".join(str(v) for v, _ in col.top_values)
+            lines.append(f"- {col.name} ({col.dtype})：{detail}")
+        return "\n".join(lines)
+
+    def to_frame(self):
+        """給 UI 資料預覽顯示的表格。"""
+        records = []
+        for col in self.columns:
+            record = {"欄位": col.name, "型別": col.dtype, "缺值": col.nulls, "不同值": col.unique}
+            if col.kind == "numeric":
+                record.update({k: col.stats.get(k) for k in ("min", "mean", "p50", "max")})
+            records.append(record)
+        return pd.DataFrame(records)
+
+
+def _numeric_profiles(df, nulls, uniques):
+    profiles = {}
+    numeric = df.select_dtypes("number")
+    if numeric.empty:
+        return profiles
+
+    # 所有數值欄一次算完
+    summary = numeric.agg(["min", "max", "mean", "std"]).T
+    quantiles = numeric.quantile(list(QUANTILES)).T
+    for col in numeric.columns:
+        values = numeric[col].to_numpy(dtype="float64", na_value=np.nan)
+        values = values[~np.isnan(values)]
+        histogram = []
+        if values.size:
+            counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+            histogram = [(float(edges[i]), float(edges[i + 1]), int(n)) for i, n in enumerate(counts)]
+        stats = {k: float(summary.at[col, k]) for k in ("min", "max", "mean", "std")}
+        stats.update({f"p{int(q * 100)}": float(quantiles.at[col, q]) for q in QUANTILES})
+        profiles[col] = ColumnProfile(
+            name=str(col),
+            dtype=str(numeric[col].dtype),
+            kind="numeric",
+            count=int(len(df) - nulls[col]),
+            nulls=int(nulls[col]),
+            unique=int(uniques[col]),
+            stats=stats,
+            histogram=histogram,
+        )
+    return profiles
+
+
+def build_profile(df):
+    nulls = df.isna().sum()
+    uniques = df.nunique(dropna=True)
+    numeric = _numeric_profiles(df, nulls, uniques)
+
+    columns = []
+    for col in df.columns:
+        if col in numeric:
+            columns.append(numeric[col])
+            continue
+        series = df[col]
+        kind, stats = "categorical", {}
+        if pd.api.types.is_datetime64_any_dtype(series):
+            kind = "datetime"
+            stats = {"min": str(series.min()), "max": str(series.max())}
+        top = series.value_counts(dropna=True).head(TOP_VALUES)
+        columns.append(ColumnProfile(
+            name=str(col),
+            dtype=str(series.dtype),
+            kind=kind,
+            count=int(len(df) - nulls[col]),
+            nulls=int(nulls[col]),
+            unique=int(uniques[col]),
+            stats=stats,
+            top_values=[(str(v), int(n)) for v, n in top.items()],
+        ))
+
+    return DatasetProfile(rows=len(df), nbytes=int(df.memory_usage(deep=True).sum()), columns=columns)
+
+
+_profiles = LRUCache(MAX_PROFILES)
+
+
+def get_profile(df, dataset_hash=None):
+    """取得資料概況；有內容雜湊時結果會快取，同一份資料只計算一次。"""
+    if dataset_hash is None:
+        return build_profile(df)
+
+    def build():
+        with span("build_profile", rows=len(df)):
+            return build_profile(df)
+
+    return _profiles.get_or_build(dataset_hash, build)
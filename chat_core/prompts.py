@@ -0,0 +1,49 @@
+"""提示詞組合：主題生成與回答所用的提示詞集中在這裡，各入口腳本共用。"""
+import re
+
+TITLE_MAX_CHARS = 10
+
+_CJK = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def estimate_tokens(text):
+    """粗估 token 數：中日韓文字一字約一個 token，其他字元約四個一個 token。"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def build_title_prompt(user_input):
+    return f"請為以下這句話產生一個簡短主題（10 個中文字以內）：「{user_input}」，請直接輸出主題，不要加引號或多餘說明。"
+
+
+def clean_title(text):
+    return text.strip().replace("主題：", "").replace("\n", "")[:TITLE_MAX_CHARS]
+
+
+def heuristic_title(user_input):
+    """不呼叫模型的本地主題：去掉標點與常見問句贅字後取前 10 個字；英文單字之間保留一個空白。"""
+    text = re.sub(r"[，。！？、：；「」『』（）,.!?:;\"'()]+", "", user_input)
+    text = re.sub(r"\s+", " ", text).strip()
+    text = re.sub(r"^(請問|請|幫我|可以|能不能)\s*", "", text)
+    return text[:TITLE_MAX_CHARS].rstrip() or user_input.strip()[:TITLE_MAX_CHARS]
+
+
+def data_section(profile=None, query_result=None, rows=None):
+    """提示詞中的資料段落：優先使用完整資料的計算結果，其次是資料概況加上與問題相關的資料列。"""
+    if query_result is not None:
+        return query_result.to_prompt()
+    text = ""
+    if profile is not None:
+        text += f"\n以下是使用者提供的 CSV 資料概況：\n{profile.to_text()}"
+    if rows is not None:
+        text += rows.to_prompt()
+    return text
+
+
+def build_answer_prompt(topic_title, question, history_text="", data_text=""):
+    prompt = f"主題是「{topic_title}」。"
+    if history_text:
+        prompt += f"\n{history_text}"
+    prompt += data_text
+    prompt += f"\n\n根據這些資料與主題，請回答：「{question}」"
+    return prompt
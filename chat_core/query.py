@@ -0,0 +1,364 @@
+"""本地查詢引擎：模型只負責把問題轉成受限的查詢規格，實際計算在完整 DataFrame 上進行。
+
+查詢規格是 JSON，不會被 eval；欄位、運算子與統計函式都必須在白名單內::
+
+    {"op": "agg", "filters": [{"column": "Gender", "op": "==", "value": "Female"}],
+     "groupby": ["Gender"], "columns": ["Shoe size_cm"], "funcs": ["mean"]}
+
+預測問題（``{"op": "predict", "target": ..., "inputs": {...}}``）交給本地訓練的模型回答，
+畫圖要求（``{"op": "chart", "kind": ..., "x": ..., "y": ...}``）在伺服器端彙總後產生圖表；
+兩者的結果都帶有可以直接顯示的 ``answer``，不必再請模型組織回答。
+"""
+import asyncio
+import json
+import math
+from dataclasses import dataclass
+
+import pandas as pd
+
+from .charts import CHART_KINDS, ChartError, get_chart
+from .common import is_numeric
+from .ingest import get_frame_cache
+from .modeling import ModelingError, predict
+from .scheduler import get_scheduler, rate_key
+from .streaming import request_options
+from .tracing import span
+
+QUERY_OPS = ("agg", "count", "describe", "quantile", "predict", "chart", "none")
+FILTER_OPS = ("==", "!=", ">", ">=", "<", "<=", "in", "between")
+AGG_FUNCS = ("mean", "median", "sum", "min", "max", "count", "std", "nunique")
+MAX_FILTERS = 10
+MAX_RESULT_ROWS = 50
+MAX_CATEGORY_VALUES = 12
+PLAN_TIMEOUT = 20.0
+
+
+class QueryError(ValueError):
+    """查詢規格不合法或無法在資料上執行。"""
+
+
+@dataclass
+class QueryResult:
+    spec: dict
+    table: pd.DataFrame
+    matched_rows: int
+    total_rows: int
+    answer: str = None          # 本地模型已經可以直接回答時的回覆文字
+    chart: object = None        # 畫圖要求的 ChartResult
+
+    def to_prompt(self):
+        text = self.table.to_csv()
+        return (
+            f"\n以下是依使用者問題在完整資料（共 {self.total_rows} 筆，"
+            f"符合條件 {self.matched_rows} 筆）上計算出的結果：\n{text}"
+        )
+
+
+def _check_columns(df, columns, field):
+    if not isinstance(columns, list):
+        raise QueryError(f"{field} 必須是欄位名稱清單")
+    missing = [c for c in columns if c not in df.columns]
+    if missing:
+        raise QueryError(f"{field} 含有不存在的欄位：{missing}")
+    return columns
+
+
+def _check_value(series, f):
+    """篩選值必須是純量（in、between 為純量清單），數值欄位的值必須能轉成數字。"""
+    values = f["value"] if f["op"] in ("in", "between") else [f.get("value")]
+    if "value" not in f or not isinstance(values, list):
+        raise QueryError(f"篩選條件缺少值：{f}")
+    for v in values:
+        if v is None or not isinstance(v, (str, int, float, bool)):
+            raise QueryError(f"篩選值必須是字串或數字：{f}")
+    try:
+        _coerce(series, values)
+    except (TypeError, ValueError) as e:
+        raise QueryError(f"欄位 {f['column']} 的篩選值必須是數字：{f['value']}") from e
+
+
+def validate_spec(df, spec):
+    """檢查並補齊查詢規格，回傳新的 dict；不合法時丟出 QueryError。"""
+    if not isinstance(spec, dict):
+        raise QueryError("查詢規格必須是 JSON 物件")
+
+    op = spec.get("op", "agg")
+    if op not in QUERY_OPS:
+        raise QueryError(f"不支援的查詢類型：{op}")
+
+    filters = spec.get("filters") or []
+    if not isinstance(filters, list) or len(filters) > MAX_FILTERS:
+        raise QueryError("filters 格式錯誤")
+    for f in filters:
+        if not isinstance(f, dict) or f.get("column") not in df.columns:
+            raise QueryError(f"篩選欄位不存在：{f}")
+        if f.get("op") not in FILTER_OPS:
+            raise QueryError(f"不支援的篩選運算子：{f.get('op')}")
+        if f["op"] == "between" and not (isinstance(f.get("value"), list) and len(f["value"]) == 2):
+            raise QueryError("between 需要 [下限, 上限]")
+        if f["op"] == "in" and not isinstance(f.get("value"), list):
+            raise QueryError("in 需要值的清單")
+        _check_value(df[f["column"]], f)
+
+    if op == "predict":
+        return _validate_predict(df, spec, filters)
+    if op == "chart":
+        # 圖表欄位由 charts 模組檢查，這裡只保留規格中與圖表有關的欄位
+        chart = {k: spec.get(k) for k in ("kind", "x", "y", "color", "agg")}
+        return {"op": "chart", "filters": filters, **chart}
+
+    groupby = _check_columns(df, spec.get("groupby") or [], "groupby")
+    columns = _check_columns(df, spec.get("columns") or [], "columns")
+    if op in ("agg", "describe", "quantile") and not columns:
+        columns = [c for c in df.select_dtypes("number").columns if c not in groupby]
+
+    funcs = spec.get("funcs") or ["mean"]
+    if not isinstance(funcs, list) or any(fn not in AGG_FUNCS for fn in funcs):
+        raise QueryError(f"統計函式只能是 {', '.join(AGG_FUNCS)}")
+
+    q = spec.get("q") or [0.25, 0.5, 0.75]
+    if not isinstance(q, list) or any(not isinstance(v, (int, float)) or not 0 <= v <= 1 for v in q):
+        raise QueryError("q 必須是 0 到 1 之間的數字清單")
+
+    return {"op": op, "filters": filters, "groupby": groupby, "columns": columns, "funcs": funcs, "q": q}
+
+
+def _validate_predict(df, spec, filters):
+    target = spec.get("target")
+    if target not in df.columns:
+        raise QueryError(f"預測目標欄位不存在：{target}")
+    inputs = spec.get("inputs")
+    if not isinstance(inputs, dict) or not inputs:
+        raise QueryError("predict 需要 inputs：{欄位: 值}")
+    _check_columns(df, list(inputs), "inputs")
+    if target in inputs:
+        raise QueryError("inputs 不可包含預測目標欄位")
+    for col, value in inputs.items():
+        _check_input(df[col], col, value)
+    return {"op": "predict", "filters": filters, "target": target, "inputs": inputs}
+
+
+def _check_input(series, col, value):
+    """預測輸入必須是純量，數值欄位的值必須是有限的數字（「180cm」、「很高」不會被默默當成缺值）。"""
+    if value is None or not isinstance(value, (str, int, float, bool)):
+        raise QueryError(f"inputs 的 {col} 必須是字串或數字：{value}")
+    if not is_numeric(series):
+        return
+    try:
+        number = float(value)
+    except (TypeError, ValueError) as e:
+        raise QueryError(f"欄位 {col} 的輸入值必須是數字：{value}") from e
+    if not math.isfinite(number):
+        raise QueryError(f"欄位 {col} 的輸入值必須是有限的數字：{value}")
+
+
+def _apply_filters(df, filters):
+    frame = df
+    try:
+        for f in filters:
+            frame = frame[_mask(frame, f)]
+    except (TypeError, ValueError, KeyError) as e:
+        raise QueryError(f"篩選失敗：{e}") from e
+    return frame
+
+
+def _run_predict(df, spec, dataset_hash):
+    # 有篩選條件時只用符合的資料訓練；資料不同所以不共用整份資料的模型快取
+    frame = _apply_filters(df, spec["filters"])
+    try:
+        prediction = predict(frame, dataset_hash if frame is df else None, spec["target"], spec["inputs"])
+    except ModelingError as e:
+        raise QueryError(str(e)) from e
+    return QueryResult(
+        spec=spec, table=prediction.to_frame().round(4), matched_rows=len(frame), total_rows=len(df),
+        answer=prediction.to_text(),
+    )
+
+
+def _run_chart(df, spec, dataset_hash):
+    frame = _apply_filters(df, spec["filters"])
+    # 篩選條件也在規格裡，所以同一份資料的篩選結果可以共用快取
+    try:
+        chart = get_chart(frame, dataset_hash, spec)
+    except ChartError as e:
+        raise QueryError(str(e)) from e
+    return QueryResult(
+        spec=spec, table=chart.to_frame(), matched_rows=len(frame), total_rows=len(df),
+        answer=chart.describe(), chart=chart,
+    )
+
+
+def replay_chart(dataset_hash, spec):
+    """依對話紀錄中保存的規格重畫圖表（通常直接命中快取）；資料已不在快取或規格失效時回傳 None。"""
+    df = get_frame_cache().get(dataset_hash)
+    if df is None:
+        return None
+    try:
+        return run_query(df, spec, dataset_hash).chart
+    except QueryError:
+        return None
+
+
+def _coerce(series, value):
+    if pd.api.types.is_numeric_dtype(series):
+        if isinstance(value, list):
+            return [float(v) for v in value]
+        return float(value)
+    return value
+
+
+def _mask(df, f):
+    series = df[f["column"]]
+    value = _coerce(series, f["value"])
+    op = f["op"]
+    if op == "==":
+        return series == value
+    if op == "!=":
+        return series != value
+    if op == ">":
+        return series > value
+    if op == ">=":
+        return series >= value
+    if op == "<":
+        return series < value
+    if op == "<=":
+        return series <= value
+    if op == "in":
+        return series.isin(value)
+    return series.between(value[0], value[1])
+
+
+def _flatten(table):
+    if isinstance(table.columns, pd.MultiIndex):
+        table.columns = ["_".join(str(part) for part in col) for col in table.columns]
+    return table
+
+
+def run_query(df, spec, dataset_hash=None):
+    """在完整 DataFrame 上以向量化運算執行查詢，回傳 QueryResult。
+
+    ``dataset_hash`` 用來快取預測模型，沒有時每次預測都重新訓練。
+    """
+    spec = validate_spec(df, spec)
+    if spec["op"] == "predict":
+        return _run_predict(df, spec, dataset_hash)
+    if spec["op"] == "chart":
+        return _run_chart(df, spec, dataset_hash)
+    groupby, columns, funcs = spec["groupby"], spec["columns"], spec["funcs"]
+
+    frame = _apply_filters(df, spec["filters"])
+    try:
+        op = spec["op"]
+        if op == "count":
+            if groupby:
+                table = frame.groupby(groupby, observed=True).size().to_frame("count")
+            else:
+                table = pd.DataFrame({"count": [len(frame)]}, index=pd.Index(["all"], name="rows"))
+        elif op == "agg":
+            if groupby:
+                table = frame.groupby(groupby, observed=True)[columns].agg(funcs)
+            else:
+                table = frame[columns].agg(funcs)
+        elif op == "describe":
+            if groupby:
+                table = frame.groupby(groupby, observed=True)[columns].describe()
+            else:
+                table = frame[columns].describe()
+        elif op == "quantile":
+            if groupby:
+                table = frame.groupby(groupby, observed=True)[columns].quantile(spec["q"])
+                table.index.names = [*groupby, "q"]
+            else:
+                table = frame[columns].quantile(spec["q"])
+                table.index.name = "q"
+        else:
+            table = pd.DataFrame()
+    except (TypeError, ValueError, KeyError) as e:
+        raise QueryError(f"查詢執行失敗：{e}") from e
+
+    table = _flatten(table).head(MAX_RESULT_ROWS).round(4)
+    return QueryResult(spec=spec, table=table, matched_rows=len(frame), total_rows=len(df))
+
+
+def describe_schema(df):
+    """給規劃提示詞用的精簡欄位說明。"""
+    lines = []
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_numeric_dtype(series):
+            detail = f"範圍 {series.min()} ~ {series.max()}"
+        else:
+            values = series.dropna().unique()[:MAX_CATEGORY_VALUES]
+            detail = "值例如 " + ", ".join(str(v) for v in values)
+        lines.append(f"- {col} ({series.dtype})：{detail}")
+    return "\n".join(lines)
+
+
+def build_plan_prompt(df, question, schema=None, context=""):
+    # 有預先算好的資料概況時直接用它的欄位說明，不必每次重算
+    schema = schema or describe_schema(df)
+    # 追問（例如「那男生呢？」）需要先前的對話才能規劃
+    context = f"對話脈絡：\n{context}\n\n" if context else ""
+    return (
+        f"你是資料查詢規劃器。資料表共有 {len(df)} 筆，欄位如下：\n{schema}\n\n"
+        "請把使用者的問題轉成 JSON 查詢規格，只輸出 JSON，不要加任何說明：\n"
+        '{"op": "agg|count|describe|quantile|none", '
+        '"filters": [{"column": 欄位, "op": 運算子, "value": 值}], '
+        '"groupby": [欄位], "columns": [欄位], "funcs": [函式], "q": [分位數]}\n'
+        f"- filters 的運算子只能是 {', '.join(FILTER_OPS)}；in 的值是清單，between 的值是 [下限, 上限]\n"
+        f"- funcs 只能是 {', '.join(AGG_FUNCS)}\n"
+        '- 問題是依某些欄位的值推估另一個欄位（例如「身高 175、體重 80 的人穿幾號鞋」）時輸出 '
+        '{"op": "predict", "target": 要推估的欄位, "inputs": {欄位: 值}}\n'
+        '- 問題要求畫圖時輸出 {"op": "chart", "kind": 圖表類型, "x": 欄位, "y": 欄位, "color": 分色欄位, '
+        '"filters": [...]}；'
+        f"kind 只能是 {', '.join(CHART_KINDS)}（分布、分組長條、散佈、大量資料的密度、依序變化的折線），"
+        "y 與 color 不需要時省略\n"
+        '- 問題不需要計算資料時輸出 {"op": "none"}\n\n'
+        f"{context}問題：「{question}」"
+    )
+
+
+def parse_spec(text):
+    """從模型輸出中取出 JSON 物件（允許被 ```json 區塊包住）。"""
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        raise QueryError("模型沒有輸出查詢規格")
+    try:
+        return json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise QueryError(f"查詢規格不是合法的 JSON：{e}") from e
+
+
+def _run_plan(df, text, dataset_hash=None):
+    spec = parse_spec(text)
+    if isinstance(spec, dict) and spec.get("op") == "none":
+        return None
+    return run_query(df, spec, dataset_hash)
+
+
+async def plan_and_run_async(model, df, question, schema=None, context="", timeout=PLAN_TIMEOUT, dataset_hash=None):
+    """``plan_and_run`` 的非同步版本：規劃呼叫不佔用執行緒，pandas 計算丟到執行緒執行。"""
+    prompt = build_plan_prompt(df, question, schema, context)
+    with span("plan") as s:
+        s.record_text("prompt", prompt)
+        response = await get_scheduler().call_async(
+            rate_key(model), model.generate_content_async, prompt, **request_options(timeout)
+        )
+        s.record_text("response", response.text)
+        s.record_usage(response)
+    with span("run_query", rows=len(df)):
+        return await asyncio.to_thread(_run_plan, df, response.text, dataset_hash)
+
+
+def plan_and_run(model, df, question, schema=None, context="", timeout=PLAN_TIMEOUT, dataset_hash=None):
+    """請模型規劃查詢並在本地執行；問題不需要計算時回傳 None。"""
+    prompt = build_plan_prompt(df, question, schema, context)
+    with span("plan") as s:
+        s.record_text("prompt", prompt)
+        response = get_scheduler().call(
+            rate_key(model), model.generate_content, prompt, **request_options(timeout)
+        )
+        s.record_text("response", response.text)
+        s.record_usage(response)
+    with span("run_query", rows=len(df)):
+        return _run_plan(df, response.text, dataset_hash)
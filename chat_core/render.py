@@ -0,0 +1,38 @@
+"""聊天紀錄顯示：每輪對話預先組成一段 markdown，並以視窗方式只顯示最近幾輪。"""
+import threading
+from collections import OrderedDict
+
+from .streaming import format_timing
+
+HISTORY_PAGE_SIZE = 10
+TOPIC_PAGE_SIZE = 20
+MAX_RENDERED_TURNS = 4096
+
+_rendered = OrderedDict()
+_rendered_lock = threading.Lock()
+
+
+def _build_markdown(turn):
+    msg = turn.as_dict()
+    parts = [f"**👤 你：** {msg['user']}", f"**🤖 Gemini：** {msg['bot']}"]
+    timing_text = format_timing(msg)
+    if timing_text:
+        parts.append(f":gray[{timing_text}]")
+    parts.append("---")
+    return "\n\n".join(parts)
+
+
+def turn_markdown(turn):
+    """回傳一輪對話的 markdown。對話寫入後不會再變動，所以以 turn id 快取組好的結果。"""
+    with _rendered_lock:
+        text = _rendered.get(turn.id)
+        if text is not None:
+            _rendered.move_to_end(turn.id)
+            return text
+
+    text = _build_markdown(turn)
+    with _rendered_lock:
+        _rendered[turn.id] = text
+        while len(_rendered) > MAX_RENDERED_TURNS:
+            _rendered.popitem(last=False)
+    return text
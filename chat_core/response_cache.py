@@ -0,0 +1,233 @@
+"""回覆快取：相同（或幾乎相同）的問題在同一份資料上直接取用先前的回答。
+
+快取存在本機 SQLite，程序重啟後仍然有效，並由同一程序內的所有 Streamlit session 共用。
+索引為（模型名稱、資料內容雜湊、對話情境、正規化後的問題）：
+
+* 精確層：上述四項完全相同。
+* 近似層：模型、資料與情境相同，問題中的數字、否定詞與分組／比較用語完全相同，
+  且去掉贅字後的字元 bigram Jaccard 相似度達門檻。bigram 相似度本身分不出「身高 170」與「身高 180」、
+  「男生」與「女生」、「超過」與「不超過」（相似度都在 0.9 以上），這些差異由前一項條件排除；
+  近似層只合併措辭不同（贅字、標點、全半形）而條件相同的問題。
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+
+from .tracing import span
+
+DEFAULT_PATH = os.path.join(".cache", "responses.sqlite3")
+DEFAULT_TTL = 7 * 24 * 3600.0
+DEFAULT_MAX_ENTRIES = 5000
+NEAR_THRESHOLD = 0.9
+NEAR_CANDIDATES = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key        TEXT PRIMARY KEY,
+    model      TEXT NOT NULL,
+    dataset    TEXT NOT NULL,
+    context    TEXT NOT NULL,
+    question   TEXT NOT NULL,
+    answer     TEXT NOT NULL,
+    latency    REAL NOT NULL,
+    created_at REAL NOT NULL,
+    last_hit   REAL NOT NULL,
+    hits       INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_responses_scope ON responses (model, dataset, context, last_hit);
+CREATE INDEX IF NOT EXISTS idx_responses_last_hit ON responses (last_hit);
+"""
+
+
+def normalize_text(text):
+    """全半形統一、轉小寫、壓縮空白並去掉結尾標點。"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?？!！。.~～ ")
+
+
+_FILLERS = re.compile(r"請問|請|幫我|一下|可以|告訴我|的|了|嗎|呢|吧|是|[\s,，、:：;；?？!！。.]")
+
+
+_NUMBERS = re.compile(r"\d+(?:\.\d+)?")
+# 會改變問題意思、但在 bigram 相似度中只佔一兩個字的用語：否定、分組、比較方向
+_KEY_TERMS = re.compile(
+    r"不|沒|無|非|未|別|男|女|以上|以下|以內|超過|低於|高於|大於|小於|多於|少於|最高|最低|最大|最小|最多|最少"
+    r"|\b(?:not|no|without|never|male|female|men|women|man|woman|boys?|girls?|above|below|over|under"
+    r"|more|less|most|least|max|min|highest|lowest)\b|n't"
+)
+
+
+def question_signature(text):
+    """問題中的數字與關鍵用語（依出現順序）；近似層只在兩個問題的簽章相同時才比較相似度。"""
+    return tuple(_NUMBERS.findall(text)), tuple(_KEY_TERMS.findall(text))
+
+
+def scoped_context(context, prompt_style, query_mode):
+    """把會改變回答的設定併入快取用的對話脈絡：提示詞樣式（各設定組不同）與是否先規劃查詢。
+
+    設定不同的 session 不共用回覆；設定相同時 Streamlit、HTTP 服務與批次仍共用同一批快取。
+    """
+    return f"[style={prompt_style};query={int(bool(query_mode))}]{context}"
+
+
+def _digest(*parts):
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _bigrams(text):
+    text = _FILLERS.sub("", text)
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def similarity(a, b):
+    grams_a, grams_b = _bigrams(a), _bigrams(b)
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+@dataclass
+class CachedResponse:
+    answer: str
+    latency: float        # 原本產生這個回答花費的時間（秒）
+    tier: str             # exact / near
+    score: float = 1.0
+
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 near_threshold=NEAR_THRESHOLD):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.near_threshold = near_threshold
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def _scope(self, model_name, dataset_hash, context):
+        return model_name, dataset_hash or "", _digest(normalize_text(context))
+
+    def get(self, model_name, question, dataset_hash=None, context="", near=True):
+        with span("cache_lookup") as s:
+            result = self._lookup(model_name, question, dataset_hash, context, near)
+            s.set(tier=result.tier if result is not None else "miss")
+        return result
+
+    def _lookup(self, model_name, question, dataset_hash, context, near):
+        model_name, dataset, context_key = self._scope(model_name, dataset_hash, context)
+        question = normalize_text(question)
+        key = _digest(model_name, dataset, context_key, question)
+        now = time.time()
+        oldest = now - self.ttl
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, answer, latency FROM responses WHERE key = ? AND created_at >= ?",
+                (key, oldest),
+            ).fetchone()
+            result = None
+            if row is not None:
+                result = CachedResponse(answer=row[1], latency=row[2], tier="exact")
+            elif near:
+                candidates = self._conn.execute(
+                    "SELECT key, answer, latency, question FROM responses "
+                    "WHERE model = ? AND dataset = ? AND context = ? AND created_at >= ? "
+                    "ORDER BY last_hit DESC LIMIT ?",
+                    (model_name, dataset, context_key, oldest, NEAR_CANDIDATES),
+                ).fetchall()
+                signature = question_signature(question)
+                candidates = [c for c in candidates if question_signature(c[3]) == signature]
+                best = max(candidates, key=lambda c: similarity(question, c[3]), default=None)
+                if best is not None:
+                    score = similarity(question, best[3])
+                    if score >= self.near_threshold:
+                        row = best
+                        result = CachedResponse(answer=best[1], latency=best[2], tier="near", score=score)
+
+            if result is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE responses SET last_hit = ?, hits = hits + 1 WHERE key = ?", (now, row[0])
+            )
+            self._conn.commit()
+            if result.tier == "exact":
+                self.exact_hits += 1
+            else:
+                self.near_hits += 1
+            self.saved_seconds += result.latency
+            return result
+
+    def put(self, model_name, question, answer, dataset_hash=None, context="", latency=0.0):
+        model_name, dataset, context_key = self._scope(model_name, dataset_hash, context)
+        question = normalize_text(question)
+        key = _digest(model_name, dataset, context_key, question)
+        now = time.time()
+
+        with span("cache_store"), self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, model, dataset, context, question, answer, latency, created_at, last_hit, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, model_name, dataset, context_key, question, answer, latency, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_hit ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            hits = self.exact_hits + self.near_hits
+            lookups = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "size": size,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
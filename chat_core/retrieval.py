@@ -0,0 +1,270 @@
+"""與問題相關的資料列：每份資料建一次索引，依問題挑出最相關的幾列放進提示詞，取代固定送前幾列。
+
+* 文字欄：每列的文字值合成一段文字，以 TF-IDF 比對問題；英數字以單字為詞，中日韓文字以相鄰兩字為詞。
+* 數值欄：問題中的數字依欄位名稱或數值範圍對應到欄位，在標準化後的這些欄位上以 KD-tree 找最接近的資料列。
+* 資料多半以英文記錄，問題中常見的中文詞（性別、族群、欄位名稱）先補上對應的英文詞再比對。
+
+兩種分數相加後排序，在 token 預算內轉成 CSV；問題與資料列都對不上時不附任何資料列。
+"""
+import re
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .common import LRUCache, is_numeric
+from .prompts import estimate_tokens
+from .tracing import span
+
+MAX_INDEXES = 16
+MAX_INDEX_ROWS = 200_000        # 更大的資料只索引固定的隨機樣本
+TOP_K = 20
+CANDIDATES = 200
+TEXT_POOL_RATIO = 0.5           # 文字分數達最高分一半以上的列都列入候選
+MAX_TEXT_POOL = 50_000
+ROW_TOKEN_BUDGET = 800
+MAX_TEXT_FEATURES = 50_000
+IDENTIFIER_RATIO = 0.9
+RANDOM_STATE = 0
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+_WORD = re.compile(r"[a-z]+")
+_LATIN_TOKEN = re.compile(r"[a-z0-9]+(?:[._-][a-z0-9]+)*")
+_CJK_RUN = re.compile(r"[\u3040-\u9fff\uac00-\ud7af]+")
+
+# 中文詞 → 資料中常用的英文詞；長的詞排在前面，比對到「女生」後不再重複比對「女」
+TERM_ALIASES = {
+    "女生": "female woman women girl", "女性": "female woman women", "女孩": "female girl",
+    "男生": "male man men boy", "男性": "male man men", "男孩": "male boy",
+    "女": "female", "男": "male",
+    "兒童": "child children kid", "小孩": "child children kid", "成人": "adult", "學生": "student",
+    "身高": "height", "體重": "weight", "年齡": "age",
+}
+_ALIAS = re.compile("|".join(sorted(map(re.escape, TERM_ALIASES), key=len, reverse=True)))
+
+
+def tokenize(text):
+    """英數字以單字為詞（female 與 male 不會互相比對到），中日韓文字取相鄰兩字。"""
+    text = text.lower()
+    tokens = _LATIN_TOKEN.findall(text)
+    for run in _CJK_RUN.findall(text):
+        tokens += [run[i:i + 2] for i in range(len(run) - 1)] or [run]
+    return tokens
+
+
+def expand_question(question):
+    """在問題後面補上其中中文詞對應的英文詞，讓「女生」能比對到資料中的 Female。"""
+    aliases = dict.fromkeys(TERM_ALIASES[m] for m in _ALIAS.findall(question))
+    return " ".join([question, *aliases])
+
+
+def row_tokens(row):
+    """估計一列資料轉成 CSV 後的 token 數（缺值是空欄位）。"""
+    return estimate_tokens(",".join("" if pd.isna(v) else str(v) for v in row))
+
+
+@dataclass
+class RetrievedRows:
+    table: pd.DataFrame
+    total_rows: int
+
+    def to_prompt(self):
+        return (
+            f"\n以下是與問題最相關的 {len(self.table)} 筆資料列（共 {self.total_rows} 筆，依相關程度排序）：\n"
+            f"{self.table.to_csv(index=False)}"
+        )
+
+
+class RowIndex:
+    """一份資料的列索引；建好之後只讀，可由多個 session 同時查詢。"""
+
+    def __init__(self, df):
+        # 只有第一次建索引時才載入 scikit-learn
+        from scipy import sparse
+        from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+
+        self.df = df
+        if len(df) > MAX_INDEX_ROWS:
+            self.positions = np.sort(np.random.default_rng(RANDOM_STATE).choice(len(df), MAX_INDEX_ROWS, replace=False))
+            frame = df.iloc[self.positions]
+        else:
+            self.positions = np.arange(len(df))
+            frame = df
+
+        self.numeric_columns = [col for col in df.columns if is_numeric(df[col])]
+        self.text_columns = [col for col in df.columns if col not in self.numeric_columns]
+
+        self.vectorizer = self.tfidf = self.text_matrix = None
+        if self.text_columns and len(frame):
+            # 文字欄通常重複值很多：每個欄位只對不同的值斷詞一次，再依各列的值組合成詞頻矩陣
+            encoded = [pd.factorize(frame[col]) for col in self.text_columns]
+            uniques = [np.asarray(values.astype(str)) for _, values in encoded]
+            self.vectorizer = CountVectorizer(analyzer=tokenize, max_features=MAX_TEXT_FEATURES, dtype=np.float32)
+            try:
+                self.vectorizer.fit(np.concatenate(uniques))
+            except ValueError:       # 文字欄全是空值，沒有任何詞
+                self.vectorizer = None
+        if self.vectorizer is not None:
+            counts = None
+            for (codes, _), values in zip(encoded, uniques):
+                rows = np.flatnonzero(codes >= 0)
+                one_hot = sparse.csr_matrix(
+                    (np.ones(len(rows), dtype=np.float32), (rows, codes[rows])), shape=(len(frame), len(values)),
+                )
+                column_counts = one_hot @ self.vectorizer.transform(values)
+                counts = column_counts if counts is None else counts + column_counts
+            self.tfidf = TfidfTransformer()
+            self.text_matrix = self.tfidf.fit_transform(counts)
+
+        values = frame[self.numeric_columns].to_numpy(dtype="float64", na_value=np.nan)
+        self.mean = np.nanmean(values, axis=0) if len(frame) else np.zeros(len(self.numeric_columns))
+        std = np.nanstd(values, axis=0) if len(frame) else np.ones(len(self.numeric_columns))
+        self.std = np.where(np.isfinite(std) & (std > 0), std, 1.0)
+        # 缺值視為平均值（標準化後為 0），不影響其他欄位的距離
+        self.scaled = np.nan_to_num((values - self.mean) / self.std)
+        # 編號欄（幾乎每列都不同的整數）的數值沒有遠近的意義，問題中的數字不對應到它
+        identifiers = {
+            col for col in self.numeric_columns
+            if pd.api.types.is_integer_dtype(frame[col]) and len(frame) > 1
+            and frame[col].nunique() >= IDENTIFIER_RATIO * len(frame)
+        }
+        self.ranges = {
+            col: (np.nanmin(values[:, i]), np.nanmax(values[:, i]))
+            for i, col in enumerate(self.numeric_columns)
+            if col not in identifiers and len(frame) and not np.isnan(values[:, i]).all()
+        }
+        self._trees = {}
+        self._trees_lock = threading.Lock()
+
+    # === 文字 ===
+    def _text_scores(self, question):
+        if self.vectorizer is None:
+            return None
+        query = self.tfidf.transform(self.vectorizer.transform([question]))
+        if not query.nnz:
+            return None
+        # TF-IDF 向量已經正規化，內積即為 cosine 相似度
+        return (self.text_matrix @ query.T).toarray().ravel()
+
+    # === 數值 ===
+    def numeric_targets(self, question):
+        """把問題中的數字對應到數值欄：優先考慮名稱出現在問題中的欄位，其次是數值範圍涵蓋它的欄位，
+        同時符合多個欄位時選最接近該欄平均的（標準化後距離最小）。"""
+        words = set(_WORD.findall(question.lower()))
+        mentioned = [
+            col for col in self.ranges
+            if any(len(w) >= 3 and w in words for w in _WORD.findall(str(col).lower()))
+        ]
+        targets = {}
+        for match in _NUMBER.finditer(question):
+            value = float(match.group())
+            best = None
+            for col in mentioned or list(self.ranges):
+                if col in targets:
+                    continue
+                low, high = self.ranges[col]
+                if not low <= value <= high:
+                    continue
+                i = self.numeric_columns.index(col)
+                distance = abs(value - self.mean[i]) / self.std[i]
+                if best is None or distance < best[0]:
+                    best = (distance, col)
+            if best is not None:
+                targets[best[1]] = value
+        return targets
+
+    def _tree(self, columns):
+        from sklearn.neighbors import KDTree
+
+        with self._trees_lock:
+            tree = self._trees.get(columns)
+            if tree is None:
+                idx = [self.numeric_columns.index(col) for col in columns]
+                tree = self._trees[columns] = KDTree(self.scaled[:, idx])
+            return tree
+
+    def _point(self, targets):
+        columns = tuple(sorted(targets, key=str))
+        idx = [self.numeric_columns.index(col) for col in columns]
+        return columns, idx, (np.array([targets[col] for col in columns]) - self.mean[idx]) / self.std[idx]
+
+    def _numeric_neighbors(self, targets, k):
+        """以 KD-tree 找出標準化後最接近問題數值的 k 列。"""
+        columns, _, point = self._point(targets)
+        _, rows = self._tree(columns).query(point.reshape(1, -1), k=min(k, len(self.scaled)))
+        return rows[0]
+
+    def _numeric_scores(self, targets, rows):
+        _, idx, point = self._point(targets)
+        distances = np.sqrt(((self.scaled[np.ix_(rows, idx)] - point) ** 2).sum(axis=1))
+        return 1.0 / (1.0 + distances)
+
+    # === 查詢 ===
+    def search(self, question, k=TOP_K, token_budget=ROW_TOKEN_BUDGET):
+        """回傳與問題最相關的資料列（RetrievedRows）；文字與數字都對不上時回傳 None。"""
+        if not len(self.positions):
+            return None
+        question = expand_question(question)
+        candidates = []
+
+        # 候選列：文字相符的列，加上 KD-tree 找到的數值最接近的列
+        text_scores = self._text_scores(question)
+        if text_scores is not None and text_scores.max() > 0:
+            text_scores = text_scores / text_scores.max()
+            pool = np.flatnonzero(text_scores >= TEXT_POOL_RATIO)
+            if len(pool) > MAX_TEXT_POOL:
+                pool = pool[np.argpartition(-text_scores[pool], MAX_TEXT_POOL - 1)[:MAX_TEXT_POOL]]
+            candidates.append(pool)
+        else:
+            text_scores = None
+
+        targets = self.numeric_targets(question)
+        if targets:
+            candidates.append(self._numeric_neighbors(targets, CANDIDATES))
+
+        if not candidates:
+            return None
+        candidates = np.unique(np.concatenate(candidates))
+        # 文字與數值分數都在 0～1 之間，相加後排序
+        scores = np.zeros(len(candidates), dtype="float64")
+        if text_scores is not None:
+            scores += text_scores[candidates]
+        if targets:
+            scores += self._numeric_scores(targets, candidates)
+        ranked = candidates[np.argsort(-scores, kind="stable")][:k]
+        table = self.df.iloc[self.positions[ranked]]
+
+        # 在 token 預算內盡量多放幾列（至少一列）；逐列估計，文字值裡的換行不會被當成另一列
+        used = row_tokens(table.columns)
+        keep = 0
+        for row in table.itertuples(index=False, name=None):
+            used += row_tokens(row)
+            if keep and used > token_budget:
+                break
+            keep += 1
+        return RetrievedRows(table=table.iloc[:keep], total_rows=len(self.df))
+
+
+_indexes = LRUCache(MAX_INDEXES)
+
+
+def get_row_index(df, dataset_hash=None):
+    """取得資料列索引；有內容雜湊時結果會快取，同一份資料只建一次。"""
+    if dataset_hash is None:
+        return RowIndex(df)
+
+    def build():
+        with span("build_row_index", rows=len(df)):
+            return RowIndex(df)
+
+    return _indexes.get_or_build(dataset_hash, build)
+
+
+def relevant_rows(df, dataset_hash, question, k=TOP_K, token_budget=ROW_TOKEN_BUDGET):
+    """挑出與問題最相關的資料列；沒有相關的列時回傳 None。"""
+    index = get_row_index(df, dataset_hash)
+    with span("retrieve_rows") as s:
+        rows = index.search(question, k=k, token_budget=token_budget)
+        s.set(rows=0 if rows is None else len(rows.table))
+    return rows
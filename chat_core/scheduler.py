@@ -0,0 +1,368 @@
+"""模型請求排程：所有 session 的模型呼叫都經過這裡，依金鑰限速、限制同時進行的請求數並自動重試。
+
+* 每把金鑰一個 token bucket，共用同一把金鑰的 session 共用額度；收到 429 時整把金鑰一起暫停。
+* 同時進行中的請求數有上限，超過時排隊。
+* 排隊依優先順序放行（回答 → 主題 → 背景摘要），同一優先順序內各 session 輪流，
+  一個 session 連續送出很多請求也不會讓其他人一直等。
+* 暫時性錯誤（429、500、503）以指數退避加隨機抖動重試。
+
+預設值假設每把金鑰每分鐘約 60 個請求（每秒補充 1 個、最多累積 5 個），是付費層級中最低的額度，
+少數幾位使用者連續提問時不必排隊。免費層級的 flash 模型每分鐘只有 10–15 個請求，
+照預設送出會頻繁收到 429 而整把金鑰暫停，應把 ``CHAT_RATE`` 設為 0.2 左右；額度較高的金鑰則調高。
+可用的環境變數為 ``CHAT_RATE``（每秒請求數）、``CHAT_BURST``（可累積的請求數）
+與 ``CHAT_MAX_CONCURRENCY``（同時進行的請求數）；批次與 HTTP 服務也可以用 ``--rate`` / ``--burst`` 指定。
+"""
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+from google.api_core import exceptions as google_exceptions
+
+PRIORITY_ANSWER = 0
+PRIORITY_TITLE = 1
+PRIORITY_BACKGROUND = 2
+
+DEFAULT_RATE = 1.0          # 每把金鑰每秒補充的請求數
+DEFAULT_BURST = 5           # 每把金鑰最多可累積的請求數
+MAX_CONCURRENCY = 16
+MAX_RETRIES = 3
+BASE_DELAY = 1.0
+MAX_DELAY = 30.0
+MAX_WAIT = 120.0            # 排隊等待上限（秒）
+WAIT_SAMPLES = 1000
+
+THROTTLE_ERRORS = (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted)
+RETRYABLE_ERRORS = THROTTLE_ERRORS + (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+)
+
+_session = contextvars.ContextVar("scheduler_session", default="")
+
+
+def set_session(session_id):
+    """設定目前呼叫者的 session 代號，用於公平排隊。
+
+    代號存在 contextvars 中；丟到執行緒池的工作請用 ``executor.submit`` 帶上目前的 context。
+    """
+    _session.set(session_id)
+
+
+def current_session():
+    return _session.get()
+
+
+def rate_key(model):
+    """模型所屬金鑰的雜湊（由 ModelRegistry 綁定），沒有時全部歸在同一個桶。"""
+    return getattr(model, "_rate_key", "")
+
+
+class StreamInterrupted(RuntimeError):
+    """串流已經輸出部分內容後才失敗；重送會重複輸出，因此不重試。"""
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def delay(self, now):
+        """距離可以放行下一個請求還要幾秒；0 表示現在就可以。"""
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now, seconds):
+        """被限流時清空額度並暫停，暫停結束後才重新開始累積。"""
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = self.paused_until
+
+
+class _Waiter:
+    __slots__ = ("key", "priority", "session", "enqueued", "wake", "granted")
+
+    def __init__(self, key, priority, session, wake):
+        self.key = key
+        self.priority = priority
+        self.session = session
+        self.enqueued = time.monotonic()
+        self.wake = wake
+        self.granted = False
+
+
+class RequestScheduler:
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_concurrency=MAX_CONCURRENCY,
+                 max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY, max_wait=MAX_WAIT):
+        # 速率為 0 時 token bucket 永遠補不滿，負數更會倒扣額度
+        if not rate > 0:
+            raise ValueError(f"rate 必須大於 0：{rate}")
+        if burst < 1:
+            raise ValueError(f"burst 至少為 1：{burst}")
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency 至少為 1：{max_concurrency}")
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._queues = {}               # 優先順序 -> OrderedDict(session -> deque[_Waiter])
+        self._active = 0
+        self._tick_due = None
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self.granted = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.timeouts = 0
+
+    # === 排隊與放行（呼叫端需持有 self._lock）===
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def _enqueue(self, key, priority, wake):
+        waiter = _Waiter(key, priority, _session.get(), wake)
+        with self._lock:
+            sessions = self._queues.setdefault(priority, OrderedDict())
+            sessions.setdefault(waiter.session, deque()).append(waiter)
+        return waiter
+
+    def _remove(self, waiter):
+        sessions = self._queues.get(waiter.priority)
+        waiters = sessions.get(waiter.session) if sessions else None
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del sessions[waiter.session]
+            if not sessions:
+                del self._queues[waiter.priority]
+
+    def _grant(self, waiter, now):
+        self._bucket(waiter.key).take(now)
+        self._active += 1
+        self.granted += 1
+        self._waits.append(now - waiter.enqueued)
+        waiter.granted = True
+        waiter.wake()
+
+    def _dispatch(self, now):
+        """依優先順序放行；同一優先順序內每個 session 輪流放行一個。
+
+        有請求被限速擋住時，排一個計時器在額度恢復時再放行一次。
+        """
+        next_delay = self._admit(now)
+        if next_delay is not None:
+            due = now + next_delay
+            if self._tick_due is None or not now < self._tick_due <= due:
+                self._tick_due = due
+                timer = threading.Timer(next_delay, self._tick)
+                timer.daemon = True
+                timer.start()
+
+    def _tick(self):
+        with self._lock:
+            self._tick_due = None
+            self._dispatch(time.monotonic())
+
+    def _admit(self, now):
+        """放行目前可以執行的請求；回傳被限速擋住的請求最早還要等幾秒，沒有時回傳 None。"""
+        next_delay = None
+        progressed = True
+        while progressed:
+            progressed = False
+            next_delay = None
+            for priority in sorted(self._queues):
+                sessions = self._queues[priority]
+                for session in list(sessions):
+                    if self._active >= self.max_concurrency:
+                        # 額滿時由 release 觸發下一次放行
+                        return None
+                    waiters = sessions[session]
+                    delay = self._bucket(waiters[0].key).delay(now)
+                    if delay > 0:
+                        next_delay = delay if next_delay is None else min(next_delay, delay)
+                        continue
+                    self._grant(waiters.popleft(), now)
+                    progressed = True
+                    # 放行後移到隊尾，輪到其他 session
+                    del sessions[session]
+                    if waiters:
+                        sessions[session] = waiters
+                if not sessions:
+                    del self._queues[priority]
+        return next_delay
+
+    def _poll(self, waiter, deadline):
+        """回傳剩餘的等待秒數，已放行時回傳 None；超過期限時丟出 TimeoutError。"""
+        with self._lock:
+            now = time.monotonic()
+            self._dispatch(now)
+            if waiter.granted:
+                return None
+            if now >= deadline:
+                self._remove(waiter)
+                self.timeouts += 1
+                raise TimeoutError("模型請求排隊等待逾時")
+            return deadline - now
+
+    def _abandon(self, waiter):
+        with self._lock:
+            if waiter.granted:
+                self._active -= 1
+                self._dispatch(time.monotonic())
+            else:
+                self._remove(waiter)
+
+    def acquire(self, key, priority=PRIORITY_ANSWER, max_wait=None):
+        """排隊直到可以送出請求；之後必須呼叫 ``release``。"""
+        event = threading.Event()
+        waiter = self._enqueue(key, priority, event.set)
+        deadline = waiter.enqueued + (self.max_wait if max_wait is None else max_wait)
+        try:
+            while True:
+                wait = self._poll(waiter, deadline)
+                if wait is None:
+                    return
+                event.wait(wait)
+                event.clear()
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    async def acquire_async(self, key, priority=PRIORITY_ANSWER, max_wait=None):
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = self._enqueue(key, priority, lambda: loop.call_soon_threadsafe(event.set))
+        deadline = waiter.enqueued + (self.max_wait if max_wait is None else max_wait)
+        try:
+            while True:
+                wait = self._poll(waiter, deadline)
+                if wait is None:
+                    return
+                try:
+                    await asyncio.wait_for(event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            self._dispatch(time.monotonic())
+
+    # === 重試 ===
+    def _backoff(self, key, error, attempt):
+        """回傳重試前要等的秒數；不再重試時回傳 None。"""
+        with self._lock:
+            if attempt >= self.max_retries:
+                self.failures += 1
+                return None
+            self.retries += 1
+            # 指數退避加上抖動，避免同時失敗的請求又同時重送
+            ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+            delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+            if isinstance(error, THROTTLE_ERRORS):
+                # 限流時整把金鑰一起暫停，排隊機制會讓重送等到暫停結束
+                self.throttled += 1
+                self._bucket(key).pause(time.monotonic(), delay)
+                return 0.0
+            return delay
+
+    def call(self, key, fn, *args, priority=PRIORITY_ANSWER, max_wait=None, **kwargs):
+        """排隊後執行 ``fn(*args, **kwargs)``，暫時性錯誤自動重試。"""
+        attempt = 0
+        while True:
+            self.acquire(key, priority, max_wait)
+            try:
+                return fn(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                delay = self._backoff(key, e, attempt)
+                if delay is None:
+                    raise
+            finally:
+                self.release()
+            attempt += 1
+            time.sleep(delay)
+
+    async def call_async(self, key, fn, *args, priority=PRIORITY_ANSWER, max_wait=None, **kwargs):
+        """``call`` 的非同步版本，``fn`` 為 async 函式。"""
+        attempt = 0
+        while True:
+            await self.acquire_async(key, priority, max_wait)
+            try:
+                return await fn(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                delay = self._backoff(key, e, attempt)
+                if delay is None:
+                    raise
+            finally:
+                self.release()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            queued = {
+                priority: sum(len(w) for w in sessions.values()) for priority, sessions in self._queues.items()
+            }
+            return {
+                "active": self._active,
+                "queued": sum(queued.values()),
+                "queued_by_priority": queued,
+                "granted": self.granted,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+                "p95_wait": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "max_wait": waits[-1] if waits else 0.0,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """程序層級共用的排程器（所有 Streamlit session 與 HTTP 服務共用）；第一次取得時讀取 ``CHAT_*`` 設定。"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            try:
+                _scheduler = RequestScheduler(
+                    rate=float(os.getenv("CHAT_RATE") or DEFAULT_RATE),
+                    burst=int(os.getenv("CHAT_BURST") or DEFAULT_BURST),
+                    max_concurrency=int(os.getenv("CHAT_MAX_CONCURRENCY") or MAX_CONCURRENCY),
+                )
+            except ValueError as e:
+                raise ValueError(f"CHAT_RATE / CHAT_BURST / CHAT_MAX_CONCURRENCY 設定錯誤：{e}") from e
+        return _scheduler
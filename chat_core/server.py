@@ -0,0 +1,494 @@
+"""非同步 HTTP 聊天服務：把 open.py 的聊天、主題與資料操作以 JSON／串流 API 提供給 index.html。
+
+一個程序以 asyncio 同時服務大量聊天 session，每則訊息不必重跑整份 Streamlit 腳本。
+模型呼叫使用 SDK 的 async 介面，同一把金鑰的模型在程序內重複使用。
+
+啟動::
+
+    python -m chat_core.server --port 8080
+
+金鑰來源依序為請求標頭 ``X-Api-Key``、環境變數 ``GEMINI_API_KEY`` / ``GOOGLE_API_KEY``（支援 .env）。
+預設只聽 127.0.0.1；以 ``--host`` 綁定其他位址時，每個請求都必須自帶 ``X-Api-Key``，
+伺服器環境中的金鑰不會借給外部的使用者。
+"""
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import time
+from pathlib import Path
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+from .charts import ChartError, get_chart
+from .client import AUTH_ERRORS, MODEL_NAME, get_registry
+from .context import ContextManager, get_context_manager
+from .executor import ANSWER_TIMEOUT, TITLE_TIMEOUT, generate_title_async
+from .ingest import get_frame_cache
+from .pipeline import prepare_data_async
+from .profiling import get_profile
+from .query import replay_chart
+from .prompts import build_answer_prompt, data_section, heuristic_title
+from .render import HISTORY_PAGE_SIZE, TOPIC_PAGE_SIZE
+from .response_cache import get_response_cache, scoped_context
+from .scheduler import get_scheduler, set_session
+from .store import get_conversation_store
+from .streaming import format_timing, generate_text_async
+from .tracing import get_tracer, start_trace
+
+INDEX_PATH = Path(__file__).resolve().parent.parent / "index.html"
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+
+
+def _error(status, message, code=None):
+    """錯誤回應；``code`` 讓前端區分錯誤種類（例如 ``auth`` 時才需要重新輸入金鑰）。"""
+    body = {"error": message}
+    if code is not None:
+        body["code"] = code
+    return web.json_response(body, status=status)
+
+
+class AuthError(Exception):
+    """API 金鑰驗證失敗。"""
+
+
+class DatasetNotFound(LookupError):
+    """請求指定的資料不在快取中（伺服器重啟或已被淘汰），需要重新上傳。"""
+
+
+class ChatBackend:
+    """聊天流程（與 open.py 相同）：主題與回答同時產生、回覆快取、對話脈絡、資料查詢。"""
+
+    def __init__(self, registry=None, store=None, contexts=None, frames=None, responses=None):
+        self.registry = registry or get_registry()
+        self.store = store or get_conversation_store()
+        # 指定了自己的 store 時，摘要也要讀寫同一個資料庫
+        self.contexts = contexts or (get_context_manager() if store is None else ContextManager(self.store))
+        self.frames = frames or get_frame_cache()
+        self.responses = responses or get_response_cache()
+
+    async def models(self, api_key):
+        """回傳 (同步模型, async 模型)，兩者都由 ModelRegistry 依 TTL 與 LRU 快取；金鑰無效時丟出 AuthError。"""
+        try:
+            sync_model = await asyncio.to_thread(self.registry.get_model, api_key)
+        except AUTH_ERRORS as e:
+            raise AuthError(str(e)) from e
+        return sync_model, self.registry.get_async_model(api_key)
+
+    async def chat(self, api_key, uid, message, topic_id=None, dataset_hash=None,
+                   query_mode=True, use_cache=True, on_chunk=None):
+        """回答一則訊息。金鑰無效時丟出 AuthError，主題不存在或不屬於 ``uid`` 時丟出 KeyError，
+        ``dataset_hash`` 不在快取中時丟出 DatasetNotFound；這些檢查都在寫入任何紀錄之前。"""
+        set_session(uid)
+        sync_model, model = await self.models(api_key)
+
+        is_new = topic_id is None
+        if not is_new:
+            topic = await asyncio.to_thread(self.store.get_topic, topic_id, uid)
+            if topic is None:
+                raise KeyError(topic_id)
+            topic_title = topic.title
+        # 資料不在快取時不能當作沒有資料回答，否則沒有資料的回覆會以這份資料的雜湊存進快取
+        df = self.frames.get(dataset_hash) if dataset_hash else None
+        if dataset_hash and df is None:
+            raise DatasetNotFound(dataset_hash)
+
+        title_task = None
+        figure = None
+        if is_new:
+            topic_id = await asyncio.to_thread(self.store.create_topic, uid, "（產生主題中...）")
+            title_task = asyncio.create_task(
+                asyncio.wait_for(generate_title_async(model, message, TITLE_TIMEOUT), TITLE_TIMEOUT)
+            )
+            topic_title = heuristic_title(message)
+
+        try:
+            history_text = await asyncio.to_thread(self.contexts.build, topic_id)
+            cache_context = scoped_context(f"主題是「{topic_title}」。" + history_text, "topic", query_mode)
+
+            cached = None
+            if use_cache:
+                cached = await asyncio.to_thread(
+                    self.responses.get, MODEL_NAME, message, dataset_hash, cache_context
+                )
+
+            if cached is not None:
+                answer = cached.answer
+                timing = {"ttft": None, "latency": 0.0, "cached": cached.tier}
+                if on_chunk is not None:
+                    await on_chunk(answer)
+            else:
+                started = time.perf_counter()
+                profile, query_result, rows = await prepare_data_async(
+                    model, df, dataset_hash, message, history_text, query_mode
+                )
+                if query_result is not None and query_result.answer:
+                    # 預測與畫圖由本地直接回答，不必再等模型組織回覆
+                    answer = query_result.answer
+                    timing = {"ttft": None, "latency": time.perf_counter() - started, "local": query_result.spec["op"]}
+                    if query_result.chart is not None:
+                        timing["chart"] = {"dataset_hash": dataset_hash, "spec": query_result.spec}
+                        figure = json.loads(query_result.chart.figure_json)
+                    if on_chunk is not None:
+                        await on_chunk(answer)
+                else:
+                    prompt = build_answer_prompt(topic_title, message, history_text, data_section(profile, query_result, rows))
+                    result = await generate_text_async(
+                        model, prompt, stream=on_chunk is not None, on_chunk=on_chunk, timeout=ANSWER_TIMEOUT
+                    )
+                    answer = result.text.strip()
+                    timing = result.timing()
+                if use_cache and answer and figure is None:
+                    await asyncio.to_thread(
+                        self.responses.put, MODEL_NAME, message, answer, dataset_hash, cache_context, timing["latency"]
+                    )
+
+            if is_new:
+                try:
+                    topic_title = await title_task
+                except Exception:
+                    pass
+                await asyncio.to_thread(self.store.rename_topic, topic_id, topic_title)
+
+        except Exception as e:
+            if title_task is not None:
+                title_task.cancel()
+                await asyncio.to_thread(self.store.rename_topic, topic_id, "錯誤主題")
+                topic_title = "錯誤主題"
+            answer = f"⚠️ 發生錯誤：{e}"
+            timing = {}
+
+        await asyncio.to_thread(self.store.append_turn, topic_id, message, answer, timing)
+        self.contexts.schedule_update(sync_model, topic_id)
+        return {
+            "topic_id": topic_id,
+            "title": topic_title,
+            "answer": answer,
+            "timing": timing,
+            "timing_text": format_timing(timing),
+            "figure": figure,
+        }
+
+
+# ============================================
+# HTTP 路由
+# ============================================
+routes = web.RouteTableDef()
+BACKEND = web.AppKey("backend", ChatBackend)
+REQUIRE_CLIENT_KEY = web.AppKey("require_client_key", bool)
+
+
+def _api_key(request):
+    key = request.headers.get("X-Api-Key")
+    if key or request.app[REQUIRE_CLIENT_KEY]:
+        return key
+    return os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+
+
+def _bad_request(message):
+    return web.HTTPBadRequest(text=json.dumps({"error": message}, ensure_ascii=False), content_type="application/json")
+
+
+def _int_query(request, name, default):
+    value = request.query.get(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise _bad_request(f"{name} 必須是整數")
+
+
+async def _json_object(request, message):
+    try:
+        payload = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise _bad_request(message)
+    if not isinstance(payload, dict):
+        raise _bad_request(message)
+    return payload
+
+
+async def _chat_payload(request):
+    payload = await _json_object(request, "請求內容必須是 JSON 物件")
+    if not isinstance(payload.get("uid"), str) or not isinstance(payload.get("message"), str):
+        raise _bad_request("缺少 uid 或 message")
+    if not payload["uid"] or not payload["message"].strip():
+        raise _bad_request("缺少 uid 或 message")
+    for field in ("topic_id", "dataset_hash"):
+        if payload.get(field) is not None and not isinstance(payload[field], str):
+            raise _bad_request(f"{field} 必須是字串")
+    return payload
+
+
+def _chat_error(e):
+    """聊天請求失敗時的 (HTTP 狀態碼, 訊息, 錯誤代碼)；只有金鑰無效是 401。"""
+    if isinstance(e, AuthError):
+        return 401, f"API 金鑰驗證失敗或無效：{e}", "auth"
+    if isinstance(e, DatasetNotFound):
+        return 409, "找不到資料，請重新上傳", "dataset"
+    if isinstance(e, KeyError):
+        return 404, "找不到這個主題", "topic"
+    return 500, f"伺服器錯誤：{e}", "server"
+
+
+def _chat_kwargs(payload):
+    return {
+        "uid": payload["uid"],
+        "message": payload["message"],
+        "topic_id": payload.get("topic_id"),
+        "dataset_hash": payload.get("dataset_hash"),
+        "query_mode": payload.get("query_mode", True),
+        "use_cache": payload.get("cache", True),
+    }
+
+
+@routes.get("/")
+async def index(request):
+    return web.FileResponse(INDEX_PATH)
+
+
+@routes.get("/api/health")
+async def health(request):
+    return web.json_response({
+        "status": "ok",
+        "models": get_registry().stats(),
+        "scheduler": get_scheduler().stats(),
+    })
+
+
+@routes.get("/api/topics")
+async def list_topics(request):
+    store = request.app[BACKEND].store
+    uid = request.query.get("uid")
+    if not uid:
+        return _error(400, "缺少 uid")
+    page = max(0, _int_query(request, "page", 0))
+    search = request.query.get("q") or None
+    total, topics = await asyncio.gather(
+        asyncio.to_thread(store.count_topics, uid, search),
+        asyncio.to_thread(store.list_topics, uid, TOPIC_PAGE_SIZE, page * TOPIC_PAGE_SIZE, search),
+    )
+    return web.json_response({
+        "topics": [{"id": t.id, "title": t.title, "updated_at": t.updated_at} for t in topics],
+        "total": total,
+        "page": page,
+        "page_size": TOPIC_PAGE_SIZE,
+    })
+
+
+@routes.delete("/api/topics")
+async def clear_topics(request):
+    uid = request.query.get("uid")
+    if not uid:
+        return _error(400, "缺少 uid")
+    await asyncio.to_thread(request.app[BACKEND].store.clear, uid)
+    return web.json_response({"cleared": True})
+
+
+@routes.get("/api/topics/{topic_id}/turns")
+async def list_turns(request):
+    store = request.app[BACKEND].store
+    uid = request.query.get("uid")
+    if not uid:
+        return _error(400, "缺少 uid")
+    limit = max(1, min(100, _int_query(request, "limit", HISTORY_PAGE_SIZE)))
+    before = _int_query(request, "before", None)
+    topic_id = request.match_info["topic_id"]
+    if await asyncio.to_thread(store.get_topic, topic_id, uid) is None:
+        return _error(404, "找不到這個主題")
+    turns = await asyncio.to_thread(store.get_turns, topic_id, limit, before)
+    return web.json_response({"turns": await asyncio.to_thread(_turns_payload, turns)})
+
+
+def _turns_payload(turns):
+    payload = []
+    for turn in turns:
+        item = {"id": turn.id, **turn.as_dict(), "timing_text": format_timing(turn.meta), "figure": None}
+        chart_meta = turn.meta.get("chart")
+        if chart_meta:
+            # 紀錄中只有圖表規格，圖表本身從快取取回
+            chart = replay_chart(chart_meta["dataset_hash"], chart_meta["spec"])
+            item["figure"] = json.loads(chart.figure_json) if chart is not None else None
+        payload.append(item)
+    return payload
+
+
+@routes.post("/api/datasets")
+async def upload_dataset(request):
+    """上傳 CSV：可用 multipart（欄位 file）或直接以請求內容傳送。"""
+    if request.content_type.startswith("multipart/"):
+        reader = await request.multipart()
+        field = await reader.next()
+        if field is None:
+            return _error(400, "缺少檔案")
+        data = await field.read(decode=False)
+    else:
+        data = await request.read()
+    if not data:
+        return _error(400, "檔案是空的")
+
+    frames = request.app[BACKEND].frames
+    try:
+        df, dataset_hash = await asyncio.to_thread(frames.load_bytes, data)
+    except Exception as e:
+        return _error(400, f"無法讀取 CSV 檔案：{e}")
+    profile = await asyncio.to_thread(get_profile, df, dataset_hash)
+    return web.json_response({
+        "dataset_hash": dataset_hash,
+        "rows": len(df),
+        "columns": [str(c) for c in df.columns],
+        "encoding": df.attrs.get("encoding"),
+        "delimiter": df.attrs.get("delimiter"),
+        "truncated": bool(df.attrs.get("truncated")),
+        "profile": profile.to_text(),
+    })
+
+
+@routes.get("/api/datasets/{dataset_hash}/profile")
+async def dataset_profile(request):
+    dataset_hash = request.match_info["dataset_hash"]
+    df = request.app[BACKEND].frames.get(dataset_hash)
+    if df is None:
+        return _error(404, "找不到資料，請重新上傳")
+    profile = await asyncio.to_thread(get_profile, df, dataset_hash)
+    return web.json_response({
+        "text": profile.to_text(),
+        "columns": json.loads(profile.to_frame().to_json(orient="records", force_ascii=False)),
+    })
+
+
+@routes.post("/api/datasets/{dataset_hash}/chart")
+async def dataset_chart(request):
+    """依圖表規格（kind / x / y / color / agg）回傳在伺服器端彙總好的 Plotly 圖表。"""
+    dataset_hash = request.match_info["dataset_hash"]
+    df = request.app[BACKEND].frames.get(dataset_hash)
+    if df is None:
+        return _error(404, "找不到資料，請重新上傳")
+    spec = await _json_object(request, "請以 JSON 物件傳送圖表規格")
+    try:
+        chart = await asyncio.to_thread(get_chart, df, dataset_hash, spec)
+    except ChartError as e:
+        return _error(400, str(e))
+    return web.json_response({
+        "figure": json.loads(chart.figure_json),
+        "description": chart.describe(),
+        "points": chart.points,
+        "rows": chart.rows,
+    })
+
+
+@routes.post("/api/chat")
+async def chat(request):
+    api_key = _api_key(request)
+    if not api_key:
+        return _error(401, "缺少 Gemini API 金鑰", "auth")
+    payload = await _chat_payload(request)
+    try:
+        result = await request.app[BACKEND].chat(api_key, **_chat_kwargs(payload))
+    except Exception as e:
+        return _error(*_chat_error(e))
+    return web.json_response(result)
+
+
+@routes.post("/api/chat/stream")
+async def chat_stream(request):
+    """以 NDJSON 串流回覆：多行 {"type": "chunk", "text": 新增文字}，最後一行 {"type": "done", ...}。"""
+    api_key = _api_key(request)
+    if not api_key:
+        return _error(401, "缺少 Gemini API 金鑰", "auth")
+    payload = await _chat_payload(request)
+
+    # 第一段回覆送出前才開始串流，金鑰、主題與資料的檢查失敗時仍可回傳對應的狀態碼
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson; charset=utf-8"})
+
+    async def send(event):
+        if not response.prepared:
+            await response.prepare(request)
+        await response.write((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    sent = 0
+
+    async def on_chunk(text):
+        nonlocal sent
+        await send({"type": "chunk", "text": text[sent:]})
+        sent = len(text)
+
+    start = time.perf_counter()
+    try:
+        result = await request.app[BACKEND].chat(api_key, on_chunk=on_chunk, **_chat_kwargs(payload))
+        await send({"type": "done", **result, "elapsed": time.perf_counter() - start})
+    except Exception as e:
+        status, message, code = _chat_error(e)
+        if not response.prepared:
+            return _error(status, message, code)
+        await send({"type": "error", "message": message, "code": code})
+    await response.write_eof()
+    return response
+
+
+@routes.get("/metrics")
+async def metrics(request):
+    """Prometheus 文字格式的各階段耗時、token 數與排程器指標。"""
+    return web.Response(text=get_tracer().prometheus_text(), content_type="text/plain", charset="utf-8")
+
+
+@web.middleware
+async def trace_requests(request, handler):
+    # 每個請求是一個 trace；/metrics 本身不記錄
+    if request.path == "/metrics":
+        return await handler(request)
+    route = request.match_info.route.resource
+    trace = start_trace("http", method=request.method, route=route.canonical if route else request.path)
+    try:
+        response = await handler(request)
+    except BaseException as e:
+        trace.end(e)
+        raise
+    trace.set(status=response.status)
+    trace.end()
+    return response
+
+
+def create_app(backend=None, require_client_key=False):
+    """``require_client_key`` 為真時只接受請求自帶的金鑰，不使用伺服器環境中的金鑰。"""
+    app = web.Application(client_max_size=MAX_UPLOAD_BYTES, middlewares=[trace_requests])
+    app[BACKEND] = backend or ChatBackend()
+    app[REQUIRE_CLIENT_KEY] = require_client_key
+    app.add_routes(routes)
+    return app
+
+
+def _is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gemini 聊天室 HTTP 服務")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="綁定的位址；不是本機位址時每個請求都必須自帶 X-Api-Key")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--rate", type=float, help="每把金鑰每秒送出的模型請求數（預設讀 CHAT_RATE）")
+    parser.add_argument("--burst", type=int, help="每把金鑰可累積的請求數（預設讀 CHAT_BURST）")
+    args = parser.parse_args(argv)
+    if args.rate is not None and not args.rate > 0:
+        parser.error("--rate 必須大於 0")
+    if args.burst is not None and args.burst < 1:
+        parser.error("--burst 至少為 1")
+    # 排程器第一次取得時讀取這些設定
+    if args.rate is not None:
+        os.environ["CHAT_RATE"] = str(args.rate)
+    if args.burst is not None:
+        os.environ["CHAT_BURST"] = str(args.burst)
+
+    load_dotenv()
+    web.run_app(create_app(require_client_key=not _is_loopback(args.host)), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""聊天紀錄儲存：以 SQLite（WAL 模式）保存主題與對話，取代只活在 session 裡的 dict。
+
+* 主題 id 是 uuid，清除紀錄後重新建立也不會撞號。
+* 每一輪對話完成後只寫入一次（append-only），不會重寫整份歷史。
+* 主題清單與對話內容都以分頁查詢讀取，session 只保存目前的主題 id。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from .tracing import span
+
+DEFAULT_PATH = os.path.join(".cache", "conversations.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS topics (
+    id         TEXT PRIMARY KEY,
+    owner      TEXT NOT NULL,
+    title      TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic_id   TEXT NOT NULL REFERENCES topics (id) ON DELETE CASCADE,
+    user       TEXT NOT NULL,
+    bot        TEXT NOT NULL,
+    meta       TEXT NOT NULL DEFAULT '{}',
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    topic_id   TEXT PRIMARY KEY REFERENCES topics (id) ON DELETE CASCADE,
+    text       TEXT NOT NULL,
+    upto_id    INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_topics_owner_updated ON topics (owner, updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_turns_topic ON turns (topic_id, id);
+CREATE INDEX IF NOT EXISTS idx_turns_created ON turns (created_at);
+"""
+
+
+@dataclass
+class Topic:
+    id: str
+    title: str
+    updated_at: float
+
+
+@dataclass
+class Summary:
+    text: str
+    upto_id: int          # 摘要涵蓋到哪一輪（含）
+
+
+@dataclass
+class Turn:
+    id: int
+    user: str
+    bot: str
+    meta: dict = field(default_factory=dict)
+
+    def as_dict(self):
+        """與舊版 history 項目相同的格式：{"user", "bot", 以及計時等附加欄位}。"""
+        return {"user": self.user, "bot": self.bot, **self.meta}
+
+
+class ConversationStore:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(_SCHEMA)
+
+    # === 主題 ===
+    def create_topic(self, owner, title):
+        topic_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO topics (id, owner, title, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (topic_id, owner, title, now, now),
+            )
+            self._conn.commit()
+        return topic_id
+
+    def rename_topic(self, topic_id, title):
+        with self._lock:
+            self._conn.execute("UPDATE topics SET title = ? WHERE id = ?", (title, topic_id))
+            self._conn.commit()
+
+    def get_topic(self, topic_id, owner=None):
+        """取得主題；指定 ``owner`` 時，主題不屬於這個使用者也回傳 None。"""
+        sql, params = "SELECT id, title, updated_at FROM topics WHERE id = ?", [topic_id]
+        if owner is not None:
+            sql += " AND owner = ?"
+            params.append(owner)
+        with self._lock:
+            row = self._conn.execute(sql, params).fetchone()
+        return Topic(*row) if row else None
+
+    @staticmethod
+    def _topic_filter(owner, search):
+        sql, params = "owner = ?", [owner]
+        if search:
+            escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            sql += " AND title LIKE ? ESCAPE '\\'"
+            params.append(f"%{escaped}%")
+        return sql, params
+
+    def list_topics(self, owner, limit=20, offset=0, search=None):
+        """依最後更新時間由新到舊分頁列出主題；``search`` 以標題關鍵字篩選。"""
+        where, params = self._topic_filter(owner, search)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, title, updated_at FROM topics WHERE {where} "
+                "ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+        return [Topic(*row) for row in rows]
+
+    def count_topics(self, owner, search=None):
+        where, params = self._topic_filter(owner, search)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM topics WHERE {where}", params).fetchone()[0]
+
+    def clear(self, owner):
+        with self._lock:
+            self._conn.execute("DELETE FROM topics WHERE owner = ?", (owner,))
+            self._conn.commit()
+
+    # === 對話 ===
+    def append_turn(self, topic_id, user, bot, meta=None):
+        now = time.time()
+        with span("store_turn"), self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO turns (topic_id, user, bot, meta, created_at) VALUES (?, ?, ?, ?, ?)",
+                (topic_id, user, bot, json.dumps(meta or {}, ensure_ascii=False), now),
+            )
+            self._conn.execute("UPDATE topics SET updated_at = ? WHERE id = ?", (now, topic_id))
+            self._conn.commit()
+        return cursor.lastrowid
+
+    def get_turns(self, topic_id, limit=None, before_id=None, after_id=None, oldest_first=False):
+        """預設由新到舊回傳對話；``before_id`` / ``after_id`` 限定 id 範圍（不含端點）。"""
+        sql = "SELECT id, user, bot, meta FROM turns WHERE topic_id = ?"
+        params = [topic_id]
+        if before_id is not None:
+            sql += " AND id < ?"
+            params.append(before_id)
+        if after_id is not None:
+            sql += " AND id > ?"
+            params.append(after_id)
+        sql += " ORDER BY id ASC" if oldest_first else " ORDER BY id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [Turn(id=r[0], user=r[1], bot=r[2], meta=json.loads(r[3])) for r in rows]
+
+    def count_turns(self, topic_id):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM turns WHERE topic_id = ?", (topic_id,)).fetchone()[0]
+
+    # === 較早對話的摘要 ===
+    def get_summary(self, topic_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, upto_id FROM summaries WHERE topic_id = ?", (topic_id,)
+            ).fetchone()
+        return Summary(*row) if row else None
+
+    def set_summary(self, topic_id, text, upto_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (topic_id, text, upto_id, updated_at) VALUES (?, ?, ?, ?)",
+                (topic_id, text, upto_id, time.time()),
+            )
+            self._conn.commit()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ConversationStore()
+        return _store
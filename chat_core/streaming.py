@@ -0,0 +1,134 @@
+"""模型呼叫與計時：支援串流（stream=True）逐段輸出，並記錄首字延遲與總延遲。"""
+import time
+from dataclasses import dataclass
+
+from .scheduler import PRIORITY_ANSWER, RETRYABLE_ERRORS, StreamInterrupted, get_scheduler, rate_key
+from .tracing import span
+
+
+@dataclass
+class GenerationResult:
+    text: str
+    ttft: float | None    # time-to-first-token（秒），沒有任何文字時為 None
+    latency: float        # 整體耗時（秒）
+    chunks: int
+
+    def timing(self):
+        return {"ttft": self.ttft, "latency": self.latency}
+
+
+def request_options(timeout):
+    """單次呼叫的逾時設定（秒），None 表示沿用 SDK 預設。"""
+    return {"request_options": {"timeout": timeout}} if timeout is not None else {}
+
+
+def _chunk_text(chunk):
+    # 被安全機制擋下或只帶 finish_reason 的片段沒有 text，存取時會丟出 ValueError
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+def generate_text(model, prompt, stream=False, on_chunk=None, timeout=None, priority=PRIORITY_ANSWER):
+    """經由排程器呼叫模型並回傳 GenerationResult。
+
+    ``stream=True`` 時每收到一段文字就以「目前累積的完整文字」呼叫 ``on_chunk``，
+    方便直接寫入 Streamlit placeholder。計時包含排隊等待的時間。
+    """
+    start = time.perf_counter()
+
+    def run():
+        if not stream:
+            response = model.generate_content(prompt, **request_options(timeout))
+            elapsed = time.perf_counter() - start
+            return GenerationResult(text=response.text, ttft=elapsed, latency=elapsed, chunks=1)
+
+        ttft = None
+        parts = []
+        try:
+            for chunk in model.generate_content(prompt, stream=True, **request_options(timeout)):
+                text = _chunk_text(chunk)
+                if not text:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                parts.append(text)
+                if on_chunk is not None:
+                    on_chunk("".join(parts))
+        except RETRYABLE_ERRORS as e:
+            if parts:
+                raise StreamInterrupted(str(e)) from e
+            raise
+
+        return GenerationResult(
+            text="".join(parts),
+            ttft=ttft,
+            latency=time.perf_counter() - start,
+            chunks=len(parts),
+        )
+
+    with span("answer", stream=stream) as s:
+        s.record_text("prompt", prompt)
+        result = get_scheduler().call(rate_key(model), run, priority=priority)
+        s.record_text("response", result.text)
+        s.set(ttft=result.ttft, chunks=result.chunks)
+    return result
+
+
+async def generate_text_async(model, prompt, stream=False, on_chunk=None, timeout=None, priority=PRIORITY_ANSWER):
+    """``generate_text`` 的非同步版本；``on_chunk`` 為 async 函式，同樣收到累積的完整文字。"""
+    start = time.perf_counter()
+
+    async def run():
+        if not stream:
+            response = await model.generate_content_async(prompt, **request_options(timeout))
+            elapsed = time.perf_counter() - start
+            return GenerationResult(text=response.text, ttft=elapsed, latency=elapsed, chunks=1)
+
+        ttft = None
+        parts = []
+        try:
+            response = await model.generate_content_async(prompt, stream=True, **request_options(timeout))
+            async for chunk in response:
+                text = _chunk_text(chunk)
+                if not text:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                parts.append(text)
+                if on_chunk is not None:
+                    await on_chunk("".join(parts))
+        except RETRYABLE_ERRORS as e:
+            if parts:
+                raise StreamInterrupted(str(e)) from e
+            raise
+
+        return GenerationResult(
+            text="".join(parts),
+            ttft=ttft,
+            latency=time.perf_counter() - start,
+            chunks=len(parts),
+        )
+
+    with span("answer", stream=stream) as s:
+        s.record_text("prompt", prompt)
+        result = await get_scheduler().call_async(rate_key(model), run, priority=priority)
+        s.record_text("response", result.text)
+        s.set(ttft=result.ttft, chunks=result.chunks)
+    return result
+
+
+def format_timing(turn):
+    """把歷史紀錄中的計時欄位格式化成一行說明文字；沒有計時資料時回傳空字串。"""
+    latency = turn.get("latency")
+    if latency is None:
+        return ""
+    if turn.get("cached"):
+        return "💾 快取回覆" + ("（相似問題）" if turn["cached"] == "near" else "")
+    if turn.get("local"):
+        label = "📈 本地繪圖" if turn["local"] == "chart" else "🧮 本地模型預測"
+        return f"{label}・總計 {latency:.2f}s"
+    ttft = turn.get("ttft")
+    first = f"首字 {ttft:.2f}s・" if ttft is not None else ""
+    return f"⏱️ {first}總計 {latency:.2f}s"
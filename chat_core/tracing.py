@@ -0,0 +1,293 @@
+"""各階段耗時追蹤：每次 rerun / 送出 / HTTP 請求是一個 trace，其中每個處理階段是一個 span。
+
+* span 結束時寫入程序內的直方圖（依階段名稱分組），並累計提示詞與回覆的字元數、token 數。
+* trace 結束時保留在最近的紀錄中，並以一行 JSON 附加到 ``.cache/traces.jsonl``（超過上限時輪替）。
+* ``prometheus_text()`` 以 Prometheus 文字格式輸出所有指標。
+
+每個 span 只有兩次 ``perf_counter`` 與一次加鎖的直方圖更新，可以在正式環境常駐。
+環境變數 ``CHAT_TRACING=0`` 關閉追蹤，``CHAT_TRACE_FILE`` 改變 JSONL 路徑（設為空字串則不寫檔）。
+"""
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from .prompts import estimate_tokens
+from .scheduler import get_scheduler
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RECENT_TRACES = 50
+DEFAULT_TRACE_FILE = os.path.join(".cache", "traces.jsonl")
+MAX_TRACE_FILE_BYTES = 20 * 1024 * 1024
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # 最後一格是 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """以桶內線性內插估計分位數（與 Prometheus 的 histogram_quantile 相同做法）。"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class Span:
+    __slots__ = ("name", "attrs", "children", "parent", "start", "started_at", "duration", "error", "_token", "_tracer")
+
+    def __init__(self, tracer, name, parent, attrs):
+        self._tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.children = []
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.duration = None
+        self.error = None
+        self._token = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self, error=None):
+        self._tracer.end(self, error)
+
+    def record_text(self, kind, text, tokens=None):
+        """記錄提示詞或回覆（``kind`` 為 prompt / response）的字元數與 token 數；
+        模型有回報實際 token 數時以實際值為準，否則用估計值。"""
+        text = text or ""
+        self.attrs[f"{kind}_chars"] = len(text)
+        self.attrs[f"{kind}_tokens"] = tokens if tokens is not None else estimate_tokens(text)
+
+    def record_usage(self, response):
+        """取出回應中的 usage_metadata（有的話）作為實際 token 數。"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        response_tokens = getattr(usage, "candidates_token_count", None)
+        if prompt_tokens:
+            self.attrs["prompt_tokens"] = prompt_tokens
+        if response_tokens:
+            self.attrs["response_tokens"] = response_tokens
+
+    def to_dict(self):
+        data = {"name": self.name, "start": self.started_at, "duration": self.duration, **self.attrs}
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [child.to_dict() for child in self.children]
+        return data
+
+
+class _NullSpan:
+    """追蹤關閉時使用，所有操作都不做事。"""
+
+    def set(self, **attrs):
+        pass
+
+    def record_text(self, kind, text, tokens=None):
+        pass
+
+    def record_usage(self, response):
+        pass
+
+    def end(self, error=None):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    def __init__(self, enabled=True, trace_file=DEFAULT_TRACE_FILE, max_file_bytes=MAX_TRACE_FILE_BYTES):
+        self.enabled = enabled
+        self.trace_file = trace_file
+        self.max_file_bytes = max_file_bytes
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._histograms = defaultdict(Histogram)
+        self._errors = defaultdict(int)
+        self._tokens = defaultdict(int)            # (stage, prompt/response) -> token 數
+        self._recent = deque(maxlen=RECENT_TRACES)
+
+    # === span ===
+    def start(self, name, root=False, **attrs):
+        """開始一個 span 並設為目前的 span；``root=True`` 時開始新的 trace，不接在目前的 span 之下。"""
+        if not self.enabled:
+            return _NULL_SPAN
+        parent = None if root else _current.get()
+        span = Span(self, name, parent, attrs)
+        if parent is not None:
+            parent.children.append(span)
+        span._token = _current.set(span)
+        return span
+
+    def end(self, span, error=None):
+        if span is _NULL_SPAN:
+            return
+        span.duration = time.perf_counter() - span.start
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        try:
+            _current.reset(span._token)
+        except ValueError:
+            # 在不同的 context 結束（例如 Streamlit 中斷後的下一次 rerun），直接清掉
+            _current.set(span.parent)
+
+        with self._lock:
+            self._histograms[span.name].observe(span.duration)
+            if span.error:
+                self._errors[span.name] += 1
+            for kind in ("prompt", "response"):
+                tokens = span.attrs.get(f"{kind}_tokens")
+                if tokens:
+                    self._tokens[span.name, kind] += tokens
+            if span.parent is None:
+                self._recent.append(span)
+        if span.parent is None:
+            self._export(span)
+
+    @contextmanager
+    def span(self, name, root=False, **attrs):
+        span = self.start(name, root=root, **attrs)
+        try:
+            yield span
+        except BaseException as e:
+            self.end(span, error=e)
+            raise
+        self.end(span)
+
+    # === 匯出 ===
+    def _export(self, span):
+        if not self.trace_file:
+            return
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n"
+        with self._file_lock:
+            try:
+                os.makedirs(os.path.dirname(self.trace_file) or ".", exist_ok=True)
+                if os.path.exists(self.trace_file) and os.path.getsize(self.trace_file) > self.max_file_bytes:
+                    os.replace(self.trace_file, self.trace_file + ".1")
+                with open(self.trace_file, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError:
+                pass
+
+    def recent(self, limit=None):
+        with self._lock:
+            traces = list(self._recent)
+        return traces[-limit:] if limit else traces
+
+    def last_trace(self, stage):
+        """最近一個包含 ``stage`` 階段的 trace；沒有時回傳 None。"""
+        for trace in reversed(self.recent()):
+            if any(child.name == stage for child in trace.children):
+                return trace
+        return None
+
+    def stage_summary(self):
+        """每個階段一列：次數、平均、p50、p95（秒）、錯誤數與累計 token 數。"""
+        with self._lock:
+            rows = []
+            for name, hist in sorted(self._histograms.items()):
+                rows.append({
+                    "階段": name,
+                    "次數": hist.count,
+                    "平均": round(hist.sum / hist.count, 4),
+                    "p50": round(hist.quantile(0.5), 4),
+                    "p95": round(hist.quantile(0.95), 4),
+                    "錯誤": self._errors.get(name, 0),
+                    "提示詞 tokens": self._tokens.get((name, "prompt"), 0),
+                    "回覆 tokens": self._tokens.get((name, "response"), 0),
+                })
+            return rows
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP chat_stage_duration_seconds Duration of each chat pipeline stage.",
+            "# TYPE chat_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for name, hist in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, n in zip(hist.buckets, hist.counts):
+                    cumulative += n
+                    lines.append(f'chat_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'chat_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {hist.count}')
+                lines.append(f'chat_stage_duration_seconds_sum{{stage="{name}"}} {hist.sum}')
+                lines.append(f'chat_stage_duration_seconds_count{{stage="{name}"}} {hist.count}')
+            lines += [
+                "# HELP chat_stage_errors_total Stages that ended with an exception.",
+                "# TYPE chat_stage_errors_total counter",
+            ]
+            lines += [f'chat_stage_errors_total{{stage="{name}"}} {n}' for name, n in sorted(self._errors.items())]
+            lines += [
+                "# HELP chat_stage_tokens_total Prompt and response tokens per stage.",
+                "# TYPE chat_stage_tokens_total counter",
+            ]
+            lines += [
+                f'chat_stage_tokens_total{{stage="{name}",kind="{kind}"}} {n}'
+                for (name, kind), n in sorted(self._tokens.items())
+            ]
+
+        scheduler = get_scheduler().stats()
+        for key, kind, help_text in (
+            ("active", "gauge", "Model requests in flight."),
+            ("queued", "gauge", "Model requests waiting in the scheduler queue."),
+            ("avg_wait", "gauge", "Mean queue wait of recent requests in seconds."),
+            ("p95_wait", "gauge", "95th percentile queue wait of recent requests in seconds."),
+            ("retries", "counter", "Model requests retried after a transient error."),
+            ("throttled", "counter", "Model requests rejected with a rate-limit error."),
+            ("failures", "counter", "Model requests that failed after all retries."),
+        ):
+            name = f"chat_scheduler_{key}" + ("_total" if kind == "counter" else "")
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {scheduler[key]}"]
+        return "\n".join(lines) + "\n"
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(
+                enabled=os.getenv("CHAT_TRACING", "1") != "0",
+                trace_file=os.getenv("CHAT_TRACE_FILE", DEFAULT_TRACE_FILE),
+            )
+        return _tracer
+
+
+def span(name, **attrs):
+    """``with span("answer") as s: ...``：在目前的 trace 下記錄一個階段。"""
+    return get_tracer().span(name, **attrs)
+
+
+def start_trace(name, **attrs):
+    """開始新的 trace（例如一次 Streamlit rerun），結束時呼叫回傳值的 ``end()``。"""
+    return get_tracer().start(name, root=True, **attrs)
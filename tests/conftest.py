@@ -0,0 +1,7 @@
+import os
+import sys
+from pathlib import Path
+
+# 測試不寫入 .cache/traces.jsonl
+os.environ.setdefault("CHAT_TRACE_FILE", "")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,26 @@
+import json
+
+from chat_core import batch, client
+from chat_core.fake import FAKE_MODEL_NAME
+
+
+class NoCache:
+    def get(self, *args):
+        raise AssertionError("--fake 不可讀取回覆快取")
+
+    put = get
+
+
+def test_fake_batch_skips_response_cache_and_records_model(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "get_response_cache", NoCache)
+    monkeypatch.setattr(client, "_registry", client._registry)      # --fake 會換掉全域登錄表
+    questions = tmp_path / "q.txt"
+    questions.write_text("平均身高是多少\n最高的人多高\n", encoding="utf-8")
+    output = tmp_path / "answers.jsonl"
+
+    code = batch.main([str(questions), "--output", str(output), "--fake", "--fake-latency", "0"])
+
+    records = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert code == 0 and len(records) == 2
+    assert {r["model"] for r in records} == {FAKE_MODEL_NAME}
+    assert all(r["source"] == "model" for r in records)
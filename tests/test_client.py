@@ -0,0 +1,57 @@
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from chat_core.client import ModelRegistry
+
+
+class Registry(ModelRegistry):
+    """不連網：``errors`` 依序作為每次驗證丟出的錯誤，None 表示驗證通過。"""
+
+    def __init__(self, errors, **kwargs):
+        super().__init__(**kwargs)
+        self.errors = list(errors)
+
+    def _build_model(self, api_key):
+        return object()
+
+    def _validate(self, model):
+        self.validations += 1
+        error = self.errors.pop(0)
+        if error is not None:
+            raise error
+
+
+def test_valid_key_is_validated_once():
+    registry = Registry([None])
+    model = registry.get_model("key")
+    assert registry.get_model("key") is model
+    assert registry.stats()["hits"] == 1 and registry.validations == 1
+
+
+@pytest.mark.parametrize("error", [
+    google_exceptions.InvalidArgument("API key not valid"),
+    google_exceptions.PermissionDenied("denied"),
+    google_exceptions.Unauthenticated("no"),
+])
+def test_auth_failures_are_remembered(error):
+    registry = Registry([error])
+    for _ in range(3):
+        with pytest.raises(type(error)):
+            registry.get_model("bad")
+    stats = registry.stats()
+    assert registry.validations == 1
+    assert (stats["failures"], stats["failure_hits"], stats["hits"]) == (1, 2, 0)
+
+
+@pytest.mark.parametrize("error", [
+    google_exceptions.ServiceUnavailable("503"),
+    google_exceptions.DeadlineExceeded("timeout"),
+    ConnectionError("reset"),
+])
+def test_transient_failures_are_not_remembered(error):
+    registry = Registry([error, None])
+    with pytest.raises(type(error)):
+        registry.get_model("key")
+    assert registry.get_model("key") is not None
+    stats = registry.stats()
+    assert (stats["failures"], stats["failure_hits"], stats["hits"]) == (1, 0, 0)
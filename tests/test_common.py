@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+from chat_core.common import LRUCache, format_number, is_numeric
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1          # a 變成最近使用
+    cache.put("c", 3)
+    assert cache.get("b") is None and len(cache) == 2
+    assert cache.get_or_build("a", lambda: 0) == 1
+    assert cache.get_or_build("d", lambda: 4) == 4
+
+
+def test_helpers():
+    assert is_numeric(pd.Series([1.5])) and not is_numeric(pd.Series([True]))
+    assert format_number(np.float32(22.3)) == "22.3"
+    assert format_number(3.0) == "3"
+    assert format_number("Female") == "Female"
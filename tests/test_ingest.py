@@ -0,0 +1,118 @@
+import io
+import threading
+
+import pandas as pd
+import pytest
+
+from chat_core import ingest
+from chat_core.ingest import HAS_PYARROW, FrameCache, read_csv_chunked
+
+
+def _csv(rows):
+    return io.BytesIO(("Gender,Name,Height_cm\n" + "".join(f"{g},{n},{h}\n" for g, n, h in rows)).encode())
+
+
+def test_chunked_read_keeps_low_cardinality_columns_categorical():
+    # 第二塊只有一列、基數比例 1.0，單獨判斷時不會轉成 category
+    rows = [("Female", f"p{i}", 160 + i) for i in range(4)] + [("Male", "p4", 180)]
+    df = read_csv_chunked(_csv(rows), chunk_rows=4)
+    assert isinstance(df["Gender"].dtype, pd.CategoricalDtype)
+    assert set(df["Gender"].cat.categories) == {"Female", "Male"}
+    assert not isinstance(df["Name"].dtype, pd.CategoricalDtype)
+    assert df["Height_cm"].tolist() == [160, 161, 162, 163, 180]
+
+
+def test_chunked_read_merges_chunks_with_missing_categories():
+    rows = [("Female", "a", 160), ("Female", "a", 161), ("", "", 170)]
+    df = read_csv_chunked(_csv(rows), chunk_rows=2)
+    assert isinstance(df["Gender"].dtype, pd.CategoricalDtype)
+    assert df["Gender"].isna().tolist() == [False, False, True]
+
+
+class Upload:
+    """模擬 Streamlit 的 UploadedFile，記錄內容被取出幾次。"""
+
+    def __init__(self, data, file_id):
+        self.data = data
+        self.file_id = file_id
+        self.size = len(data)
+        self.reads = 0
+
+    def getvalue(self):
+        self.reads += 1
+        return self.data
+
+
+def test_upload_hash_is_memoized_by_file_id():
+    cache = FrameCache(spill_dir=None)
+    upload = Upload(b"a,b\n1,x\n2,y\n", "file-1")
+    df, key = cache.load_upload(upload)
+    assert cache.load_upload(upload) == (df, key)
+    assert upload.reads == 1
+    # 另一個上傳的同內容檔案共用解析結果
+    assert cache.load_upload(Upload(upload.data, "file-2"))[1] == key
+
+
+@pytest.mark.skipif(not HAS_PYARROW, reason="落地需要 pyarrow")
+def test_spill_dir_evicts_least_recently_used_files(tmp_path):
+    cache = FrameCache(spill_dir=str(tmp_path), spill_budget=1)
+    _, first = cache.load_bytes(b"a\n1\n")
+    _, second = cache.load_bytes(b"a\n2\n")
+    assert sorted(p.name for p in tmp_path.iterdir()) == [f"{second}.parquet"]
+    assert cache.stats()["spill_evictions"] == 1
+    assert first != second
+
+
+def test_concurrent_path_loads_parse_once(tmp_path, monkeypatch):
+    path = tmp_path / "data.csv"
+    path.write_text("a,b\n1,x\n2,y\n")
+    cache = FrameCache(spill_dir=None)
+    parses = []
+    started = threading.Event()
+    release = threading.Event()
+    original = ingest.read_csv_chunked
+
+    def slow_read(*args, **kwargs):
+        parses.append(1)
+        started.set()
+        release.wait(5)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(ingest, "read_csv_chunked", slow_read)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.load_path(str(path)))) for _ in range(4)]
+    threads[0].start()
+    assert started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(parses) == 1
+    assert len({key for _, key in results}) == 1 and len(results) == 4
+    assert not cache._loading
+
+
+def test_path_hashes_are_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_PATH_HASHES", 2)
+    cache = FrameCache(spill_dir=None)
+    for i in range(3):
+        path = tmp_path / f"{i}.csv"
+        path.write_text(f"a\n{i}\n")
+        cache.load_path(str(path))
+    assert [p.rsplit("/", 1)[-1] for p, _, _ in cache._path_hashes] == ["1.csv", "2.csv"]
+
+
+def test_frame_cache_limits_come_from_env(monkeypatch):
+    monkeypatch.setattr(ingest, "_cache", None)
+    monkeypatch.setenv("CHAT_MAX_ROWS", "10")
+    monkeypatch.setenv("CHAT_MAX_BYTES", "2048")
+    cache = ingest.get_frame_cache()
+    assert (cache.max_rows, cache.max_bytes) == (10, 2048)
+    with pytest.raises(ingest.IngestError):
+        cache.load_bytes(b"a\n" + b"1\n" * 2048)
+
+    monkeypatch.setattr(ingest, "_cache", None)
+    monkeypatch.setenv("CHAT_MAX_ROWS", "0")
+    with pytest.raises(ValueError, match="CHAT_MAX_ROWS"):
+        ingest.get_frame_cache()
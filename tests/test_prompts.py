@@ -0,0 +1,12 @@
+import pytest
+
+from chat_core.prompts import heuristic_title
+
+
+@pytest.mark.parametrize("question, title", [
+    ("請問 Female 的平均鞋碼？", "Female 的平均"),
+    ("shoe   size\nby gender", "shoe size"),
+    ("身高，體重。", "身高體重"),
+])
+def test_heuristic_title_keeps_single_spaces(question, title):
+    assert heuristic_title(question) == title
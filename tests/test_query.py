@@ -0,0 +1,117 @@
+import asyncio
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from chat_core.pipeline import prepare_data, prepare_data_async
+from chat_core.query import QueryError, run_query, validate_spec
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        "Gender": ["Female", "Male", "Female", "Male"],
+        "Height_cm": [160, 180, 165, 175],
+        "Shoe size_cm": [23.5, 28.0, 24.0, 27.0],
+    })
+
+
+class PlannerModel:
+    """規劃呼叫時丟出 ``error`` 或回傳 ``text``。"""
+
+    def __init__(self, text='{"op": "describe"}', error=None):
+        self.text = text
+        self.error = error
+
+    def generate_content(self, prompt, **kwargs):
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace(text=self.text)
+
+    async def generate_content_async(self, prompt, **kwargs):
+        return self.generate_content(prompt, **kwargs)
+
+
+# === 查詢規格檢查 ===
+@pytest.mark.parametrize("spec", [
+    {"op": "drop_table"},
+    {"op": "agg", "columns": ["Password"]},
+    {"op": "agg", "groupby": ["Nope"]},
+    {"op": "agg", "funcs": ["__import__"]},
+    {"op": "count", "filters": [{"column": "Nope", "op": "==", "value": 1}]},
+    {"op": "count", "filters": [{"column": "Gender", "op": "like", "value": "F%"}]},
+    {"op": "count", "filters": [{"column": "Height_cm", "op": "between", "value": 170}]},
+    {"op": "predict", "target": "Nope", "inputs": {"Height_cm": 170}},
+    "describe",
+    # 篩選值
+    {"op": "count", "filters": [{"column": "Height_cm", "op": ">"}]},
+    {"op": "count", "filters": [{"column": "Height_cm", "op": ">", "value": None}]},
+    {"op": "count", "filters": [{"column": "Height_cm", "op": ">", "value": "tall"}]},
+    {"op": "count", "filters": [{"column": "Height_cm", "op": "==", "value": [170]}]},
+    {"op": "count", "filters": [{"column": "Gender", "op": "==", "value": {"$ne": 1}}]},
+    {"op": "count", "filters": [{"column": "Height_cm", "op": "in", "value": [170, "x"]}]},
+    {"op": "predict", "target": "Shoe size_cm", "inputs": {"Height_cm": 170},
+     "filters": [{"column": "Height_cm", "op": "between", "value": ["low", 180]}]},
+    {"op": "chart", "kind": "histogram", "x": "Height_cm",
+     "filters": [{"column": "Height_cm", "op": "<", "value": "short"}]},
+])
+def test_validate_spec_rejects_unknown_columns_and_ops(df, spec):
+    with pytest.raises(QueryError):
+        validate_spec(df, spec)
+
+
+def test_run_query_filters_and_groups(df):
+    result = run_query(df, {
+        "op": "agg", "filters": [{"column": "Height_cm", "op": ">", "value": 162}],
+        "groupby": ["Gender"], "columns": ["Shoe size_cm"], "funcs": ["mean"],
+    })
+    assert result.matched_rows == 3
+    assert result.table.loc["Male", "Shoe size_cm_mean"] == 27.5
+
+
+@pytest.mark.parametrize("value", ["很高", "180cm", None, [180], float("nan")])
+def test_predict_rejects_non_numeric_inputs_for_numeric_columns(df, value):
+    spec = {"op": "predict", "target": "Shoe size_cm", "inputs": {"Height_cm": value}}
+    with pytest.raises(QueryError, match="Height_cm"):
+        validate_spec(df, spec)
+
+
+def test_predict_accepts_numeric_strings_and_categories(df):
+    spec = validate_spec(df, {"op": "predict", "target": "Shoe size_cm",
+                              "inputs": {"Height_cm": "172", "Gender": "Female"}})
+    assert spec["inputs"] == {"Height_cm": "172", "Gender": "Female"}
+
+
+def test_run_query_turns_mask_failures_into_query_error(df):
+    # 分類欄位與數字比大小在篩選時才會失敗
+    spec = {"op": "chart", "kind": "histogram", "x": "Height_cm",
+            "filters": [{"column": "Gender", "op": ">", "value": 3}]}
+    with pytest.raises(QueryError):
+        run_query(df.astype({"Gender": "category"}), spec)
+
+
+# === 規劃失敗時退回資料概況 ===
+@pytest.mark.parametrize("model", [
+    PlannerModel(text="沒有 JSON"),
+    PlannerModel(text='{"op": "agg", "columns": ["Nope"]}'),
+    PlannerModel(error=TimeoutError("plan timed out")),
+    PlannerModel(error=ValueError("response was blocked")),
+])
+def test_prepare_data_falls_back_to_profile(df, model):
+    profile, query_result, rows = prepare_data(model, df, None, "Female 的平均鞋碼")
+    assert query_result is None
+    assert profile is not None and profile.rows == len(df)
+    assert rows is not None and set(rows.table["Gender"]) == {"Female"}
+
+
+def test_prepare_data_async_falls_back_to_profile(df):
+    model = PlannerModel(error=TimeoutError("plan timed out"))
+    profile, query_result, _ = asyncio.run(prepare_data_async(model, df, None, "平均鞋碼"))
+    assert query_result is None and profile is not None
+
+
+def test_prepare_data_uses_query_result(df):
+    profile, query_result, rows = prepare_data(PlannerModel(), df, None, "平均鞋碼")
+    assert query_result is not None and query_result.matched_rows == len(df)
+    assert rows is None
@@ -0,0 +1,47 @@
+import pytest
+
+from chat_core.response_cache import ResponseCache, question_signature, scoped_context
+
+MODEL = "models/test"
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(":memory:")
+
+
+def test_exact_hit_ignores_case_width_and_trailing_punctuation(cache):
+    cache.put(MODEL, "Female 的平均鞋碼？", "23.8", "data")
+    hit = cache.get(MODEL, "ｆｅｍａｌｅ 的平均鞋碼", "data")
+    assert hit is not None and hit.tier == "exact" and hit.answer == "23.8"
+
+
+def test_paraphrase_is_a_near_hit(cache):
+    cache.put(MODEL, "身高 170 的女生平均鞋碼是多少", "24", "data")
+    hit = cache.get(MODEL, "請問身高 170 的女生平均鞋碼是多少呢", "data")
+    assert hit is not None and hit.tier == "near"
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("身高 170 的人平均鞋碼是多少", "身高 180 的人平均鞋碼是多少"),
+    ("男生的平均鞋碼是多少", "女生的平均鞋碼是多少"),
+    ("身高超過 170 的人有幾位", "身高不超過 170 的人有幾位"),
+    ("average shoe size of men", "average shoe size of women"),
+])
+def test_questions_that_differ_in_numbers_groups_or_negation_miss(cache, cached, asked):
+    cache.put(MODEL, cached, "answer", "data")
+    assert cache.get(MODEL, asked, "data") is None
+
+
+def test_question_signature():
+    assert question_signature("身高不超過 170.5 的男生") == (("170.5",), ("不", "超過", "男"))
+
+
+def test_scope_separates_dataset_model_and_settings(cache):
+    topic = scoped_context("主題是「鞋碼」。", "topic", True)
+    cache.put(MODEL, "平均鞋碼", "24", "data", topic)
+    assert cache.get(MODEL, "平均鞋碼", "data", topic) is not None
+    assert cache.get(MODEL, "平均鞋碼", "other", topic) is None
+    assert cache.get("models/other", "平均鞋碼", "data", topic) is None
+    assert cache.get(MODEL, "平均鞋碼", "data", scoped_context("主題是「鞋碼」。", "topic", False)) is None
+    assert cache.get(MODEL, "平均鞋碼", "data", scoped_context("主題是「鞋碼」。", "plain", True)) is None
@@ -0,0 +1,33 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from chat_core.retrieval import RowIndex, expand_question
+
+SHOE_SIZE = Path(__file__).resolve().parent.parent / "ShoeSize.csv"
+
+
+@pytest.fixture(scope="module")
+def shoe_index():
+    return RowIndex(pd.read_csv(SHOE_SIZE))
+
+
+def test_expand_question_maps_chinese_terms():
+    assert expand_question("女生的平均身高").split()[1:] == ["female", "woman", "women", "girl", "height"]
+    assert expand_question("average height") == "average height"
+
+
+@pytest.mark.parametrize("question, gender", [("身高 175 公分的女生", "Female"), ("身高 175 公分的男生", "Male")])
+def test_chinese_gender_terms_select_matching_rows(shoe_index, question, gender):
+    table = shoe_index.search(question).table
+    assert (table["Gender"] == gender).mean() >= 0.8
+    assert (table["Height_cm"] - 175).abs().max() <= 5
+
+
+def test_token_budget_counts_rows_not_csv_lines():
+    # 引號內的換行會讓 CSV 多出幾行，但仍然只是一列
+    df = pd.DataFrame({"note": ["first\nsecond\nthird apple", "apple pie"], "n": [1, 2]})
+    rows = RowIndex(df).search("apple", token_budget=1000)
+    assert len(rows.table) == 2
+    assert len(RowIndex(df).search("apple", token_budget=1).table) == 1
@@ -0,0 +1,181 @@
+import asyncio
+import contextvars
+from types import SimpleNamespace
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from chat_core import batch, scheduler, streaming
+from chat_core.scheduler import (
+    PRIORITY_ANSWER, PRIORITY_BACKGROUND, PRIORITY_TITLE, RequestScheduler, StreamInterrupted, TokenBucket,
+    set_session,
+)
+
+
+def fast_scheduler(**kwargs):
+    options = {"rate": 1000.0, "burst": 100, "base_delay": 0.001, "max_delay": 0.004}
+    return RequestScheduler(**{**options, **kwargs})
+
+
+def enqueue(s, session, priority, granted, name):
+    """以 ``session`` 的身分排隊，放行時把 ``name`` 記到 ``granted``。"""
+    def run():
+        set_session(session)
+        return s._enqueue("key", priority, lambda: granted.append(name))
+    return contextvars.copy_context().run(run)
+
+
+def drain(s, count):
+    for _ in range(count):
+        s.release()
+
+
+# === token bucket 與設定 ===
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2.0, capacity=2)
+    now = bucket.updated
+    bucket.take(now)
+    bucket.take(now)
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == 0
+    bucket.take(now + 0.5)
+    bucket.pause(now + 0.5, 3.0)
+    assert bucket.delay(now + 1.0) == pytest.approx(2.5)
+
+
+@pytest.mark.parametrize("kwargs", [{"rate": 0}, {"rate": -1.0}, {"burst": 0}, {"max_concurrency": 0}])
+def test_scheduler_rejects_invalid_limits(kwargs):
+    with pytest.raises(ValueError):
+        RequestScheduler(**kwargs)
+
+
+def test_env_limits_are_validated(monkeypatch):
+    monkeypatch.setattr(scheduler, "_scheduler", None)
+    monkeypatch.setenv("CHAT_RATE", "0")
+    with pytest.raises(ValueError, match="CHAT_RATE"):
+        scheduler.get_scheduler()
+    monkeypatch.setenv("CHAT_RATE", "2.5")
+    monkeypatch.setenv("CHAT_BURST", "3")
+    assert (scheduler.get_scheduler().rate, scheduler.get_scheduler().burst) == (2.5, 3)
+
+
+@pytest.mark.parametrize("flags", [["--rate", "0"], ["--rate", "-1"], ["--burst", "0"]])
+def test_batch_rejects_invalid_rate_flags(tmp_path, flags):
+    with pytest.raises(SystemExit):
+        batch.main([str(tmp_path / "q.txt"), "--fake", *flags])
+
+
+# === 排隊順序 ===
+def test_priorities_answer_before_title_before_background():
+    s = fast_scheduler(max_concurrency=1)
+    s.acquire("key")
+    granted = []
+    enqueue(s, "a", PRIORITY_BACKGROUND, granted, "background")
+    enqueue(s, "b", PRIORITY_TITLE, granted, "title")
+    enqueue(s, "c", PRIORITY_ANSWER, granted, "answer")
+    drain(s, 3)
+    assert granted == ["answer", "title", "background"]
+
+
+def test_sessions_take_turns_within_a_priority():
+    s = fast_scheduler(max_concurrency=1)
+    s.acquire("key")
+    granted = []
+    for i in range(3):
+        enqueue(s, "busy", PRIORITY_ANSWER, granted, f"busy{i}")
+    enqueue(s, "other", PRIORITY_ANSWER, granted, "other")
+    drain(s, 4)
+    assert granted == ["busy0", "other", "busy1", "busy2"]
+
+
+def test_queue_wait_times_out():
+    s = fast_scheduler(max_concurrency=1)
+    s.acquire("key")
+    with pytest.raises(TimeoutError):
+        s.acquire("key", max_wait=0.01)
+    assert s.stats()["timeouts"] == 1 and s.stats()["queued"] == 0
+
+
+# === 重試 ===
+def flaky(errors, result="ok"):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return fn, calls
+
+
+def test_transient_errors_are_retried():
+    s = fast_scheduler()
+    fn, calls = flaky([google_exceptions.ServiceUnavailable("x"), google_exceptions.InternalServerError("x")])
+    assert s.call("key", fn) == "ok"
+    assert len(calls) == 3 and s.retries == 2 and s.stats()["active"] == 0
+
+
+def test_retries_give_up_after_max_retries():
+    s = fast_scheduler(max_retries=2)
+    fn, calls = flaky([google_exceptions.ServiceUnavailable("x")] * 5)
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        s.call("key", fn)
+    assert len(calls) == 3 and s.failures == 1
+
+
+def test_backoff_is_exponential_with_jitter():
+    s = RequestScheduler(base_delay=1.0, max_delay=8.0, max_retries=10)
+    for attempt, ceiling in [(0, 1.0), (1, 2.0), (2, 4.0), (3, 8.0), (6, 8.0)]:
+        delays = {s._backoff("key", google_exceptions.ServiceUnavailable("x"), attempt) for _ in range(20)}
+        assert all(ceiling / 2 <= d <= ceiling for d in delays)
+        assert len(delays) > 1
+
+
+def test_throttling_pauses_the_whole_key():
+    s = RequestScheduler(base_delay=1.0)
+    assert s._backoff("key", google_exceptions.TooManyRequests("x"), 0) == 0.0
+    assert s._bucket("key").delay(scheduler.time.monotonic()) >= 0.5
+    assert s._bucket("other").delay(scheduler.time.monotonic()) == 0
+    assert s.throttled == 1
+
+
+def test_non_retryable_errors_are_raised_once():
+    s = fast_scheduler()
+    fn, calls = flaky([ValueError("blocked")])
+    with pytest.raises(ValueError):
+        s.call("key", fn)
+    assert len(calls) == 1 and s.retries == 0
+
+
+class BrokenStream:
+    """串流送出一段文字後斷線。"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        self.calls += 1
+        yield SimpleNamespace(text="部分")
+        raise google_exceptions.ServiceUnavailable("connection reset")
+
+
+def test_interrupted_stream_is_not_retried(monkeypatch):
+    s = fast_scheduler()
+    monkeypatch.setattr(streaming, "get_scheduler", lambda: s)
+    model = BrokenStream()
+    with pytest.raises(StreamInterrupted):
+        streaming.generate_text(model, "hi", stream=True)
+    assert model.calls == 1 and s.retries == 0
+
+
+def test_call_async_retries():
+    s = fast_scheduler()
+    errors = [google_exceptions.ServiceUnavailable("x")]
+
+    async def fn():
+        if errors:
+            raise errors.pop()
+        return "ok"
+
+    assert asyncio.run(s.call_async("key", fn)) == "ok"
+    assert s.retries == 1
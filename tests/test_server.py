@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from google.api_core import exceptions as google_exceptions
+
+from chat_core import server
+from chat_core.context import ContextManager
+from chat_core.fake import FakeGenerativeModel, FakeModelRegistry
+from chat_core.ingest import FrameCache
+from chat_core.response_cache import ResponseCache
+from chat_core.store import ConversationStore
+
+KEY = {"X-Api-Key": "key"}
+
+
+class Registry(FakeModelRegistry):
+    """金鑰 ``bad`` 無效、``flaky`` 驗證時服務暫時無法使用，其他金鑰都回傳替身模型。"""
+
+    def get_model(self, api_key, validate=True):
+        if api_key == "bad":
+            raise google_exceptions.InvalidArgument("API key not valid")
+        if api_key == "flaky":
+            raise google_exceptions.ServiceUnavailable("try again")
+        return self.model
+
+
+@pytest.fixture
+def backend():
+    store = ConversationStore(":memory:")
+    return server.ChatBackend(
+        registry=Registry(FakeGenerativeModel(latency=0, chunk_rate=1000)), store=store,
+        contexts=ContextManager(store), frames=FrameCache(spill_dir=None), responses=ResponseCache(":memory:"),
+    )
+
+
+def request(backend, method, path, require_client_key=False, **kwargs):
+    """送出一個請求，回傳 (狀態碼, JSON 內容)。"""
+    async def run():
+        app = server.create_app(backend, require_client_key=require_client_key)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.request(method, path, **kwargs)
+            return response.status, await response.json(content_type=None)
+    return asyncio.run(run())
+
+
+def test_chat_answers_and_lists_turns_for_owner_only(backend):
+    status, result = request(backend, "POST", "/api/chat", json={"uid": "alice", "message": "你好"}, headers=KEY)
+    assert status == 200 and result["answer"]
+    topic = result["topic_id"]
+
+    assert request(backend, "GET", f"/api/topics/{topic}/turns?uid=alice")[0] == 200
+    assert request(backend, "GET", f"/api/topics/{topic}/turns?uid=mallory")[0] == 404
+    status, _ = request(backend, "POST", "/api/chat", json={"uid": "mallory", "message": "hi", "topic_id": topic},
+                        headers=KEY)
+    assert status == 404
+
+
+@pytest.mark.parametrize("path", [
+    "/api/topics?uid=alice&page=abc",
+    "/api/topics/x/turns?uid=alice&limit=ten",
+    "/api/topics/x/turns?uid=alice&before=1.5",
+])
+def test_bad_int_query_params_are_rejected(backend, path):
+    assert request(backend, "GET", path)[0] == 400
+
+
+@pytest.mark.parametrize("body", [[1, 2], "hi", {"uid": "alice"}, {"uid": "alice", "message": ["hi"]},
+                                  {"uid": "alice", "message": "hi", "topic_id": 3}])
+def test_chat_rejects_malformed_bodies(backend, body):
+    status, result = request(backend, "POST", "/api/chat", json=body, headers=KEY)
+    assert status == 400 and "error" in result
+
+
+def test_chat_stream_maps_errors_to_status_codes(backend):
+    body = {"uid": "alice", "message": "平均身高"}
+    status, result = request(backend, "POST", "/api/chat/stream", json=body, headers={"X-Api-Key": "bad"})
+    assert (status, result["code"]) == (401, "auth")
+    # 暫時性錯誤不是金鑰的問題，前端不應要求重新輸入金鑰
+    status, result = request(backend, "POST", "/api/chat/stream", json=body, headers={"X-Api-Key": "flaky"})
+    assert (status, result["code"]) == (500, "server")
+    status, _ = request(backend, "POST", "/api/chat/stream", json={**body, "dataset_hash": "missing"}, headers=KEY)
+    assert status == 409
+    # 資料不存在時不建立主題
+    assert backend.store.count_topics("alice") == 0
+
+
+def test_public_binding_requires_client_key(backend, monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "server-key")
+    body = {"uid": "alice", "message": "你好"}
+    assert request(backend, "POST", "/api/chat", json=body)[0] == 200
+    assert request(backend, "POST", "/api/chat", require_client_key=True, json=body)[0] == 401
+
+
+def test_backend_summarizes_against_its_own_store(backend):
+    assert backend.contexts.store is backend.store
+
+
+def test_async_models_are_cached_by_the_registry():
+    from chat_core.client import ModelRegistry
+
+    class Registry(ModelRegistry):
+        def build_async_model(self, api_key):
+            return object()
+
+    registry = Registry(max_entries=2)
+
+    async def run():
+        first = registry.get_async_model("a")
+        assert registry.get_async_model("a") is first
+        registry.get_async_model("b")
+        registry.get_async_model("c")
+        return len(registry._async_entries)
+
+    assert asyncio.run(run()) == 2